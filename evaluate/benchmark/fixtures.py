@@ -0,0 +1,138 @@
+from typing import Optional
+import ast
+import json
+import random
+import re
+
+from rag.type import Chunk
+from rag import util
+from evaluate.prepare.context import context as recorded_context
+
+_CHUNK_PATTERN = re.compile(r"CHUNK \((.*?)\)\n\(\n.*?TEXT=\n(.*?)\nMETADATA=\n(\{.*?\n\})\n\)", re.DOTALL)
+
+def load_recorded_chunks() -> list[Chunk]:
+    """Chunks recorded in `evaluate/prepare/context.py`, retrieved from the production index"""
+    chunks: dict[str, Chunk] = {}
+    for ctx in recorded_context:
+        for context_type in ["base", "additional"]:
+            for chunk_id, text, metadata in _CHUNK_PATTERN.findall(ctx[context_type]["text"]):
+                metadata = ast.literal_eval(metadata)
+                doc_meta = metadata["document_metadata"]
+                chunks[chunk_id] = Chunk(
+                    text=" ".join(text.split()),
+                    doc_id=doc_meta["uri"],
+                    chunk_id=chunk_id,
+                    doc_meta=util.remove_falsy({
+                        "doc_name": doc_meta["doc_name"],
+                        "doc_type": doc_meta["doc_type"],
+                        "version": doc_meta.get("version"),
+                        "base_doc_id": metadata["chunk_metadata"].get("base_doc_id"),
+                    }),
+                )
+    return list(chunks.values())
+
+def _windows(words: list[str], size: int, stride: int) -> list[list[str]]:
+    return [words[i:i + size] for i in range(0, max(len(words) - size, 0) + 1, stride)]
+
+def split_parent(chunk: Chunk, parent_words: int) -> list[Chunk]:
+    words = chunk.text.split()
+    return [
+        Chunk(
+            text=" ".join(words[i:i + parent_words]),
+            doc_id=chunk.doc_id,
+            chunk_id=f"{chunk.chunk_id}:{i // parent_words}",
+            doc_meta=chunk.doc_meta,
+            chunk_meta={"page": 1},
+        )
+        for i in range(0, len(words), parent_words)
+    ]
+
+def split_children(parent: Chunk, child_words: int) -> list[Chunk]:
+    """Overlapping windows of the parent, linked by `parent_id`, as the multivector ingestor does"""
+    return [
+        Chunk(
+            text=" ".join(window),
+            doc_id=parent.doc_id,
+            chunk_id=f"{parent.chunk_id}:child:{i}",
+            doc_meta=parent.doc_meta,
+            chunk_meta={"page": 1, "parent_id": parent.chunk_id},
+        )
+        for i, window in enumerate(_windows(parent.text.split(), child_words, max(child_words * 3 // 4, 1)))
+    ]
+
+def distractor_documents(chunks: list[Chunk], num_docs: int, seed: int = 0) -> list[Chunk]:
+    """Synthetic documents shuffled from the vocabulary of the recorded chunks, to scale the corpus up"""
+    rng = random.Random(seed)
+    vocabulary = [word for chunk in chunks for word in chunk.text.split()]
+    distractors = []
+    for i in range(num_docs):
+        doc_id = f"distractor://doc_{i}.pdf"
+        doc_type = "base" if i % 2 == 0 else "additional"
+        distractors.append(Chunk(
+            text=" ".join(rng.choices(vocabulary, k=300)),
+            doc_id=doc_id,
+            chunk_id=f"distractor_{i}",
+            doc_meta=util.remove_falsy({
+                "doc_name": f"doc_{i}.pdf",
+                "doc_type": doc_type,
+                "base_doc_id": "*" if doc_type == "additional" else None,
+            }),
+        ))
+    return distractors
+
+class Corpus:
+    """Parent and child chunks of the benchmark, with the queries and their expected parents.
+    Queries are word windows of the recorded parents, so that each has a known answer.
+
+    Args:
+        parent_words (int): words per parent chunk
+        child_words (int): words per child chunk
+        num_distractors (int): number of synthetic documents added to the recorded ones
+        query_words (int): words per query
+        seed (int): seed of the distractors
+    """
+    def __init__(
+        self,
+        parent_words: int = 120,
+        child_words: int = 32,
+        num_distractors: int = 200,
+        query_words: int = 12,
+        seed: int = 0,
+    ) -> None:
+        recorded = load_recorded_chunks()
+        self.parents: list[Chunk] = []
+        self.queries: list[dict] = []
+        for chunk in recorded:
+            for parent in split_parent(chunk, parent_words):
+                self.parents.append(parent)
+                words = parent.text.split()
+                if len(words) < query_words * 2:
+                    continue
+                # middle of the parent, so that the query is not aligned with the child windows
+                start = (len(words) - query_words) // 2
+                self.queries.append({
+                    "question": " ".join(words[start:start + query_words]),
+                    "expected_doc_ids": [parent.doc_id],
+                    "expected_chunk_ids": [parent.chunk_id],
+                })
+
+        for distractor in distractor_documents(recorded, num_distractors, seed=seed):
+            self.parents.extend(split_parent(distractor, parent_words))
+        self.children: list[Chunk] = [child for parent in self.parents for child in split_children(parent, child_words)]
+
+    def load_reference(self, reference_path: str, num_samples: Optional[int] = None) -> None:
+        """Replay the questions of a reference set (see `cold_start`) instead, expecting the documents of their contexts"""
+        with open(reference_path, "r") as f:
+            reference = json.load(f)
+        self.queries = [
+            {
+                "question": data["question"],
+                "expected_doc_ids": [
+                    source["doc_id"]
+                    for context_type in ["base", "additional"]
+                    for source in data["context"][context_type]["source"]
+                ],
+                "expected_chunk_ids": [],
+            }
+            for data in reference["data"][:num_samples]
+        ]
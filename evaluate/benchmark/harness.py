@@ -0,0 +1,242 @@
+from typing import Optional, Callable, Any
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from wasabi import msg
+import io
+import os
+import time
+import tracemalloc
+
+from rag.rag_manager import RAGManager
+from rag.config import RAGConfig
+from rag.type import Chunk
+from rag.component import llm, embeddings, tracing
+from rag.component.vectorstore.vectorstore import get_vectorstore
+from rag.component.tracing.report import stage_stats, percentile
+from evaluate.benchmark.fixtures import Corpus
+from evaluate.benchmark.stubs import StubEmbeddings, FakeChatModel
+
+STUB_EMBEDDINGS = "stub-embeddings"
+FAKE_TRANSFORMER = "fake-transformer"
+FAKE_GENERATOR = "fake-generator"
+
+def install_stubs(
+    queries: list[str],
+    embedding_latency: float = 0.0,
+    llm_ttft: float = 0.0,
+    token_latency: float = 0.0,
+    response_tokens: int = 128,
+) -> None:
+    """Register the stub embeddings and the fake LLMs, so that the managers resolve them by name"""
+    stub_embeddings = StubEmbeddings(latency=embedding_latency)
+    embeddings.register_model(STUB_EMBEDDINGS, lambda **kwargs: stub_embeddings)
+    llm.register_model(FAKE_TRANSFORMER, lambda **kwargs: FakeChatModel(ttft=llm_ttft, known_queries=queries))
+    llm.register_model(FAKE_GENERATOR, lambda **kwargs: FakeChatModel(
+        ttft=llm_ttft, token_latency=token_latency, response_tokens=response_tokens, known_queries=queries
+    ))
+
+def benchmark_config(workdir: str, **overrides: dict) -> RAGConfig:
+    """Pipeline configuration resolving every model to the stubs, with the local vectorstore in `workdir`"""
+    stores = {"vectorstore": "local", "local_path": os.path.join(workdir, "vectorstore"), "embeddings": STUB_EMBEDDINGS}
+    config = {
+        "global": {
+            "lang": {"user": "English", "source": "English", "assistant": "English"},
+            "trace_path": os.path.join(workdir, "traces.sqlite"),
+        },
+        "ingestion": {**stores, "manifest_path": None},
+        "transformation": {"model": FAKE_TRANSFORMER},
+        "retrieval": {**stores, "retriever": ["pinecone-multivector"]},
+        "generation": {"model": FAKE_GENERATOR},
+        "fact_verification": {"model": FAKE_TRANSFORMER},
+    }
+    for stage, stage_config in overrides.items():
+        config.setdefault(stage, {}).update(stage_config)
+    return RAGConfig(**config)
+
+def ingest_corpus(corpus: Corpus, config: RAGConfig) -> None:
+    embedding_model = embeddings.get_model(STUB_EMBEDDINGS)
+    for namespace, chunks in [(config.retrieval.namespace, corpus.parents), (config.retrieval.sub_namespace, corpus.children)]:
+        vectorstore = get_vectorstore(
+            "local", embeddings=embedding_model, namespace=namespace, local_path=config.retrieval.local_path
+        )
+        if len(vectorstore) != len(chunks):
+            vectorstore.ingest(chunks)
+
+@contextmanager
+def quiet(enable: bool = True):
+    """Silence the logs of the pipeline while measuring"""
+    if not enable:
+        yield
+        return
+    no_print = msg.no_print
+    msg.no_print = True
+    try:
+        with redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        msg.no_print = no_print
+
+def retrieval_metrics(queries: list[dict], results: list[list[Chunk]]) -> dict[str, float]:
+    """Recall of the expected documents and chunks, and MRR of the first expected chunk"""
+    doc_hits, chunk_hits, chunk_total, reciprocal_ranks = 0, 0, 0, []
+    for query, chunks in zip(queries, results):
+        doc_ids = {chunk.doc_id for chunk in chunks}
+        doc_hits += any(doc_id in doc_ids for doc_id in query["expected_doc_ids"])
+        if query["expected_chunk_ids"]:
+            chunk_total += 1
+            ranks = [i for i, chunk in enumerate(chunks, start=1) if chunk.chunk_id in query["expected_chunk_ids"]]
+            chunk_hits += bool(ranks)
+            reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+    return {
+        "doc_recall": doc_hits / len(queries) if queries else 0.0,
+        "chunk_recall": chunk_hits / chunk_total if chunk_total else 0.0,
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks) if reciprocal_ranks else 0.0,
+    }
+
+def run_phase(
+    name: str,
+    func: Callable[[str], list[Chunk]],
+    queries: list[dict],
+    concurrency: int = 1,
+    trace_allocations: bool = False,
+) -> dict[str, Any]:
+    """Replay the queries through `func` with `concurrency` callers, and measure the throughput,
+    the latency per query and per stage, and optionally the allocations
+
+    Returns:
+        dict[str, Any]: report of the phase
+    """
+    def _timed(query: dict) -> tuple[list[Chunk], float]:
+        start = time.perf_counter()
+        chunks = func(query["question"])
+        return chunks, time.perf_counter() - start
+
+    if trace_allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+    since = time.time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_timed, queries))
+    elapsed = time.perf_counter() - start
+
+    report: dict[str, Any] = {"name": name, "queries": len(queries), "concurrency": concurrency}
+    if trace_allocations:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        diffs = after.compare_to(before, "lineno")
+        report["allocations"] = {
+            "peak_kb": peak / 1024,
+            "net_kb": sum(diff.size_diff for diff in diffs) / 1024,
+            "net_blocks": sum(diff.count_diff for diff in diffs),
+            "top": [
+                {"site": str(diff.traceback[0]), "kb": diff.size_diff / 1024, "blocks": diff.count_diff}
+                for diff in diffs[:5]
+            ],
+        }
+
+    latencies = sorted(latency for _, latency in results)
+    tracer = tracing.get_tracer()
+    spans = tracer.store.read(since=since) if tracer.enabled else []
+    report.update({
+        "qps": len(queries) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        **retrieval_metrics(queries, [chunks for chunks, _ in results]),
+        "stages": stage_stats(spans),
+    })
+    return report
+
+def run_benchmark(
+    workdir: str,
+    corpus: Corpus,
+    concurrency: list[int],
+    phases: list[str] = ["retrieval", "end_to_end"],
+    verbose: bool = False,
+    trace_allocations: bool = False,
+    config_overrides: Optional[dict[str, dict]] = None,
+    **stub_kwargs: Any,
+) -> list[dict[str, Any]]:
+    """Replay the query set of the corpus through `RetrieverManager` and `RAGManager` with the stub backends
+
+    Args:
+        workdir (str): directory of the local vectorstore and the traces. Reused across runs
+        corpus (Corpus): chunks and queries
+        concurrency (list[int]): numbers of concurrent callers to measure
+        phases (list[str]): "retrieval" for the retriever alone, "end_to_end" for transformation, retrieval, generation and verification
+        verbose (bool): print the logs of the pipeline
+        trace_allocations (bool): measure the allocations with tracemalloc. Slows the run down
+        config_overrides (Optional[dict[str, dict]]): overrides of the pipeline configuration, by stage
+        stub_kwargs: latencies of the stubs. See `install_stubs`
+    """
+    install_stubs([query["question"] for query in corpus.queries], **stub_kwargs)
+    config = benchmark_config(workdir, **(config_overrides or {}))
+    ingest_corpus(corpus, config)
+
+    rag_manager = RAGManager()
+    with quiet(not verbose):
+        rag_manager.set_config(config)
+    retriever = rag_manager.managers["retrieval"]
+
+    def _retrieve(question: str) -> list[Chunk]:
+        return retriever.retrieve({"query": question})
+
+    def _query(question: str) -> list[Chunk]:
+        # same stages as `rag.api.query_stream`
+        with tracing.span("query"):
+            queries, chunks = rag_manager.transform_and_retrieve(question, [])
+            response = "".join(rag_manager.generate_stream(queries["translation"], [], chunks))
+            rag_manager.verify_fact(response, chunks)
+        return chunks
+
+    funcs = {"retrieval": _retrieve, "end_to_end": _query}
+    reports = []
+    for phase in phases:
+        # warm up the lazy initializations, out of the measurement
+        with quiet(not verbose):
+            funcs[phase](corpus.queries[0]["question"])
+        for n in concurrency:
+            with quiet(not verbose):
+                reports.append(run_phase(phase, funcs[phase], corpus.queries, concurrency=n, trace_allocations=trace_allocations))
+    return reports
+
+def print_reports(reports: list[dict[str, Any]], baseline: Optional[list[dict[str, Any]]] = None) -> None:
+    baseline_by_key = {(r["name"], r["concurrency"]): r for r in baseline or []}
+
+    def _delta(report: dict, key: str) -> str:
+        base = baseline_by_key.get((report["name"], report["concurrency"]))
+        if base is None or not base.get(key):
+            return ""
+        return f" ({(report[key] - base[key]) / base[key]:+.1%})"
+
+    rows = [
+        [
+            r["name"], r["concurrency"], r["queries"],
+            f"{r['qps']:.1f}{_delta(r, 'qps')}",
+            f"{r['p50'] * 1000:.1f}", f"{r['p95'] * 1000:.1f}{_delta(r, 'p95')}", f"{r['p99'] * 1000:.1f}",
+            f"{r['doc_recall']:.3f}{_delta(r, 'doc_recall')}", f"{r['chunk_recall']:.3f}{_delta(r, 'chunk_recall')}", f"{r['mrr']:.3f}",
+        ]
+        for r in reports
+    ]
+    msg.table(rows, header=["phase", "concurrency", "queries", "QPS", "p50 ms", "p95 ms", "p99 ms", "doc recall", "chunk recall", "MRR"], divider=True)
+
+    for r in reports:
+        msg.divider(f"{r['name']} x{r['concurrency']}: stages")
+        msg.table(
+            [
+                [name, s["count"], "ms", f"{s['p50'] * 1000:.1f}", f"{s['p95'] * 1000:.1f}", f"{s['p99'] * 1000:.1f}"]
+                if not name.endswith("tokens_per_s") else
+                [name, s["count"], "tokens/s", f"{s['p50']:.1f}", f"{s['p95']:.1f}", f"{s['p99']:.1f}"]
+                for name, s in r["stages"].items()
+            ],
+            header=["stage", "count", "unit", "p50", "p95", "p99"],
+            divider=True,
+        )
+        if "allocations" in r:
+            allocations = r["allocations"]
+            msg.info(f"Allocations: peak {allocations['peak_kb']:.0f}KB, net {allocations['net_kb']:.0f}KB in {allocations['net_blocks']} blocks")
+            for top in allocations["top"]:
+                print(f"    {top['kb']:10.1f}KB {top['blocks']:8d} blocks  {top['site']}")
@@ -0,0 +1,121 @@
+from typing import Optional, Any, Iterator, AsyncIterator
+import asyncio
+import hashlib
+import json
+import re
+import time
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+class StubEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings, with the hashing trick.
+    Texts sharing words are close to each other, so that retrieval quality is meaningful without a real model.
+
+    Args:
+        dim (int): dimension of the vectors
+        latency (float): seconds per request, to simulate the round-trip
+    """
+    def __init__(self, dim: int = 384, latency: float = 0.0) -> None:
+        self.dim = dim
+        self.latency = latency
+
+    def _bucket(self, token: str) -> tuple[int, float]:
+        # builtin hash is salted per process. md5 keeps the vectors identical across runs
+        digest = hashlib.md5(token.encode()).digest()
+        return int.from_bytes(digest[:4], "little") % self.dim, 1.0 if digest[4] % 2 else -1.0
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            index, sign = self._bucket(token)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering without network, with configurable latency.
+        - verification prompts get a positive JSON verdict
+        - other prompts get the first known query found in the prompt, padded to `response_tokens` words
+
+    Attributes:
+        ttft (float): seconds until the first token
+        token_latency (float): seconds per generated token
+        response_tokens (int): minimum number of words of the response
+        known_queries (list[str]): queries of the benchmark, echoed back as the transformed queries
+    """
+    ttft: float = 0.0
+    token_latency: float = 0.0
+    response_tokens: int = 0
+    known_queries: list[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _respond(self, messages: list[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if '"verification"' in prompt:
+            return json.dumps({"verification": True, "reasoning": "The response is supported by the context."})
+
+        response = next((query for query in self.known_queries if query in prompt), prompt[-200:])
+        words = response.split()
+        if len(words) < self.response_tokens:
+            words += ["token"] * (self.response_tokens - len(words))
+        return " ".join(words)
+
+    def _result(self, messages: list[BaseMessage], text: str) -> ChatResult:
+        token_usage = {
+            "prompt_tokens": sum(len(str(message.content).split()) for message in messages),
+            "completion_tokens": len(text.split()),
+        }
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": token_usage, "model_name": "fake"},
+        )
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self._respond(messages)
+        time.sleep(self.ttft + self.token_latency * len(text.split()))
+        return self._result(messages, text)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self._respond(messages)
+        await asyncio.sleep(self.ttft + self.token_latency * len(text.split()))
+        return self._result(messages, text)
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.ttft)
+        for i, word in enumerate(self._respond(messages).split()):
+            if i:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.ttft)
+        for i, word in enumerate(self._respond(messages).split()):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
@@ -0,0 +1,58 @@
+from typing import Optional, Any
+import json
+
+from rag.component.cache.base import BaseRAGCache
+from rag import util
+
+class ExperimentCache(BaseRAGCache):
+    """Per-question results of the experiments and the evaluations, keyed by (kind, config hash, question).
+    Results are written as soon as they are computed, so that interrupted runs resume where they stopped,
+    and re-runs only recompute the questions whose config changed.
+        - experiment: output of the pipeline, keyed by the hash of the pipeline config
+        - judge: score of the answer, keyed by the hash of the evaluator, the prompt and both answers
+    """
+    @property
+    def table_name(self) -> str:
+        return "results"
+
+    def _init_tables(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "kind TEXT NOT NULL, "
+            "config_hash TEXT NOT NULL, "
+            "question_hash TEXT NOT NULL, "
+            "output TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (kind, config_hash, question_hash))"
+        )
+
+    def get_many(self, kind: str, config_hash: str, questions: list[str]) -> list[Optional[Any]]:
+        hashes = [util.generate_id(question) for question in questions]
+        found: dict[str, str] = {}
+
+        with self._lock:
+            # sqlite limits the number of host parameters
+            for i in range(0, len(hashes), 500):
+                batch = list(set(hashes[i:i + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT question_hash, output FROM results "
+                    f"WHERE kind = ? AND config_hash = ? AND question_hash IN ({placeholders})",
+                    (kind, config_hash, *batch)
+                ).fetchall()
+                found.update(rows)
+
+        outputs = [json.loads(found[question_hash]) if question_hash in found else None for question_hash in hashes]
+        hits = sum(1 for output in outputs if output is not None)
+        self._count_lookups(hits, len(outputs) - hits)
+        return outputs
+
+    def put(self, kind: str, config_hash: str, question: str, output: Any) -> None:
+        now = self._now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (kind, config_hash, question_hash, output, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, config_hash, util.generate_id(question), json.dumps(output), now, now)
+            )
+            self._conn.commit()
@@ -0,0 +1,70 @@
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse, json, tempfile
+from wasabi import msg
+
+from evaluate.benchmark.fixtures import Corpus
+from evaluate.benchmark.harness import run_benchmark, print_reports
+
+parser = argparse.ArgumentParser(description="Benchmark the retrieval and the pipeline offline, with stub embeddings, a local vectorstore and a fake LLM")
+parser.add_argument("-c", "--concurrency", type=int, nargs="+", metavar="", default=[1, 4, 16], help="Numbers of concurrent callers. Default: 1 4 16")
+parser.add_argument("-p", "--phases", type=str, nargs="+", choices=["retrieval", "end_to_end"], default=["retrieval", "end_to_end"], help="Phases to measure. Default: both")
+parser.add_argument("--workdir", type=str, metavar="", default=None, help="Directory of the local vectorstore and the traces. Reused if provided. Default: temporary directory")
+parser.add_argument("--num_distractors", type=int, metavar="", default=200, help="Number of synthetic documents added to the recorded ones. Default: 200")
+parser.add_argument("--reference", type=str, metavar="", default=None, help="Replay the questions of a reference set (see cold_start) instead of the synthetic queries")
+parser.add_argument("--num_samples", type=int, metavar="", default=None, help="Number of queries to replay. Default: all")
+parser.add_argument("--top_k", type=int, metavar="", default=6, help="Top k of the retrieval. Default: 6")
+parser.add_argument("--reranker", type=str, choices=["bm25", "cross-encoder"], default=None, help="Rerank the retrieved candidates. Default: no reranking")
+parser.add_argument("--reranker_model_path", type=str, metavar="", default=None, help="Directory of the ONNX cross-encoder")
+parser.add_argument("--context_token_budget", type=int, metavar="", default=None, help="Token budget of the context in the prompts. Default: all the chunks in full")
+parser.add_argument("--no_hierarchy", action="store_true", help="Disable the context hierarchy")
+parser.add_argument("--embedding_latency", type=float, metavar="", default=0.0, help="Seconds per embeddings request. Default: 0")
+parser.add_argument("--llm_ttft", type=float, metavar="", default=0.05, help="Seconds until the first token of the fake LLM. Default: 0.05")
+parser.add_argument("--token_latency", type=float, metavar="", default=0.002, help="Seconds per token of the fake LLM. Default: 0.002")
+parser.add_argument("--response_tokens", type=int, metavar="", default=128, help="Tokens of the generated responses. Default: 128")
+parser.add_argument("--trace_allocations", action="store_true", help="Measure the allocations with tracemalloc. Slows the run down")
+parser.add_argument("--verbose", action="store_true", help="Print the logs of the pipeline")
+parser.add_argument("-o", "--output", type=str, metavar="", default=None, help="Save the report as JSON")
+parser.add_argument("-b", "--baseline", type=str, metavar="", default=None, help="Report saved by a previous run, to compare with")
+
+def main():
+    args = parser.parse_args()
+
+    corpus = Corpus(num_distractors=args.num_distractors)
+    if args.reference:
+        corpus.load_reference(args.reference)
+    corpus.queries = corpus.queries[:args.num_samples]
+    msg.info(f"{len(corpus.parents)} parents, {len(corpus.children)} children, {len(corpus.queries)} queries")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reports = run_benchmark(
+            args.workdir or tmpdir,
+            corpus,
+            concurrency=args.concurrency,
+            phases=args.phases,
+            verbose=args.verbose,
+            trace_allocations=args.trace_allocations,
+            config_overrides={
+                "retrieval": {"top_k": args.top_k, "reranker": args.reranker, "reranker_model_path": args.reranker_model_path},
+                "global": {"context_hierarchy": not args.no_hierarchy, "context_token_budget": args.context_token_budget},
+            },
+            embedding_latency=args.embedding_latency,
+            llm_ttft=args.llm_ttft,
+            token_latency=args.token_latency,
+            response_tokens=args.response_tokens,
+        )
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["reports"]
+    print_reports(reports, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "reports": reports}, f, indent=4)
+        msg.good(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -10,18 +10,10 @@ if __name__ == "__main__":
             "reference_path": "./evaluate/reference/data.json"
         },
         "rag_config": {
-            "model": {
-                "Reader": {"selected": ""},
-                "Chunker": {"selected": ""},
-                "Embedder": {"selected": ""},
-                "Retriever": {"selected": "knowledge-base"},
-                "Generator": {"selected": "gpt4"},
-                "Revisor": {"selected": "gpt"},
+            "transformation": {
+                "enable": {"rewriting": False, "hyde": False}
             },
-            "pipeline": {
-                "revise_query": False,
-                "hyde": False,
-            }
+            "generation": {"model": "gpt-4o"},
         }
     }
     run_experiment(run_config, num_samples=3)
\ No newline at end of file
@@ -15,6 +15,7 @@ ref_json_name = "data_small.json"
 
 num_questions = 3
 num_samples = None
+max_concurrency = 8
 
 run_config = {
     "experiment_name": experiment_name,
@@ -22,18 +23,10 @@ run_config = {
         "reference_path": f"./evaluate/reference/{ref_json_name}"
     },
     "rag_config": {
-        "model": {
-            "Reader": {"selected": ""},
-            "Chunker": {"selected": ""},
-            "Embedder": {"selected": ""},
-            "Retriever": {"selected": "knowledge-base"},
-            "Generator": {"selected": "gpt4"},
-            "Revisor": {"selected": "gpt"},
+        "transformation": {
+            "enable": {"rewriting": True, "hyde": True}
         },
-        "pipeline": {
-            "revise_query": True,
-            "hyde": True,
-        }
+        "generation": {"model": "gpt-4o"},
     }
 }
 
@@ -45,10 +38,10 @@ if __name__ == "__main__":
 
     if enable_experiment:
         print("Running experiment...")
-        run_experiment(run_config, num_samples=num_samples)
+        run_experiment(run_config, num_samples=num_samples, max_concurrency=max_concurrency)
         print("Finished running experiment\n\n")
 
     if enable_evaluation:
         print("Evaluating experiment...")
-        evaluate_experiment(experiment_name, eval_name=eval_name, num_samples=num_samples)
+        evaluate_experiment(experiment_name, eval_name=eval_name, num_samples=num_samples, max_concurrency=max_concurrency)
         print("Finished evaluating experiment")
@@ -6,14 +6,21 @@ import json, time
 from tqdm import tqdm
 import numpy as np
 import re
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from rag.api import api as rag_api
+from rag.config import RAGConfig
+from rag import util
 from evaluate.prepare.prompts import evaluate_answer_prompt, generate_questions_prompt
 from evaluate.prepare.context import context
+from evaluate.cache import ExperimentCache
 
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 
+EXPERIMENT_CACHE_PATH = "./evaluate/cache/results.sqlite"
+
 def parse_pair(pair_string):
     question_match = re.search(r"<question>(.*?)</question>", pair_string, re.DOTALL)
     answer_match = re.search(r"<answer>(.*?)</answer>", pair_string, re.DOTALL)
@@ -93,25 +100,19 @@ def cold_start(num_questions=5, file_name="data.json", reference_generator="gpt-
     with open(f"./evaluate/reference/{raw_file_name}", "w") as f:
         f.write("\n---------------------------------\n".join(responses))
 
+def get_context_docs(chunks, doc_type):
+    docs = {}
+    for chunk in chunks:
+        if chunk.doc_meta.get("doc_type", "base") == doc_type:
+            docs.setdefault(chunk.doc_id, []).append(chunk.chunk_id)
+    return [{"doc_id": doc_id, "chunks_ids": chunk_ids} for doc_id, chunk_ids in docs.items()]
+
 def experiment_single_query(run_config, query, history=[]):
-    rag_api.init(run_config["rag_config"])
     generated_response = ""
-    base_docs = None
-    additional_docs = None
+    chunks = []
     for response in rag_api.query_stream(query, history):
-        generated_response += response
-    base_docs = [
-        {
-            "doc_id": doc_id,
-            "chunks_ids": [chunk_id for chunk_id in rag_api.recent_base_docs[doc_id].chunks]
-        } for doc_id in rag_api.recent_base_docs
-    ]
-    additional_docs = [
-        {
-            "doc_id": doc_id,
-            "chunks_ids": [chunk_id for chunk_id in rag_api.recent_additional_docs[doc_id].chunks]
-        } for doc_id in rag_api.recent_additional_docs
-    ]
+        chunks = response.get("retrieval", chunks)
+        generated_response += response.get("generation", "")
 
     result = {
         "input": {
@@ -120,15 +121,18 @@ def experiment_single_query(run_config, query, history=[]):
         },
         "output": {
             "context": {
-                "base": base_docs,
-                "additional": additional_docs
+                "base": get_context_docs(chunks, "base"),
+                "additional": get_context_docs(chunks, "additional")
             },
             "response": generated_response
         }
     }
     return result
 
-def run_experiment(run_config, num_samples=None):
+def run_experiment(run_config, num_samples=None, max_concurrency=8, cache_path=EXPERIMENT_CACHE_PATH):
+    """Run the queries of the reference set through the pipeline, `max_concurrency` at a time.
+    Outputs are cached per (pipeline config, question), so that re-runs only query the pipeline for new questions or configs.
+    """
     experiment_result = {
         "config": run_config,
         "result": []
@@ -139,10 +143,34 @@ def run_experiment(run_config, num_samples=None):
         reference = json.load(f)
     reference_data = reference["data"][:num_samples]
 
+    # configure once, overriding the current config. the pipeline is reused across the queries
+    if run_config.get("rag_config") is not None:
+        config = rag_api.get_config().model_dump(by_alias=True)
+        config = util.deflatten_dict({**util.flatten_dict(config), **util.flatten_dict(run_config["rag_config"])})
+        rag_api.rag_manager.set_config(RAGConfig(**config))
+    config_hash = util.generate_id(rag_api.get_config().model_dump_json(by_alias=True, exclude={"cache"}))
+
     queries = [data["question"] for data in reference_data]
-    for query in tqdm(queries, total=len(queries)):
-        result = experiment_single_query(run_config, query)
-        experiment_result["result"].append(result)
+    cache = ExperimentCache(cache_path) if cache_path else None
+    results = cache.get_many("experiment", config_hash, queries) if cache else [None] * len(queries)
+    pending = [i for i, result in enumerate(results) if result is None]
+    msg.info(f"{len(queries) - len(pending)} cached results, running {len(pending)} queries (concurrency: {max_concurrency})")
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(experiment_single_query, run_config, queries[i]): i for i in pending}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                msg.warn(f"Failed to run query `{queries[i]}`: {e}")
+                continue
+            if cache is not None:
+                cache.put("experiment", config_hash, queries[i], results[i])
+
+    experiment_result["result"] = [result for result in results if result is not None]
+    if len(experiment_result["result"]) < len(queries):
+        msg.warn(f"{len(queries) - len(experiment_result['result'])} queries failed. Re-run to retry them")
     
     # save the reuslt
     experiment_name = run_config["experiment_name"]
@@ -164,12 +192,25 @@ def get_retrieval_score(exp_ctx, ref_ctx):
     additional_score = get_retrieval_score_docs(exp_ctx["additional"], ref_ctx["additional"]["source"])
     return (base_score + additional_score) / 2
 
+def _try_parse_judge_response(response: str) -> Optional[tuple[float, str]]:
+    """Score on the first line, followed by the reasoning. None if the first line is not a number"""
+    answer_score, _, reasoning = response.strip().partition("\n")
+    try:
+        return float(answer_score.strip()), reasoning
+    except ValueError:
+        return None
+
 def evaluate_experiment(
         experiment_name,
         eval_name=None,
         num_samples=None,
         evaluator="gpt-4-turbo",
+        max_concurrency=8,
+        cache_path=EXPERIMENT_CACHE_PATH,
     ):
+    """Score the answers of the experiment with the evaluator, batching `max_concurrency` judge calls at a time.
+    Scores are cached per (evaluator, prompt, question and answers), so that unchanged answers are not judged again.
+    """
     experiment_path = f"./evaluate/experiment/{experiment_name}.json"
     eval_name = f"{experiment_name}_{evaluator}" if eval_name is None else eval_name
     if os.path.exists(f"./evaluate/evaluation/{eval_name}.json"):
@@ -183,16 +224,54 @@ def evaluate_experiment(
     reference_path = experiment["config"]["input_config"]["reference_path"]
     with open(reference_path, "r") as f:
         reference = json.load(f)
-    reference_data = reference["data"][:num_samples]
-    assert len(experiment_result) == len(reference_data)
+    # failed queries are missing in the experiment
+    reference_by_question = {data["question"]: data for data in reference["data"]}
+    reference_data = [reference_by_question[exp["input"]["question"]] for exp in experiment_result]
+
+    # a single model for all the judge calls, sharing the connections
+    llm = ChatOpenAI(model=evaluator)
+    chain = evaluate_answer_prompt | llm | StrOutputParser()
+    judge_hash = util.generate_id(json.dumps([evaluate_answer_prompt.to_json(), evaluator], sort_keys=True, default=str))
+    judge_inputs = [
+        {
+            "query": exp["input"]["question"],
+            "reference_answer": ref["answer"],
+            "generated_answer": exp["output"]["response"]
+        } for exp, ref in zip(experiment_result, reference_data)
+    ]
+    judge_keys = [json.dumps(judge_input, sort_keys=True) for judge_input in judge_inputs]
+
+    cache = ExperimentCache(cache_path) if cache_path else None
+    cached_responses = cache.get_many("judge", judge_hash, judge_keys) if cache else [None] * len(judge_inputs)
+    # malformed responses cached by the previous versions are judged again
+    judge_results = [_try_parse_judge_response(response) if response is not None else None for response in cached_responses]
+    pending = [i for i, result in enumerate(judge_results) if result is None]
+    msg.info(f"{len(judge_inputs) - len(pending)} cached scores, judging {len(pending)} answers with {evaluator}")
+
+    # cache after each batch, so that an interrupted evaluation resumes from there
+    for batch in tqdm(list(util.batched(pending, max_concurrency * 4))):
+        responses = chain.batch(
+            [judge_inputs[i] for i in batch],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        for i, response in zip(batch, responses):
+            if isinstance(response, Exception):
+                msg.warn(f"Failed to judge `{judge_inputs[i]['query']}`: {response}")
+                continue
+            # only well-formed responses are cached, so that the others are retried on the next run
+            if (result := _try_parse_judge_response(response)) is None:
+                msg.warn(f"Failed to parse the score of `{judge_inputs[i]['query']}`: {response[:100]!r}")
+                continue
+            judge_results[i] = result
+            if cache is not None:
+                cache.put("judge", judge_hash, judge_keys[i], response)
 
     # Scoring
     results = []
-    for i in tqdm(range(len(experiment_result)), total=len(experiment_result)):
-        exp = experiment_result[i]
-        ref = reference_data[i]
-
-        assert exp["input"]["question"] == ref["question"]
+    for exp, ref, judge_result in zip(experiment_result, reference_data, judge_results):
+        if judge_result is None:
+            continue
         question = exp["input"]["question"]
 
         exp_ans, exp_ctx = exp["output"]["response"], exp["output"]["context"]
@@ -202,20 +281,7 @@ def evaluate_experiment(
         retrieval_score = get_retrieval_score(exp_ctx, ref_ctx)
 
         # Evaluate the answer
-        llm = ChatOpenAI(model=evaluator)
-        prmopt = evaluate_answer_prompt
-        chain = prmopt | llm | StrOutputParser()
-
-        response = ""
-        for res in chain.stream({
-            "query": question,
-            "reference_answer": ref_ans,
-            "generated_answer": exp_ans
-        }):
-            response += res
-            # print(res, end="", flush=True)
-        # print()
-        answer_score, reasoning = response.split("\n", 1) if "\n" in response else (0, "")
+        answer_score, reasoning = judge_result
 
         evaluate_result = {
             "question": question,
@@ -229,11 +295,13 @@ def evaluate_experiment(
                 "base": exp_ctx["base"],
                 "additional": exp_ctx["additional"]
             },
-            "answer_score": float(answer_score),
+            "answer_score": answer_score,
             "retrieval_score": float(retrieval_score),
             "reasoning": reasoning
         }
         results.append(evaluate_result)
+    if len(results) < len(experiment_result):
+        msg.warn(f"{len(experiment_result) - len(results)} answers failed to be judged. Re-run to retry them")
 
     evaluation = {
         "config": {**experiment["config"], "evaluator": evaluator},
@@ -1,12 +1,14 @@
 import os, json, argparse
 from pathlib import Path
-from typing import Type, Callable, Any
+from typing import Type, Callable, Iterable, Any
+from functools import partial
 
 from langchain_community.document_loaders import PyPDFLoader
 
 from rag.component.loader import *
-from rag.api import upload_data, ingest_data, get_config
+from rag.api import upload_data, ingest_data, ingest_data_pipelined, get_config
 from rag.component.ingestor import PineconeMultiVectorIngestor
+from rag.component.s3sync import sync_from_s3
 from rag import util
 
 parser = argparse.ArgumentParser(description="Ingest data")
@@ -41,13 +43,104 @@ parser.add_argument(
     "-a",
     "--all",
     action="store_true",
-    help="Ingest all files in the source directory. If not set, scan ingesting log and ingest only missing files.",
+    help="Ingest all files in the source directory. If not set, scan the ingestion manifest and ingest only new or changed pages.",
+)
+parser.add_argument(
+    "--prune",
+    action="store_true",
+    help="Delete the vectors of the documents which are not in the source directory anymore. Vanished pages of the ingested documents are always deleted.",
 )
 parser.add_argument(
     "-d",
     "--download",
     action="store_true",
-    help="Download all files from S3 to the source directory. The name of the source directory is defined by -s option.",
+    help="Sync files from S3 to the source directory, downloading only new or changed files. Download all files if -a is set. The name of the source directory is defined by -s option.",
+)
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of chunks in an ingestion batch. Default: 10",
+    default=10,
+)
+parser.add_argument(
+    "--load_workers",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of documents loaded (layout analyzed) concurrently. Default: 2",
+    default=2,
+)
+parser.add_argument(
+    "--prepare_workers",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of batches prepared (child chunk generation) concurrently. Default: 4",
+    default=4,
+)
+parser.add_argument(
+    "--upsert_workers",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of batches embedded and upserted concurrently. Default: 2",
+    default=2,
+)
+parser.add_argument(
+    "--queue_size",
+    type=int,
+    metavar="",
+    required=False,
+    help="Maximum number of batches waiting between the pipeline stages. Default: 8",
+    default=8,
+)
+parser.add_argument(
+    "--page_range_size",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of pages per layout analysis request. If set, page ranges are analyzed concurrently, and pages in the backup directory are skipped. Default: whole document in a request",
+    default=None,
+)
+parser.add_argument(
+    "--layout_concurrency",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of page ranges analyzed concurrently per document. Used with --page_range_size. Default: 4",
+    default=4,
+)
+parser.add_argument(
+    "--backup_format",
+    type=str,
+    metavar="",
+    required=False,
+    choices=["dir", "packed"],
+    help="Format of the layout analysis backup. dir: files per page, packed: a single file per document. Default: dir",
+    default="dir",
+)
+parser.add_argument(
+    "--pack_backup",
+    action="store_true",
+    help="Convert the backup directory into the packed format, removing the page files, before ingestion.",
+)
+parser.add_argument(
+    "--markdown_workers",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of processes converting HTML into markdown and writing the backup. Default: inline",
+    default=None,
+)
+parser.add_argument(
+    "--download_workers",
+    type=int,
+    metavar="",
+    required=False,
+    help="Number of files downloaded from S3 concurrently. Default: 8",
+    default=8,
 )
 args = parser.parse_args()
 
@@ -58,10 +151,15 @@ source_exts = [".pdf",]
 
 persistent_metadata_handler = lambda metadata: util.persistent_metadata_handler(metadata, source_dir=source_dir)
 
-def _ingest(loader: BaseLoader):
-    cnt = ingest_data(
-        loader=loader,
-        batch_size=10,
+def _ingest(loader_inits: Iterable[Callable[[], BaseLoader]]):
+    cnt = ingest_data_pipelined(
+        loader_inits,
+        batch_size=args.batch_size,
+        load_workers=args.load_workers,
+        prepare_workers=args.prepare_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+        prune_missing=args.prune,
     )
     print(f"{cnt} chunks ingested")
     
@@ -69,13 +167,14 @@ def _ingest_walk(loader_init: Callable[[Any], BaseLoader], **kwargs):
     if not os.path.exists(source_dir):
         raise FileNotFoundError(f"Source directory not found: {source_dir}")
     
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            if any(file.endswith(ext) for ext in source_exts):
-                _ingest(loader_init(
-                    os.path.join(root, file),
-                    **kwargs,
-                ))
+    def _loader_inits():
+        for root, dirs, files in os.walk(source_dir):
+            for file in files:
+                if any(file.endswith(ext) for ext in source_exts):
+                    # loaders are initialized in the pipeline, since layout analysis starts on initialization
+                    yield partial(loader_init, os.path.join(root, file), **kwargs)
+    
+    _ingest(_loader_inits())
 
 def ingest():
     print(f"Using loader: {args.loader}")
@@ -88,14 +187,19 @@ def ingest():
             to_markdown=True,
             cache_to_local=True,
             backup_dir=backup_dir,
+            page_range_size=args.page_range_size,
+            max_concurrency=args.layout_concurrency,
+            backup_format=args.backup_format,
+            markdown_workers=args.markdown_workers,
             metadata_handler=persistent_metadata_handler,
         )
     elif args.loader == "upstage_backup":
         # ingest all backup files in the backup_dir
-        _ingest(UpstageLayoutBackupDirLoader(
+        _ingest([partial(
+            UpstageLayoutBackupDirLoader,
             backup_dir,
             metadata_handler=persistent_metadata_handler,
-        ))
+        )])
     elif args.loader == "pypdf":
         def loader_init(file_path: str, **kwargs):
             return BaseRAGLoader.from_lc_loader(
@@ -112,89 +216,15 @@ def ingest():
     else:
         raise ValueError(f"Unknown loader: {args.loader}")
 
-def get_file_folders(s3_client, bucket_name, prefix=""):
-    file_names = []
-    folders = []
-
-    default_kwargs = {
-        "Bucket": bucket_name,
-        "Prefix": prefix
-    }
-    next_token = ""
-
-    while next_token is not None:
-        updated_kwargs = default_kwargs.copy()
-        if next_token != "":
-            updated_kwargs["ContinuationToken"] = next_token
-
-        response = s3_client.list_objects_v2(**updated_kwargs)
-        contents = response.get("Contents")
-
-        for result in contents:
-            key = result.get("Key")
-            if key[-1] == "/":
-                folders.append(key)
-            else:
-                file_names.append(key)
-
-        next_token = response.get("NextContinuationToken")
-
-    return file_names, folders
-
-def download_files(s3_client, bucket_name, local_path, file_names, folders, ignore_existing=False):
-    local_path = Path(local_path)
-
-    for folder in folders:
-        folder_path = Path.joinpath(local_path, folder)
-		# Create all folders in the path
-        folder_path.mkdir(parents=True, exist_ok=True)
-
-    for file_name in file_names:
-        file_path = Path.joinpath(local_path, file_name)
-		# Create folder for parent directory
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        if ignore_existing and file_path.exists():
-            print(f"File {file_path} already exists. Skipping...")
-            continue
-        
-        print(f"Downloading {file_name} to {file_path}")
-        s3_client.download_file(
-            bucket_name,
-            file_name,
-            str(file_path)
-        )
-
-def attach_metadata(local_path, file_names, bucket_name, metadata_ext=".metadata.json"):
-    for file_name in file_names:
-        if not file_name.endswith(".pdf"):
-            continue
-        metadata_path = os.path.join(local_path, file_name) + metadata_ext
-        
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
-        
-        metadata["source"] = f"s3://{bucket_name}/{file_name}"
-        metadata["doc_id"] = metadata["source"]
-        
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f)
-
-
-def download_from_s3(to_dir: str, ignore_existing=True):
-    import boto3
-    s3_bucket = os.getenv("S3_BUCKET_NAME")
-    s3_client = boto3.client("s3")
-    file_names, folders = get_file_folders(s3_client, s3_bucket)
-    download_files(s3_client, s3_bucket, to_dir, file_names, folders, ignore_existing=ignore_existing)
-    attach_metadata(to_dir, file_names, s3_bucket)
-
-
 def main():
+    if args.pack_backup:
+        converted_cnt = convert_backup_dir(backup_dir, remove=True)
+        print(f"{converted_cnt} documents packed")
+    
     if args.download:
         if not os.path.exists(source_dir):
             os.makedirs(source_dir)
-        download_from_s3(to_dir=source_dir, ignore_existing=not args.all)
+        sync_from_s3(to_dir=source_dir, ignore_existing=not args.all, max_workers=args.download_workers)
         
     print(f"Source directory: {source_dir}")
     print(f"Backup directory: {backup_dir}")
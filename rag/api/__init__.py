@@ -1,8 +1,11 @@
-from rag.api.api import query, query_stream, upload_data, ingest_data, get_config
+from rag.api.api import query, query_stream, aquery_stream, upload_data, ingest_data, ingest_data_pipelined, aingest_data, get_config
 __all__ = [
     "query",
     "query_stream",
+    "aquery_stream",
     "upload_data",
     "ingest_data",
+    "ingest_data_pipelined",
+    "aingest_data",
     "get_config",
 ]
\ No newline at end of file
@@ -1,5 +1,6 @@
-from typing import Generator, Any
+from typing import Generator, AsyncGenerator, Iterable, Callable, Any
 from wasabi import msg
+import asyncio
 
 from langchain_community.callbacks import get_openai_callback
 from langchain.globals import set_debug
@@ -9,6 +10,7 @@ from rag import util
 from rag.type import *
 from rag.config import *
 from rag.component.loader import *
+from rag.component import tracing
 
 recent_chunks = None
 recent_translated_query = None
@@ -36,14 +38,22 @@ init()
 def get_config() -> Optional[RAGConfig]:
     return rag_manager.config
 
+@tracing.trace("query")
 def query(query: str, history: list[ChatLog]=None) -> GenerationResult:
     history = history or []
+    global recent_chunks, recent_translated_query
+    
+    cached_result = rag_manager.lookup_cache(query, history)
+    tracing.annotate(cache_hit=cached_result is not None)
+    if cached_result is not None:
+        recent_chunks = cached_result.get("retrieval", [])
+        recent_translated_query = cached_result.get("transformation", {}).get("translation", query)
+        return cached_result
+    
     with get_openai_callback() as cb:
-        queries = rag_manager.transform_query(query, history)
+        queries, chunks = rag_manager.transform_and_retrieve(query, history)
         translated_query = queries["translation"]
-        chunks = rag_manager.retrieve(queries)
         
-        global recent_chunks, recent_translated_query
         recent_chunks = chunks
         recent_translated_query = translated_query
 
@@ -51,37 +61,127 @@ def query(query: str, history: list[ChatLog]=None) -> GenerationResult:
         verification_response = rag_manager.verify_fact(generation_response, chunks)
         
         print(cb)
-    return util.remove_falsy({"transformation": queries, "retrieval": chunks, "generation": generation_response, "fact_verification": verification_response})
+    result = util.remove_falsy({"transformation": queries, "retrieval": chunks, "generation": generation_response, "fact_verification": verification_response})
+    rag_manager.update_cache(query, result, history)
+    return result
     
 
+@tracing.trace("query", stream=True)
 def query_stream(
     query: str, 
     history: list[ChatLog]=None,
     categories: list[str]=None,
 ) -> Generator[GenerationResult, None, None]:
     history = history or []
+    global recent_chunks, recent_translated_query
+    
+    cached_result = rag_manager.lookup_cache(query, history, categories)
+    tracing.annotate(cache_hit=cached_result is not None)
+    if cached_result is not None:
+        recent_chunks = cached_result.get("retrieval", [])
+        recent_translated_query = cached_result.get("transformation", {}).get("translation", query)
+        # same order as the uncached path. empty values are dropped from the cached result
+        yield {"transformation": cached_result.get("transformation", {})}
+        yield {"retrieval": cached_result.get("retrieval", [])}
+        for key in ["generation", "fact_verification"]:
+            if cached_result.get(key) is not None:
+                yield {key: cached_result[key]}
+        return
+    
     with get_openai_callback() as cb:
-        queries = rag_manager.transform_query(query, history)
+        queries, chunks = rag_manager.transform_and_retrieve(query, history, categories)
         yield {"transformation": queries}
         
         translated_query = queries["translation"]
-        chunks = rag_manager.retrieve(queries, categories)
         yield {"retrieval": chunks}
         
-        global recent_chunks, recent_translated_query
         recent_chunks = chunks
         recent_translated_query = translated_query
 
+        # in incremental mode, segments of the response are verified while streaming
+        incremental_verification = rag_manager.start_fact_verification(chunks)
+        
         generation_response = ""
         for response in rag_manager.generate_stream(translated_query, history, chunks):
             yield {"generation": response}
             generation_response += response
+            if incremental_verification is not None:
+                incremental_verification.feed(response)
+        
+        if incremental_verification is not None:
+            verification = rag_manager.finish_fact_verification(incremental_verification)
+        else:
+            verification = rag_manager.verify_fact(generation_response, chunks)
+        if verification is not None:
+            yield {"fact_verification": verification}
+        
+        print(cb)
+    
+    rag_manager.update_cache(
+        query, 
+        util.remove_falsy({"transformation": queries, "retrieval": chunks, "generation": generation_response, "fact_verification": verification}),
+        history,
+        categories,
+    )
+        
+@tracing.trace("query", stream=True)
+async def aquery_stream(
+    query: str, 
+    history: list[ChatLog]=None,
+    categories: list[str]=None,
+) -> AsyncGenerator[GenerationResult, None]:
+    """Async version of `query_stream`. LLM calls are awaited, so a single event loop can serve many chats at once."""
+    history = history or []
+    global recent_chunks, recent_translated_query
+    
+    cached_result = await asyncio.to_thread(rag_manager.lookup_cache, query, history, categories)
+    tracing.annotate(cache_hit=cached_result is not None)
+    if cached_result is not None:
+        recent_chunks = cached_result.get("retrieval", [])
+        recent_translated_query = cached_result.get("transformation", {}).get("translation", query)
+        # same order as the uncached path. empty values are dropped from the cached result
+        yield {"transformation": cached_result.get("transformation", {})}
+        yield {"retrieval": cached_result.get("retrieval", [])}
+        for key in ["generation", "fact_verification"]:
+            if cached_result.get(key) is not None:
+                yield {key: cached_result[key]}
+        return
+    
+    with get_openai_callback() as cb:
+        queries, chunks = await rag_manager.atransform_and_retrieve(query, history, categories)
+        yield {"transformation": queries}
+        
+        translated_query = queries["translation"]
+        yield {"retrieval": chunks}
+        
+        recent_chunks = chunks
+        recent_translated_query = translated_query
+
+        incremental_verification = rag_manager.start_fact_verification(chunks)
+        
+        generation_response = ""
+        async for response in rag_manager.agenerate_stream(translated_query, history, chunks):
+            yield {"generation": response}
+            generation_response += response
+            if incremental_verification is not None:
+                incremental_verification.feed(response)
         
-        verification = rag_manager.verify_fact(generation_response, chunks)
+        if incremental_verification is not None:
+            verification = await asyncio.to_thread(rag_manager.finish_fact_verification, incremental_verification)
+        else:
+            verification = await rag_manager.averify_fact(generation_response, chunks)
         if verification is not None:
             yield {"fact_verification": verification}
         
         print(cb)
+    
+    await asyncio.to_thread(
+        rag_manager.update_cache,
+        query, 
+        util.remove_falsy({"transformation": queries, "retrieval": chunks, "generation": generation_response, "fact_verification": verification}),
+        history,
+        categories,
+    )
         
 def fake_query_stream(
     query: str, 
@@ -103,8 +203,15 @@ def upload_data(file_path: str, object_location: str, metadata: Optional[dict] =
 def ingest_data(loader: Union[BaseRAGLoader, BaseLoader], batch_size: int = 20) -> int:
     return rag_manager.ingest(loader=loader, batch_size=batch_size)
 
-async def aingest_data(s3_url: str) -> int:
-    return await rag_manager.aingest(s3_url)
+def ingest_data_pipelined(
+    loader_inits: Iterable[Callable[[], Union[BaseRAGLoader, BaseLoader]]], 
+    batch_size: int = 20,
+    **pipeline_kwargs,
+) -> int:
+    return rag_manager.ingest_pipelined(loader_inits, batch_size=batch_size, **pipeline_kwargs)
+
+async def aingest_data(s3_url: str, batch_size: int = 20) -> int:
+    return await rag_manager.aingest(s3_url, batch_size=batch_size)
 
 def get_categories() -> list[str]:
     return rag_manager.get_categories()
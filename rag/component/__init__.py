@@ -1,10 +1,13 @@
-from rag.component.llm import llm, prompt
+from rag.component.llm import llm, prompt, ratelimit
 from rag.component.embeddings import embeddings
 from rag.component.chunker import chunker
+from rag.component.tracing import tracing
 
 __all__ = [
     "llm",
     "prompt",
+    "ratelimit",
     "embeddings",
-    "chunker"
+    "chunker",
+    "tracing",
 ]
\ No newline at end of file
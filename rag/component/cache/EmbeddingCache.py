@@ -0,0 +1,66 @@
+from typing import Optional
+from array import array
+
+from rag.component.cache.base import BaseRAGCache
+from rag import util
+
+class EmbeddingCache(BaseRAGCache):
+    """Content-addressed embeddings cache.
+    Vectors are keyed by (embeddings model name, sha256 of the text), and stored as float32.
+    """
+    @property
+    def table_name(self) -> str:
+        return "embeddings"
+    
+    def _init_tables(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "text_hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+    
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[list[float]]]:
+        hashes = [util.generate_id(text) for text in texts]
+        found: dict[str, list[float]] = {}
+        
+        with self._lock:
+            # sqlite limits the number of host parameters
+            for i in range(0, len(hashes), 500):
+                batch = list(set(hashes[i:i + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch)
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+            
+            if found:
+                now = self._now()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+        
+        vectors = [found.get(text_hash) for text_hash in hashes]
+        hits = sum(1 for vector in vectors if vector is not None)
+        self._count_lookups(hits, len(vectors) - hits)
+        return vectors
+    
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]) -> None:
+        now = self._now()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [
+                    (model, util.generate_id(text), array("f", vector).tobytes(), now)
+                    for text, vector in zip(texts, vectors)
+                ]
+            )
+            self._conn.commit()
+        self.evict(written=len(texts))
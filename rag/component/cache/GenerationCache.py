@@ -0,0 +1,103 @@
+from typing import Optional
+
+from rag.component.cache.base import BaseRAGCache
+from rag import util
+
+class GenerationCache(BaseRAGCache):
+    """Content-addressed cache of LLM generations, e.g. summaries and hypothetical queries of the chunks.
+    Generations are keyed by (prompt template hash, model name, lang, sha256 of the text),
+    so that they are reused across re-ingestions with different metadata, namespaces or embeddings.
+    """
+    @property
+    def table_name(self) -> str:
+        return "generations"
+
+    def _init_tables(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "template_hash TEXT NOT NULL, "
+            "model TEXT NOT NULL, "
+            "lang TEXT NOT NULL, "
+            "text_hash TEXT NOT NULL, "
+            "output TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (template_hash, model, lang, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access)")
+
+    def get_many(self, template_hash: str, model: str, lang: str, texts: list[str]) -> list[Optional[str]]:
+        hashes = [util.generate_id(text) for text in texts]
+        found: dict[str, str] = {}
+
+        with self._lock:
+            # sqlite limits the number of host parameters
+            for i in range(0, len(hashes), 500):
+                batch = list(set(hashes[i:i + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT text_hash, output FROM generations "
+                    f"WHERE template_hash = ? AND model = ? AND lang = ? AND text_hash IN ({placeholders})",
+                    (template_hash, model, lang, *batch)
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = self._now()
+                self._conn.executemany(
+                    "UPDATE generations SET last_access = ? WHERE template_hash = ? AND model = ? AND lang = ? AND text_hash = ?",
+                    [(now, template_hash, model, lang, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+
+        outputs = [found.get(text_hash) for text_hash in hashes]
+        hits = sum(1 for output in outputs if output is not None)
+        self._count_lookups(hits, len(outputs) - hits)
+        return outputs
+
+    def put_many(self, template_hash: str, model: str, lang: str, texts: list[str], outputs: list[str]) -> None:
+        now = self._now()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO generations (template_hash, model, lang, text_hash, output, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (template_hash, model, lang, util.generate_id(text), output, now, now)
+                    for text, output in zip(texts, outputs)
+                ]
+            )
+            self._conn.commit()
+        self.evict(written=len(texts))
+
+    def prune(
+        self,
+        max_age: Optional[float] = None,
+        keep_templates: Optional[list[str]] = None,
+        keep_models: Optional[list[str]] = None,
+    ) -> int:
+        """Delete the generations which are not likely to be reused
+
+        Args:
+            max_age (Optional[float]): delete the generations not accessed for `max_age` seconds
+            keep_templates (Optional[list[str]]): delete the generations of the other prompt templates, e.g. outdated prompts
+            keep_models (Optional[list[str]]): delete the generations of the other models
+
+        Returns:
+            int: number of deleted generations
+        """
+        conditions, params = [], []
+        if max_age is not None:
+            conditions.append("last_access < ?")
+            params.append(self._now() - max_age)
+        if keep_templates is not None:
+            conditions.append(f"template_hash NOT IN ({','.join('?' * len(keep_templates))})")
+            params.extend(keep_templates)
+        if keep_models is not None:
+            conditions.append(f"model NOT IN ({','.join('?' * len(keep_models))})")
+            params.extend(keep_models)
+        if not conditions:
+            return 0
+
+        with self._lock:
+            deleted = self._conn.execute(f"DELETE FROM generations WHERE {' OR '.join(conditions)}", params).rowcount
+            self._conn.commit()
+        return deleted
@@ -0,0 +1,65 @@
+from typing import Optional
+
+from rag.component.cache.base import BaseRAGCache
+from rag import util
+
+class RerankCache(BaseRAGCache):
+    """Relevance scores of the reranker, keyed by (reranker model name, sha256 of the query, chunk key).
+    Chunk keys include the hash of the chunk text, so that a re-ingested page with the same chunk id is scored again.
+    Chunks retrieved again for the same query, e.g. by the two passes of the hierarchical retriever, are not scored twice.
+    """
+    @property
+    def table_name(self) -> str:
+        return "rerank_scores"
+
+    def _init_tables(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rerank_scores ("
+            "model TEXT NOT NULL, "
+            "query_hash TEXT NOT NULL, "
+            "chunk_id TEXT NOT NULL, "
+            "score REAL NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (model, query_hash, chunk_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rerank_scores_last_access ON rerank_scores (last_access)")
+
+    def get_many(self, model: str, query: str, chunk_ids: list[str]) -> list[Optional[float]]:
+        query_hash = util.generate_id(query)
+        found: dict[str, float] = {}
+
+        with self._lock:
+            # sqlite limits the number of host parameters
+            for i in range(0, len(chunk_ids), 500):
+                batch = list(set(chunk_ids[i:i + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT chunk_id, score FROM rerank_scores "
+                    f"WHERE model = ? AND query_hash = ? AND chunk_id IN ({placeholders})",
+                    (model, query_hash, *batch)
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = self._now()
+                self._conn.executemany(
+                    "UPDATE rerank_scores SET last_access = ? WHERE model = ? AND query_hash = ? AND chunk_id = ?",
+                    [(now, model, query_hash, chunk_id) for chunk_id in found]
+                )
+                self._conn.commit()
+
+        scores = [found.get(chunk_id) for chunk_id in chunk_ids]
+        hits = sum(1 for score in scores if score is not None)
+        self._count_lookups(hits, len(scores) - hits)
+        return scores
+
+    def put_many(self, model: str, query: str, chunk_ids: list[str], scores: list[float]) -> None:
+        query_hash = util.generate_id(query)
+        now = self._now()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rerank_scores (model, query_hash, chunk_id, score, last_access) VALUES (?, ?, ?, ?, ?)",
+                [(model, query_hash, chunk_id, float(score), now) for chunk_id, score in zip(chunk_ids, scores)]
+            )
+            self._conn.commit()
+        self.evict(written=len(chunk_ids))
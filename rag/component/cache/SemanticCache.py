@@ -0,0 +1,135 @@
+from typing import Optional
+import threading
+
+import numpy as np
+
+from rag.component.cache.base import BaseRAGCache
+
+class _PartitionIndex:
+    def __init__(self, signature: tuple, ids: np.ndarray, matrix: np.ndarray, created_at: np.ndarray) -> None:
+        self.signature = signature
+        self.ids = ids
+        self.matrix = matrix
+        self.created_at = created_at
+
+class SemanticCache(BaseRAGCache):
+    """Cache of query results, looked up by the similarity of the query embeddings.
+    Entries are grouped by partition (e.g. filter and config fingerprint), and only compared within the same partition.
+    Each partition is held in memory as a normalized float32 matrix, and reloaded when the table changes.
+    """
+    def __init__(self, path: str, max_entries: Optional[int] = None) -> None:
+        self._indices: dict[str, _PartitionIndex] = {}
+        self._index_lock = threading.Lock()
+        super().__init__(path, max_entries)
+    
+    @property
+    def table_name(self) -> str:
+        return "semantic_cache"
+    
+    def _init_tables(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "partition TEXT NOT NULL, "
+            "query TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, "
+            "result TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS semantic_cache_partition ON semantic_cache (partition)")
+    
+    def _signature(self, partition: str) -> tuple:
+        return self._conn.execute(
+            "SELECT COUNT(*), MAX(id) FROM semantic_cache WHERE partition = ?", (partition,)
+        ).fetchone()
+    
+    def _get_index(self, partition: str) -> _PartitionIndex:
+        with self._lock:
+            signature = self._signature(partition)
+            index = self._indices.get(partition)
+            if index is not None and index.signature == signature:
+                return index
+            
+            rows = self._conn.execute(
+                "SELECT id, embedding, created_at FROM semantic_cache WHERE partition = ? ORDER BY id", (partition,)
+            ).fetchall()
+        
+        if rows:
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            created_at = np.array([row[2] for row in rows], dtype=np.float64)
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            matrix = np.empty((0, 0), dtype=np.float32)
+            created_at = np.empty(0, dtype=np.float64)
+        
+        index = _PartitionIndex(signature, ids, matrix, created_at)
+        with self._index_lock:
+            self._indices[partition] = index
+        return index
+    
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def lookup(
+        self, 
+        partition: str, 
+        embedding: list[float], 
+        threshold: float, 
+        ttl: Optional[float] = None
+    ) -> Optional[tuple[str, float]]:
+        """Find the most similar cached query in the partition.
+
+        Args:
+            partition (str): partition key
+            embedding (list[float]): embedding of the query
+            threshold (float): minimum cosine similarity to be a hit
+            ttl (Optional[float]): time to live in seconds. Expired entries are ignored. Defaults to None.
+
+        Returns:
+            Optional[tuple[str, float]]: serialized result and its similarity, if found
+        """
+        index = self._get_index(partition)
+        if len(index.ids) == 0:
+            self._count_lookups(0, 1)
+            return None
+        
+        similarities = index.matrix @ self._normalize(embedding)
+        if ttl is not None:
+            similarities[index.created_at < self._now() - ttl] = -np.inf
+        
+        best = int(np.argmax(similarities))
+        if similarities[best] < threshold:
+            self._count_lookups(0, 1)
+            return None
+        
+        entry_id = int(index.ids[best])
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM semantic_cache WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                self._count_lookups(0, 1)
+                return None
+            self._conn.execute("UPDATE semantic_cache SET last_access = ? WHERE id = ?", (self._now(), entry_id))
+            self._conn.commit()
+        self._count_lookups(1, 0)
+        return row[0], float(similarities[best])
+    
+    def put(self, partition: str, query: str, embedding: list[float], result: str) -> None:
+        now = self._now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO semantic_cache (partition, query, embedding, result, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (partition, query, self._normalize(embedding).tobytes(), result, now, now)
+            )
+            self._conn.commit()
+        self.evict(written=1)
+    
+    def purge_expired(self, ttl: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM semantic_cache WHERE created_at < ?", (self._now() - ttl,))
+            self._conn.commit()
+            return cursor.rowcount
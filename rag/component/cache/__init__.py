@@ -0,0 +1,13 @@
+from rag.component.cache.base import BaseRAGCache
+from rag.component.cache.EmbeddingCache import EmbeddingCache
+from rag.component.cache.SemanticCache import SemanticCache
+from rag.component.cache.GenerationCache import GenerationCache
+from rag.component.cache.RerankCache import RerankCache
+
+__all__ = [
+    "BaseRAGCache",
+    "EmbeddingCache",
+    "SemanticCache",
+    "GenerationCache",
+    "RerankCache",
+]
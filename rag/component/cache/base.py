@@ -0,0 +1,114 @@
+from typing import Optional
+import os
+import sqlite3
+import threading
+import time
+
+class BaseRAGCache:
+    """Base class of the local persistent caches, backed by a single SQLite file.
+    Subclasses define their tables in `_init_tables`, and share the connection, lock and hit/miss counters.
+
+    Args:
+        path (str): path of the SQLite file. `:memory:` for a non-persistent cache.
+        max_entries (Optional[int]): maximum number of entries. Least recently used entries are evicted. Unbounded if None.
+    """
+    # entries evicted below `max_entries`, relative to it, so that the table is not counted on every write
+    EVICTION_SLACK = 0.05
+    
+    def __init__(self, path: str, max_entries: Optional[int] = None) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # upper bound of the number of entries, since the last count. None until counted
+        self._max_count: Optional[int] = None
+        
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_tables()
+        self._conn.commit()
+    
+    def _init_tables(self) -> None:
+        raise NotImplementedError()
+    
+    @property
+    def table_name(self) -> str:
+        raise NotImplementedError()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+    
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "entries": len(self),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+    
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def _count_lookups(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table_name}")
+            self._conn.commit()
+            self._max_count = 0
+    
+    def evict(self, written: int = 0) -> int:
+        """Evict least recently used entries exceeding `max_entries`, down to `max_entries * (1 - EVICTION_SLACK)`.
+        The entries are counted only when the written entries may exceed `max_entries`. The table should have `last_access` column.
+
+        Args:
+            written (int): number of entries written since the last call. Replaced entries included
+
+        Returns:
+            int: number of evicted entries
+        """
+        if self.max_entries is None:
+            return 0
+        
+        with self._lock:
+            if self._max_count is not None:
+                self._max_count += written
+                if self._max_count <= self.max_entries:
+                    return 0
+            count = len(self)
+            self._max_count = count
+            if count <= self.max_entries:
+                return 0
+            
+            overflow = count - int(self.max_entries * (1 - self.EVICTION_SLACK))
+            self._conn.execute(
+                f"DELETE FROM {self.table_name} WHERE rowid IN "
+                f"(SELECT rowid FROM {self.table_name} ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._conn.commit()
+            self._max_count -= overflow
+            return overflow
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def _now() -> float:
+        return time.time()
@@ -1,9 +1,14 @@
 from wasabi import msg
-from typing import Optional
+from typing import Optional, Iterator, Callable
+import asyncio
 import os
+import threading
 
 from langchain_core.embeddings import Embeddings
 
+from rag.component.cache import EmbeddingCache
+from rag.component.llm.ratelimit import RateLimiter, get_limiter, estimate_tokens
+
 model_providers = {
     "openai": [
         "text-embedding-3-small",
@@ -16,13 +21,139 @@ model_providers = {
     ]
 }
 
+# embeddings registered at runtime, e.g. stubs of the offline benchmark. looked up before the providers
+_custom_models: dict[str, Callable[..., Embeddings]] = {}
+
+def register_model(model_name: str, factory: Callable[..., Embeddings]) -> None:
+    """Register embeddings created by `factory(**kwargs)`, overriding the providers"""
+    _custom_models[model_name] = factory
+
 def get_provider(model_name: str) -> Optional[str]:
     for provider, models in model_providers.items():
         if model_name in models:
             return provider
     return None
 
-def get_model(model_name: str, **kwargs) -> Optional[Embeddings]:
+DEFAULT_CACHE_MAX_ENTRIES = 1_000_000
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that looks up the persistent cache first, 
+    and embeds only the missing texts with the underlying model.
+    """
+    def __init__(self, underlying: Embeddings, model_name: str, cache: EmbeddingCache) -> None:
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+    
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.cache.get_many(self.model_name, texts)
+        
+        missing_indices = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing_indices:
+            # embed each missing text only once, even if duplicated in the input
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing_indices))
+            missing_vectors = self.underlying.embed_documents(missing_texts)
+            self.cache.put_many(self.model_name, missing_texts, missing_vectors)
+            
+            embedded = dict(zip(missing_texts, missing_vectors))
+            for i in missing_indices:
+                vectors[i] = embedded[texts[i]]
+        return vectors
+    
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get_many(self.model_name, [text])[0]
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self.cache.put_many(self.model_name, [text], [vector])
+        return vector
+    
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # sqlite calls run on a thread, so that the lock and the disk I/O do not block the event loop
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model_name, texts)
+        
+        missing_indices = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing_indices:
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing_indices))
+            missing_vectors = await self.underlying.aembed_documents(missing_texts)
+            await asyncio.to_thread(self.cache.put_many, self.model_name, missing_texts, missing_vectors)
+            
+            embedded = dict(zip(missing_texts, missing_vectors))
+            for i in missing_indices:
+                vectors[i] = embedded[texts[i]]
+        return vectors
+    
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = (await asyncio.to_thread(self.cache.get_many, self.model_name, [text]))[0]
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, self.model_name, [text], [vector])
+        return vector
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings wrapper that schedules the requests with a rate limiter, 
+    splitting large inputs so that each request fits in the token budget.
+    """
+    def __init__(self, underlying: Embeddings, limiter: RateLimiter, batch_size: int = 512) -> None:
+        self.underlying = underlying
+        self.limiter = limiter
+        self.batch_size = batch_size
+    
+    def _batches(self, texts: list[str]) -> Iterator[tuple[list[str], int]]:
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            yield batch, sum(estimate_tokens(text) for text in batch)
+    
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for batch, tokens in self._batches(texts):
+            vectors.extend(self.limiter.run(lambda: self.underlying.embed_documents(batch), tokens=tokens))
+        return vectors
+    
+    def embed_query(self, text: str) -> list[float]:
+        return self.limiter.run(lambda: self.underlying.embed_query(text), tokens=estimate_tokens(text))
+    
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for batch, tokens in self._batches(texts):
+            vectors.extend(await self.limiter.arun(lambda: self.underlying.aembed_documents(batch), tokens=tokens))
+        return vectors
+    
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.limiter.arun(lambda: self.underlying.aembed_query(text), tokens=estimate_tokens(text))
+
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_cache(cache_path: str, max_entries: Optional[int] = DEFAULT_CACHE_MAX_ENTRIES) -> EmbeddingCache:
+    """Get the embeddings cache of the path. Caches are shared among the models using the same path."""
+    with _caches_lock:
+        if cache_path not in _caches:
+            _caches[cache_path] = EmbeddingCache(cache_path, max_entries=max_entries)
+        return _caches[cache_path]
+
+def get_model(
+    model_name: str, 
+    cache_path: Optional[str] = None,
+    cache_max_entries: Optional[int] = DEFAULT_CACHE_MAX_ENTRIES,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    **kwargs
+) -> Optional[Embeddings]:
+    model = _get_model(model_name, **kwargs)
+    if model is not None and (rpm or tpm):
+        msg.info(f"Rate limiting embeddings {model_name}: rpm={rpm}, tpm={tpm}")
+        # shared by all the embeddings of the same model
+        model = RateLimitedEmbeddings(model, get_limiter(f"embeddings:{model_name}", rpm=rpm, tpm=tpm))
+    if model is None or cache_path is None:
+        return model
+    
+    msg.info(f"Using embeddings cache for {model_name}: {cache_path}")
+    return CachedEmbeddings(model, model_name, get_cache(cache_path, cache_max_entries))
+
+def _get_model(model_name: str, **kwargs) -> Optional[Embeddings]:
+    if model_name in _custom_models:
+        return _custom_models[model_name](**kwargs)
+    
     try:
         provider = get_provider(model_name)
         if provider is None:
@@ -0,0 +1,234 @@
+from typing import Optional, Iterable
+from wasabi import msg
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from rag.type import *
+from rag import util
+
+PageKey = tuple[str, int]
+
+class _PageRun:
+    """Chunks of a page seen during the current run, tracked across the batches"""
+    def __init__(self, previous_chunks: dict[str, dict], previous_ids: dict[str, list[str]]) -> None:
+        self.previous_chunks = previous_chunks
+        self.previous_ids = previous_ids
+        self.chunk_hashes: dict[str, str] = {}
+        self.ingested: dict[str, dict[str, list[str]]] = {}
+
+class IngestionManifest:
+    """Durable record of the ingested pages, backed by a single SQLite file.
+    Each page is recorded with the hashes of its chunks and the ids of their vectors, per namespace,
+    so that re-runs re-ingest only the changed chunks, and delete the vectors of the stale ones.
+    
+    The chunks of a page may span several batches, so pages are recorded by `commit_run` at the end of the run,
+    once all their changed chunks are ingested. Pages of an interrupted run are ingested again on the next run.
+
+    Pages are identified by (doc_id, page). Chunks without page number cannot be tracked, and are always ingested.
+
+    Args:
+        path (str): path of the SQLite file. `:memory:` for a non-persistent manifest.
+        scope (str): scope of the records, e.g. the namespace of the ingestor. Ingestors of different scopes can share a file.
+    """
+    def __init__(self, path: str, scope: str) -> None:
+        self.path = path
+        self.scope = scope
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "scope TEXT NOT NULL, "
+            "doc_id TEXT NOT NULL, "
+            "page INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, "
+            "vector_ids TEXT NOT NULL, "
+            "chunks TEXT NOT NULL DEFAULT '{}', "
+            "ingested_at REAL NOT NULL, "
+            "PRIMARY KEY (scope, doc_id, page))"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(pages)")]
+        if "chunks" not in columns:
+            # manifests recorded per page. their chunks are considered changed
+            self._conn.execute("ALTER TABLE pages ADD COLUMN chunks TEXT NOT NULL DEFAULT '{}'")
+        self._conn.commit()
+
+        # pages and documents seen during the current run
+        self._seen_pages: set[PageKey] = set()
+        self._seen_docs: set[str] = set()
+        self._runs: dict[PageKey, _PageRun] = {}
+
+    @staticmethod
+    def page_key(chunk: Chunk) -> Optional[PageKey]:
+        page = chunk.chunk_meta.get("page")
+        if page is None:
+            return None
+        return chunk.doc_id, int(page)
+
+    @staticmethod
+    def chunk_hash(chunk: Chunk) -> str:
+        """Hash of the text and the metadata of a chunk"""
+        return util.generate_id(chunk.text + json.dumps([chunk.doc_meta, chunk.chunk_meta], sort_keys=True, default=str))
+
+    @staticmethod
+    def content_hash(chunk_hashes: Iterable[str]) -> str:
+        """Hash of the chunks of a page, regardless of the order they are ingested in"""
+        return util.generate_id("\n".join(sorted(chunk_hashes)))
+
+    def group_by_page(self, chunks: list[Chunk]) -> dict[Optional[PageKey], list[Chunk]]:
+        pages: dict[Optional[PageKey], list[Chunk]] = {}
+        for chunk in chunks:
+            pages.setdefault(self.page_key(chunk), []).append(chunk)
+        return pages
+
+    def filter_changed(self, chunks: list[Chunk]) -> list[Chunk]:
+        """Mark the chunks as seen, and filter out the unchanged ones.
+        Chunks are compared one by one, so that a page spanning several batches is compared correctly.
+
+        Returns:
+            list[Chunk]: new or changed chunks, and chunks without page number
+        """
+        changed = []
+        for key, page_chunks in self.group_by_page(chunks).items():
+            if key is None:
+                changed.extend(page_chunks)
+                continue
+
+            run = self._get_run(key)
+            with self._lock:
+                for chunk in page_chunks:
+                    chunk_hash = self.chunk_hash(chunk)
+                    run.chunk_hashes[chunk.chunk_id] = chunk_hash
+                    if run.previous_chunks.get(chunk.chunk_id, {}).get("hash") != chunk_hash:
+                        changed.append(chunk)
+        return changed
+
+    def _get_run(self, key: PageKey) -> _PageRun:
+        """State of the page during the current run. Marks the page as seen"""
+        with self._lock:
+            self._seen_pages.add(key)
+            self._seen_docs.add(key[0])
+            if key not in self._runs:
+                row = self._conn.execute(
+                    "SELECT vector_ids, chunks FROM pages WHERE scope = ? AND doc_id = ? AND page = ?",
+                    (self.scope, *key)
+                ).fetchone()
+                self._runs[key] = _PageRun(json.loads(row[1]), json.loads(row[0])) if row else _PageRun({}, {})
+            return self._runs[key]
+
+    def mark_ingested(self, chunk: Chunk, vector_ids: dict[str, list[str]]) -> None:
+        """Mark a chunk as ingested
+
+        Args:
+            chunk (Chunk): ingested chunk
+            vector_ids (dict[str, list[str]]): ids of the vectors upserted for the chunk, per namespace
+        """
+        if (key := self.page_key(chunk)) is None:
+            return
+        run = self._get_run(key)
+        with self._lock:
+            run.ingested[chunk.chunk_id] = vector_ids
+
+    def commit_run(self) -> dict[str, list[str]]:
+        """Record the pages ingested during the run
+
+        Returns:
+            dict[str, list[str]]: ids of the previous versions of the pages which are not overwritten, per namespace. Should be deleted
+        """
+        stale: dict[str, list[str]] = {}
+        incomplete = 0
+        with self._lock:
+            for key, run in self._runs.items():
+                if any(
+                    chunk_id not in run.ingested and run.previous_chunks.get(chunk_id, {}).get("hash") != chunk_hash
+                    for chunk_id, chunk_hash in run.chunk_hashes.items()
+                ):
+                    # some changed chunks are not ingested. keep the previous record, and ingest the page again on the next run
+                    incomplete += 1
+                    continue
+                chunks = {
+                    chunk_id: {
+                        "hash": chunk_hash,
+                        "ids": run.ingested.get(chunk_id) or run.previous_chunks.get(chunk_id, {}).get("ids", {}),
+                    }
+                    for chunk_id, chunk_hash in run.chunk_hashes.items()
+                }
+                if not run.ingested and chunks == run.previous_chunks:
+                    continue
+                
+                vector_ids: dict[str, list[str]] = {}
+                for chunk in chunks.values():
+                    for namespace, ids in chunk["ids"].items():
+                        vector_ids.setdefault(namespace, []).extend(ids)
+                for namespace, ids in run.previous_ids.items():
+                    if (stale_ids := sorted(set(ids) - set(vector_ids.get(namespace, [])))):
+                        stale.setdefault(namespace, []).extend(stale_ids)
+                
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pages (scope, doc_id, page, content_hash, vector_ids, chunks, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.scope, *key, self.content_hash(run.chunk_hashes.values()), json.dumps(vector_ids), json.dumps(chunks), time.time())
+                )
+            self._conn.commit()
+        if incomplete:
+            msg.warn(f"{incomplete} pages are not fully ingested. They will be ingested again on the next run")
+        return stale
+
+    def get_hash(self, key: PageKey) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM pages WHERE scope = ? AND doc_id = ? AND page = ?",
+                (self.scope, *key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def stale_pages(self, prune_missing: bool = False) -> dict[PageKey, dict[str, list[str]]]:
+        """Recorded pages which are not seen during the current run.
+        Only the documents seen during the run are considered, since the others might be just not loaded.
+
+        Args:
+            prune_missing (bool): consider the documents not seen during the run as removed, too.
+                Set only if the run covered the entire corpus.
+
+        Returns:
+            dict[PageKey, dict[str, list[str]]]: vector ids of the stale pages, per namespace
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, page, vector_ids FROM pages WHERE scope = ?", (self.scope,)
+            ).fetchall()
+            return {
+                (doc_id, page): json.loads(vector_ids)
+                for doc_id, page, vector_ids in rows
+                if (doc_id, page) not in self._seen_pages and (prune_missing or doc_id in self._seen_docs)
+            }
+
+    def remove(self, keys: Iterable[PageKey]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM pages WHERE scope = ? AND doc_id = ? AND page = ?",
+                [(self.scope, *key) for key in keys]
+            )
+            self._conn.commit()
+
+    def reset_run(self) -> None:
+        with self._lock:
+            self._seen_pages.clear()
+            self._seen_docs.clear()
+            self._runs.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages WHERE scope = ?", (self.scope,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
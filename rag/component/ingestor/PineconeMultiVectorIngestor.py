@@ -1,65 +1,101 @@
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Any
 from wasabi import msg
-import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 import itertools
-import random
-import os
+import json
+import threading
 
 from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable, RunnableLambda, RunnableParallel, RunnablePassthrough
 
 from rag.component.ingestor.base import BaseRAGIngestor
 from rag.component.ingestor.PineconeVectorstoreIngestor import PineconeVectorstoreIngestor
+from rag.component.ingestor.IngestionManifest import IngestionManifest
 from rag.type import Chunk
-from rag.component import chunker, embeddings, llm
+from rag.component import chunker, embeddings, llm, ratelimit
+from rag.component.llm.ratelimit import ExponentialBackoff # backward compatibility
+from rag.component.cache import GenerationCache
 from rag.component.ingestor import prompt
 from rag.util import time_logger
+from rag import util
 from rag.config import IngestionConfig
 
-class ExponentialBackoff:
-    def __init__(self, initial_delay=1, max_delay=60, factor=2, jitter=True):
-        self.initial_delay = initial_delay
-        self.max_delay = max_delay
-        self.factor = factor
-        self.jitter = jitter
-
-    def get_delay(self, attempt):
-        delay = self.initial_delay * (self.factor ** attempt)
-        if self.jitter:
-            delay += random.uniform(0, 1)  # Add some randomness to avoid thundering herd
-        return min(delay, self.max_delay)
-
-def retry_with_exponential_backoff(func, max_retries=5, backoff=ExponentialBackoff(initial_delay=30, max_delay=120)):
-    for attempt in range(max_retries):
-        try:
-            return func()
-        except Exception as e:
-            if attempt < max_retries - 1:
-                delay = backoff.get_delay(attempt)
-                print(f"Attempt {attempt + 1} failed: {e}. Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print(f"Attempt {attempt + 1} failed: {e}. No more retries.")
-                raise
-
-def generate_chunks_with_retries(chunk_generator: "ChunkGenerator", chunks: list[Chunk]) -> list[Chunk]:
-    def generate_chunks():
-        return chunk_generator.generate(chunks)
-    
-    return retry_with_exponential_backoff(generate_chunks)
-
 class ChunkGenerator:
+    """Generates child chunks of the parent chunks: splits, summaries and hypothetical queries.
+    LLM calls are scheduled by the rate limiter shared by all the callers of the model,
+    and a failed call is retried alone, without discarding the rest of the batch.
+    
+    Args:
+        llm_model_name (str): LLM model name
+        parent_id_key (str): key of the parent chunk id in the child chunk metadata
+        lang (str): language of the generated chunks
+        rate_limiter (Optional[RateLimiter]): rate limiter of the LLM. Shared limiter of the model if not provided
+        max_concurrency (int): maximum number of concurrent LLM calls per generation step
+        generation_cache (Optional[GenerationCache]): cache of the summaries and hypothetical queries. Not cached if not provided
+    """
+    # prompt template and completion, in addition to the chunk text
+    ESTIMATED_OVERHEAD_TOKENS = 500
+    
     def __init__(
         self, 
         llm_model_name: str = "gpt-4o-mini",
         parent_id_key: str = "parent_id",
         lang: str = "English",
+        rate_limiter: Optional[ratelimit.RateLimiter] = None,
+        max_concurrency: int = 16,
+        generation_cache: Optional[GenerationCache] = None,
     ) -> None:
         self.llm_model_name = llm_model_name
         self.parent_id_key = parent_id_key
         self.lang = lang
+        self.rate_limiter = rate_limiter or ratelimit.get_limiter(llm_model_name)
+        self.max_concurrency = max_concurrency
+        self.generation_cache = generation_cache
+    
+    def _get_llm(self):
+        if llm.get_provider(self.llm_model_name) == "openai":
+            # expose rate limit headers, and leave the retries to the rate limiter.
+            # without fallbacks, which would swallow the rate limit errors of the model
+            return llm.get_model(self.llm_model_name, include_response_headers=True, max_retries=0, with_fallbacks=False)
+        return llm.get_model(self.llm_model_name)
+    
+    def _batch(self, chain: Runnable, inputs: list[dict]) -> list[str]:
+        """`chain.batch`, with each input scheduled and retried individually"""
+        config = {"callbacks": [ratelimit.RateLimitCallbackHandler(self.rate_limiter)]}
+        
+        def _invoke(input: dict) -> str:
+            tokens = ratelimit.estimate_tokens(input["text"]) + self.ESTIMATED_OVERHEAD_TOKENS
+            return self.rate_limiter.run(lambda: chain.invoke(input, config=config), tokens=tokens)
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(_invoke, inputs))
+    
+    def _generate(self, prompt_template: ChatPromptTemplate, chunks: list[Chunk], **params) -> list[str]:
+        """Generate an output per chunk with the prompt, reusing the cached generations of the same chunk text.
+        Metadata is not a part of the cache key, so that a metadata fix does not invalidate the generations.
+        """
+        prompt_template = prompt_template.partial(lang=self.lang)
+        inputs = [{**params, "text": chunk.text, "doc_meta": chunk.doc_meta, "chunk_meta": chunk.chunk_meta} for chunk in chunks]
+        chain = prompt_template | self._get_llm() | StrOutputParser()
+        if self.generation_cache is None:
+            return self._batch(chain, inputs)
+        
+        template_hash = util.generate_id(json.dumps([prompt_template.to_json(), params], sort_keys=True, default=str))
+        texts = [chunk.text for chunk in chunks]
+        outputs = self.generation_cache.get_many(template_hash, self.llm_model_name, self.lang, texts)
+        
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            generated = self._batch(chain, [inputs[i] for i in missing])
+            for i, output in zip(missing, generated):
+                outputs[i] = output
+            self.generation_cache.put_many(template_hash, self.llm_model_name, self.lang, [texts[i] for i in missing], generated)
+        
+        msg.info(f"{len(chunks) - len(missing)}/{len(chunks)} generations reused from the cache")
+        return outputs
         
     def generate(self, chunks: list[Chunk]) -> list[Chunk]:
         parallel_chain = RunnableParallel(
@@ -109,8 +145,7 @@ class ChunkGenerator:
         ):
             chunks = list(chunks)
         
-            chain = prompt.summarize_prompt.partial(lang=self.lang) | llm.get_model(self.llm_model_name) | StrOutputParser()
-            summaries = chain.batch([{"text": chunk.text, "doc_meta": chunk.doc_meta, "chunk_meta": chunk.chunk_meta} for chunk in chunks])
+            summaries = self._generate(prompt.summarize_prompt, chunks)
             new_chunks = []
             for chunk, summary in zip(chunks, summaries):
                 new_chunk_id = f"{chunk.chunk_id}-summary"
@@ -133,8 +168,7 @@ class ChunkGenerator:
         ):
             chunks = list(chunks)
         
-            chain = prompt.hypothetical_queries_prompt.partial(lang=self.lang) | llm.get_model(self.llm_model_name) | StrOutputParser()
-            queries_list = chain.batch([{"n": 3 , "text": chunk.text, "doc_meta": chunk.doc_meta, "chunk_meta": chunk.chunk_meta} for chunk in chunks])
+            queries_list = self._generate(prompt.hypothetical_queries_prompt, chunks, n=3)
             
             new_chunks = []
             for chunk, queries in zip(chunks, queries_list):
@@ -155,9 +189,27 @@ class ChunkGenerator:
                 new_chunks.extend(_new_chunks)
             return new_chunks
 
+class _GenerationJob:
+    """Parent chunks of a batch, tracked until the parent chunks and all their child chunks are ingested"""
+    def __init__(self, chunks: list[Chunk]) -> None:
+        self.chunks = chunks
+        self.children: Optional[list[Chunk]] = None
+        self.pending_children = 0
+        self.parent_upserted = False
+        self.recorded = False
+
 class PineconeMultiVectorIngestor(BaseRAGIngestor):
+    """Ingests the parent chunks, and the child chunks generated from them (splits, summaries and hypothetical queries)
+    into separate namespaces. Parent chunks are upserted as soon as they are prepared,
+    while the child chunks are generated on a separate worker pool and upserted in batches of `child_batch_size` vectors.
+    
+    Args:
+        generation_workers (int): number of parent batches whose child chunks are generated concurrently
+        child_batch_size (int): number of child chunks in an upsert batch
+    """
     CHILD_INGESTION_CNT: int = 0
     INGEST_FROM_SCRATCH: bool = True # Set to False to skip already ingested chunks
+    _lock = threading.Lock() # guards the class counters, shared by the pipeline workers
     
     def __init__(
         self,
@@ -165,90 +217,234 @@ class PineconeMultiVectorIngestor(BaseRAGIngestor):
         parent_namespace: str,
         child_namespace: str,
         source_lang: str = "English",
-        ingestion_log_path: Optional[str] = "ingestor_logs.txt",
+        manifest_path: Optional[str] = "ingestion_manifest.sqlite",
+        generation_cache_path: Optional[str] = None,
+        generation_cache_max_entries: Optional[int] = None,
+        vectorstore: str = "pinecone",
+        llm_model_name: str = "gpt-4o-mini",
+        llm_rpm: Optional[int] = None,
+        llm_tpm: Optional[int] = None,
+        generation_concurrency: int = 16,
+        generation_workers: int = 4,
+        child_batch_size: int = 200,
+        **vectorstore_kwargs,
     ) -> None:
         super().__init__()
         self.parent_ingestor = PineconeVectorstoreIngestor(
             embeddings=embeddings,
-            namespace=parent_namespace
+            namespace=parent_namespace,
+            vectorstore=vectorstore,
+            **vectorstore_kwargs,
         )
         self.child_ingestor = PineconeVectorstoreIngestor(
             embeddings=embeddings,
-            namespace=child_namespace
+            namespace=child_namespace,
+            vectorstore=vectorstore,
+            **vectorstore_kwargs,
         )
         self._embeddings = embeddings
         self._parent_namespace = parent_namespace
         self._child_namespace = child_namespace
         self._source_lang = source_lang
+        self._llm_model_name = llm_model_name
+        self._parent_id_key = "parent_id"
+        self._rate_limiter = ratelimit.get_limiter(llm_model_name, rpm=llm_rpm, tpm=llm_tpm)
+        self._generation_concurrency = generation_concurrency
+        self._child_batch_size = child_batch_size
+        
+        self._generation_executor = ThreadPoolExecutor(max_workers=generation_workers)
+        self._generation_slots = threading.BoundedSemaphore(4 * generation_workers)
+        self._generation_futures: set[Future] = set()
+        self._child_buffer: list[tuple[Chunk, _GenerationJob]] = []
+        self._buffer_lock = threading.RLock()
         
-        self.ingestion_log: dict[str, set] = {}
-        if os.path.exists(ingestion_log_path):
-            with open(ingestion_log_path, "r") as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-                    doc_id, page = line.strip().split(",")
-                    if doc_id not in self.ingestion_log:
-                        self.ingestion_log[doc_id] = set()
-                    self.ingestion_log[doc_id].add(int(page))
+        self.generation_cache = GenerationCache(generation_cache_path, max_entries=generation_cache_max_entries) if generation_cache_path else None
+        self.manifest = IngestionManifest(manifest_path, scope=f"{parent_namespace}/{child_namespace}") if manifest_path else None
     
-    def ingest(self, chunks: list[Chunk]) -> int:
-        """In addition to the parent ingestion, this ingestor also chunks further and ingests the chunks into the child namespace.
+    def prepare(self, chunks: list[Chunk]) -> Iterable[tuple[str, Any]]:
+        """In addition to the parent chunks, this ingestor also chunks further to generate child chunks.
+        Parent chunks are yielded immediately, while their child chunks are generated in the background.
+        Generated child chunks are buffered across the batches, and yielded in batches of `child_batch_size` vectors.
  
         Args:
             chunks (list[Chunk]): List of chunks to ingest
 
         Returns:
-            bool: True if ingestion is successful
+            Iterable[tuple[str, Any]]: ("parent", job) and ("child", [(child chunk, job), ...]) units
         """
         
-        if not PineconeMultiVectorIngestor.INGEST_FROM_SCRATCH:
-            # Filter out already ingested chunks
-            filtered_chunks = [c for c in chunks if c.doc_id not in self.ingestion_log or c.chunk_meta.get("page") not in self.ingestion_log[c.doc_id]]
-            if len(filtered_chunks) != len(chunks):
-                msg.warn(f"Skipping {len(chunks) - len(filtered_chunks)} already ingested chunks")
-            chunks = filtered_chunks
+        if self.manifest is not None:
+            # pages are marked as seen even if ingested from scratch, to find the stale pages in `finalize`
+            changed_chunks = self.manifest.filter_changed(chunks)
+            if not PineconeMultiVectorIngestor.INGEST_FROM_SCRATCH:
+                # Filter out unchanged chunks
+                if len(changed_chunks) != len(chunks):
+                    msg.warn(f"Skipping {len(chunks) - len(changed_chunks)} unchanged chunks")
+                chunks = changed_chunks
         
+        num_chunk_ids = len(set([c.chunk_id for c in chunks]))
         if len(chunks) == 0:
             msg.warn("No new chunks to ingest")
-            return 0
-        
-        msg.info(f"Ingesting {len(chunks)} chunks")
-        chunk_generator = ChunkGenerator(lang=self._source_lang)
-        children_chunks = generate_chunks_with_retries(chunk_generator, chunks)
+        elif len(chunks) != num_chunk_ids:
+            # checked before the generation, so that no child chunk points to a parent chunk which is never upserted
+            msg.warn(f"Duplicate chunk ids found in parent chunks. # of chunks: {len(chunks)}, # of unique chunk ids: {num_chunk_ids}. Skipping the batch...")
+        else:
+            msg.info(f"Ingesting {len(chunks)} chunks")
+            job = _GenerationJob(chunks)
+            # bounds the parent chunks waiting for the generation
+            self._generation_slots.acquire()
+            future = self._generation_executor.submit(self._generate, job)
+            with self._buffer_lock:
+                self._generation_futures.add(future)
+            future.add_done_callback(self._on_generated)
+            yield "parent", job
         
-        parent_ingestion_cnt = self.parent_ingestor.ingest(chunks)
-        child_ingestion_cnt = self.child_ingestor.ingest(children_chunks)
-        PineconeMultiVectorIngestor.CHILD_INGESTION_CNT += child_ingestion_cnt
-
-        num_chunk_ids = len(set([c.chunk_id for c in chunks]))
-        if len(chunks) != num_chunk_ids:
-            msg.warn(f"Duplicate chunk ids found in parent chunks. # of chunks: {len(chunks)}, # of unique chunk ids: {num_chunk_ids}")
-            return 0
+        yield from self._drain_children(full_only=True)
+    
+    def flush(self) -> Iterable[tuple[str, Any]]:
+        """Wait for the child chunks being generated, and yield all the buffered ones"""
+        while True:
+            with self._buffer_lock:
+                futures = list(self._generation_futures)
+            if not futures:
+                break
+            wait(futures)
+        yield from self._drain_children(full_only=False)
+    
+    def _generate(self, job: "_GenerationJob") -> None:
+        chunk_generator = ChunkGenerator(
+            llm_model_name=self._llm_model_name,
+            parent_id_key=self._parent_id_key,
+            lang=self._source_lang, 
+            rate_limiter=self._rate_limiter, 
+            max_concurrency=self._generation_concurrency,
+            generation_cache=self.generation_cache,
+        )
+        children_chunks = chunk_generator.generate(job.chunks)
         
         num_child_chunk_ids = len(set([c.chunk_id for c in children_chunks]))
         if len(children_chunks) != num_child_chunk_ids:
-            msg.warn(f"Duplicate chunk ids found in child chunks. # of chunks: {len(children_chunks)}, # of unique chunk ids: {num_child_chunk_ids}")
-            return 0
+            raise ValueError(f"Duplicate chunk ids found in child chunks. # of chunks: {len(children_chunks)}, # of unique chunk ids: {num_child_chunk_ids}")
+        
+        with self._buffer_lock:
+            job.children = children_chunks
+            job.pending_children = len(children_chunks)
+            self._child_buffer.extend((child, job) for child in children_chunks)
+        self._maybe_complete(job)
+    
+    def _on_generated(self, future: Future) -> None:
+        with self._buffer_lock:
+            self._generation_futures.discard(future)
+        self._generation_slots.release()
+        if (e := future.exception()) is not None:
+            # parent chunks are not recorded in the manifest, and will be ingested again on the next run
+            msg.fail(f"Child chunk generation failed: {e}")
+    
+    def _drain_children(self, full_only: bool) -> Iterable[tuple[str, list[tuple[Chunk, "_GenerationJob"]]]]:
+        while True:
+            with self._buffer_lock:
+                if not self._child_buffer or (full_only and len(self._child_buffer) < self._child_batch_size):
+                    return
+                batch = self._child_buffer[:self._child_batch_size]
+                del self._child_buffer[:self._child_batch_size]
+            yield "child", batch
+    
+    def upsert(self, unit: tuple[str, Any]) -> int:
+        """Ingest the parent chunks into the parent namespace, or a batch of child chunks into the child namespace.
+        Parent chunks are marked as ingested in the manifest once they and all their child chunks are ingested.
+
+        Returns:
+            int: number of ingested parent chunks
+        """
+        kind, payload = unit
+        if kind == "parent":
+            return self._upsert_parents(payload)
+        self._upsert_children(payload)
+        return 0
     
+    def _upsert_parents(self, job: "_GenerationJob") -> int:
+        chunks = job.chunks
+        parent_ingestion_cnt = self.parent_ingestor.upsert(chunks)
         msg.good(f"{len(chunks)} chunks ingested into parent namespace `{self.parent_ingestor.namespace}`")
+        
+        with self._buffer_lock:
+            job.parent_upserted = True
+        self._maybe_complete(job)
+        return parent_ingestion_cnt
+    
+    def _upsert_children(self, batch: list[tuple[Chunk, "_GenerationJob"]]) -> None:
+        children_chunks = [child for child, _ in batch]
+        child_ingestion_cnt = self.child_ingestor.upsert(children_chunks)
+        with PineconeMultiVectorIngestor._lock:
+            PineconeMultiVectorIngestor.CHILD_INGESTION_CNT += child_ingestion_cnt
         msg.good(f"{len(children_chunks)} chunks ingested into child namespace `{self.child_ingestor.namespace}`")
         
-        # print(f"Ingested chunks:")
-        logs = ""
-        for c in chunks:
-            if c.chunk_meta.get("page") is None:
-                msg.warn(f"Page number not found for chunk {c.chunk_id}. Skipping logging...")
-                continue
-            logs += f"{c.doc_id},{c.chunk_meta['page']}\n"
-            
-            if c.doc_id not in self.ingestion_log:
-                self.ingestion_log[c.doc_id] = set()
-            self.ingestion_log[c.doc_id].add(c.chunk_meta["page"])
-        with open("ingestor_logs.txt", "a") as f:
-            f.write(logs)
+        jobs = {}
+        with self._buffer_lock:
+            for _, job in batch:
+                job.pending_children -= 1
+                jobs[id(job)] = job
+        for job in jobs.values():
+            self._maybe_complete(job)
+    
+    def _maybe_complete(self, job: "_GenerationJob") -> None:
+        with self._buffer_lock:
+            if job.recorded or not job.parent_upserted or job.children is None or job.pending_children > 0:
+                return
+            job.recorded = True
+        if self.manifest is not None:
+            self._mark_ingested(job.chunks, job.children)
+    
+    def _mark_ingested(self, chunks: list[Chunk], children_chunks: list[Chunk]) -> None:
+        """Mark the parent chunks as ingested in the manifest, with the ids of their vectors.
+        Pages are recorded in `finalize`, as their chunks may span several jobs.
+        """
+        children_ids: dict[str, list[str]] = {c.chunk_id: [] for c in chunks}
+        for child in children_chunks:
+            if (parent_id := child.chunk_meta.get(self._parent_id_key)) in children_ids:
+                children_ids[parent_id].append(child.chunk_id)
         
-        return parent_ingestion_cnt
+        for chunk in chunks:
+            self.manifest.mark_ingested(chunk, {
+                self._parent_namespace: [chunk.chunk_id],
+                self._child_namespace: children_ids[chunk.chunk_id],
+            })
+    
+    def _delete(self, ids_by_namespace: dict[str, list[str]]) -> None:
+        vectorstores = {
+            self._parent_namespace: self.parent_ingestor.vectorstore,
+            self._child_namespace: self.child_ingestor.vectorstore,
+        }
+        for namespace, ids in ids_by_namespace.items():
+            if ids and namespace in vectorstores:
+                vectorstores[namespace].delete(ids)
+    
+    def finalize(self, prune_missing: bool = False) -> int:
+        """Ingest the remaining child chunks, record the ingested pages, and delete the vectors of the pages which disappeared since the last run"""
+        for unit in self.flush():
+            self.upsert(unit)
+        
+        if self.generation_cache is not None:
+            stats = self.generation_cache.stats()
+            msg.info(f"Generation cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']:.1%})")
+            self.generation_cache.reset_stats()
+        
+        if self.manifest is None:
+            return 0
+        
+        # delete the vectors of the previous versions of the pages which are not overwritten
+        # (e.g. a page split into fewer child chunks than before)
+        self._delete(self.manifest.commit_run())
+        
+        stale_pages = self.manifest.stale_pages(prune_missing=prune_missing)
+        for key, ids_by_namespace in stale_pages.items():
+            self._delete(ids_by_namespace)
+        self.manifest.remove(stale_pages.keys())
+        self.manifest.reset_run()
+        
+        if stale_pages:
+            msg.good(f"Deleted vectors of {len(stale_pages)} stale pages")
+        return len(stale_pages)
     
     @classmethod
     def from_config(cls, config: IngestionConfig) -> "PineconeMultiVectorIngestor":
@@ -256,7 +452,13 @@ class PineconeMultiVectorIngestor(BaseRAGIngestor):
         parent_namespace = config.namespace
         child_namespace = config.sub_namespace
         
-        embeddings_model = embeddings.get_model(embeddings_name)
+        embeddings_model = embeddings.get_model(
+            embeddings_name,
+            cache_path=config.embeddings_cache_path,
+            cache_max_entries=config.embeddings_cache_max_entries,
+            rpm=config.embeddings_rpm,
+            tpm=config.embeddings_tpm,
+        )
         
         source_lang = config.global_.lang.source
         
@@ -265,4 +467,19 @@ class PineconeMultiVectorIngestor(BaseRAGIngestor):
             parent_namespace=parent_namespace,
             child_namespace=child_namespace,
             source_lang=source_lang,
+            vectorstore=config.vectorstore,
+            local_path=config.local_path,
+            local_index=config.local_index,
+            embedding_batch_size=config.embedding_batch_size,
+            upsert_batch_size=config.upsert_batch_size,
+            upsert_payload_bytes=config.upsert_payload_bytes,
+            pool_threads=config.upsert_pool_threads,
+            llm_rpm=config.llm_rpm,
+            llm_tpm=config.llm_tpm,
+            generation_concurrency=config.generation_concurrency,
+            generation_workers=config.generation_workers,
+            child_batch_size=config.child_batch_size,
+            manifest_path=config.manifest_path,
+            generation_cache_path=config.generation_cache_path,
+            generation_cache_max_entries=config.generation_cache_max_entries,
         )
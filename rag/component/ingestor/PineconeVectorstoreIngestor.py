@@ -3,7 +3,7 @@ from typing import Optional
 
 from rag.type import *
 from rag.component.ingestor.base import BaseRAGIngestor
-from rag.component.vectorstore.PineconeVectorstore import PineconeVectorstore
+from rag.component.vectorstore.vectorstore import get_vectorstore
 from rag.component import embeddings
 from rag.config import IngestionConfig
 
@@ -12,25 +12,42 @@ class PineconeVectorstoreIngestor(BaseRAGIngestor):
         self,
         embeddings: Embeddings, 
         namespace: Optional[str] = None,
+        vectorstore: str = "pinecone",
+        **vectorstore_kwargs,
     ) -> None:
         super().__init__()
-        self.vectorstore = PineconeVectorstore(
+        self.vectorstore = get_vectorstore(
+            vectorstore,
             embeddings=embeddings,
             namespace=namespace,
+            **vectorstore_kwargs,
         )
         self.namespace = namespace
     
-    def ingest(self, chunks: list[Chunk]) -> int:
-        return self.vectorstore.ingest(chunks)
+    def upsert(self, unit: list[Chunk]) -> int:
+        return self.vectorstore.ingest(unit)
     
     @classmethod
     def from_config(cls, config: IngestionConfig) -> "PineconeVectorstoreIngestor":
         embeddings_name = config.embeddings
         namespace = config.namespace
         
-        embeddings_model = embeddings.get_model(embeddings_name)
+        embeddings_model = embeddings.get_model(
+            embeddings_name,
+            cache_path=config.embeddings_cache_path,
+            cache_max_entries=config.embeddings_cache_max_entries,
+            rpm=config.embeddings_rpm,
+            tpm=config.embeddings_tpm,
+        )
         
         return cls(
             embeddings=embeddings_model,
             namespace=namespace,
+            vectorstore=config.vectorstore,
+            local_path=config.local_path,
+            local_index=config.local_index,
+            embedding_batch_size=config.embedding_batch_size,
+            upsert_batch_size=config.upsert_batch_size,
+            upsert_payload_bytes=config.upsert_payload_bytes,
+            pool_threads=config.upsert_pool_threads,
         )
\ No newline at end of file
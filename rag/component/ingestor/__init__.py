@@ -1,9 +1,13 @@
 from rag.component.ingestor.base import BaseRAGIngestor
 from rag.component.ingestor.PineconeVectorstoreIngestor import PineconeVectorstoreIngestor
 from rag.component.ingestor.PineconeMultiVectorIngestor import PineconeMultiVectorIngestor
+from rag.component.ingestor.pipeline import IngestionPipeline
+from rag.component.ingestor.IngestionManifest import IngestionManifest
 
 __all__ = [
     "BaseRAGIngestor",
     "PineconeVectorstoreIngestor",
-    "PineconeMultiVectorIngestor"
+    "PineconeMultiVectorIngestor",
+    "IngestionPipeline",
+    "IngestionManifest",
 ]
\ No newline at end of file
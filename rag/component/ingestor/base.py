@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, Any
 
 from rag.type import *
 
@@ -7,8 +7,49 @@ class BaseRAGIngestor:
         pass
     
     def ingest(self, chunks: list[Chunk]) -> int:
+        return sum(self.upsert(unit) for unit in self.prepare(chunks))
+    
+    def prepare(self, chunks: list[Chunk]) -> Iterable[Any]:
+        """Prepare a batch of chunks for the upsert, e.g. generating additional chunks.
+        Split into `prepare` and `upsert` so that the stages can be pipelined. See `IngestionPipeline`.
+        By default, the batch itself is the unit of upsert.
+
+        Args:
+            chunks (list[Chunk]): batch of chunks
+
+        Returns:
+            Iterable[Any]: units to pass to `upsert`
+        """
+        yield chunks
+    
+    def flush(self) -> Iterable[Any]:
+        """Units buffered across the batches by `prepare`. Called once all the batches are prepared.
+        By default, nothing is buffered.
+
+        Returns:
+            Iterable[Any]: remaining units to pass to `upsert`
+        """
+        return []
+    
+    def upsert(self, unit: Any) -> int:
+        """Upsert a prepared unit
+
+        Returns:
+            int: number of ingested chunks
+        """
         raise NotImplementedError()
     
+    def finalize(self, prune_missing: bool = False) -> int:
+        """Finish an ingestion run, e.g. cleaning up the stale vectors. Called after all the units are upserted.
+
+        Args:
+            prune_missing (bool): whether the documents not ingested during the run are removed from the corpus
+
+        Returns:
+            int: number of removed pages
+        """
+        return 0
+    
     @classmethod
     def from_config(cls, config: dict) -> "BaseRAGIngestor":
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
@@ -0,0 +1,138 @@
+from typing import Iterable, Optional, Callable
+from wasabi import msg
+from concurrent.futures import ThreadPoolExecutor, Future
+import queue
+import threading
+
+from rag.type import *
+from rag.component.ingestor.base import BaseRAGIngestor
+
+_END_OF_STAGE = object()
+
+class IngestionPipeline:
+    """Staged ingestion pipeline with bounded queues between the stages.
+        load: iterate chunks of each document, and group them into batches
+        prepare: `ingestor.prepare` each batch (e.g. LLM generation of child chunks), and `ingestor.flush` at the end
+        upsert: `ingestor.upsert` each prepared unit (embedding and upsert)
+
+    Each stage runs its own workers, so that loading the next document overlaps
+    the generation and the upsert of the previous ones.
+    Bounded queues apply backpressure to the upstream stages, keeping the memory bounded.
+    A failed batch is logged and skipped, without stopping the pipeline.
+
+    Args:
+        ingestor (BaseRAGIngestor): ingestor to prepare and upsert the chunks
+        batch_size (int): number of chunks in a batch
+        load_workers (int): number of documents loaded concurrently
+        prepare_workers (int): number of batches prepared concurrently
+        upsert_workers (int): number of units upserted concurrently
+        queue_size (int): maximum number of items waiting between the stages
+    """
+    def __init__(
+        self,
+        ingestor: BaseRAGIngestor,
+        batch_size: int = 20,
+        load_workers: int = 2,
+        prepare_workers: int = 4,
+        upsert_workers: int = 2,
+        queue_size: int = 8,
+    ) -> None:
+        self.ingestor = ingestor
+        self.batch_size = batch_size
+        self.load_workers = load_workers
+        self.prepare_workers = prepare_workers
+        self.upsert_workers = upsert_workers
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+        self.ingested_cnt = 0
+        self.failed_batches = 0
+
+    def run(self, sources: Iterable[Callable[[], Iterable[Chunk]]]) -> int:
+        """Run the pipeline until all the sources are ingested
+
+        Args:
+            sources (Iterable[Callable[[], Iterable[Chunk]]]): one callable per document, returning its chunks.
+                Called in the load stage, so that expensive loader initialization is also pipelined.
+
+        Returns:
+            int: number of ingested chunks
+        """
+        source_queue: queue.Queue = queue.Queue(maxsize=self.load_workers)
+        batch_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        unit_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        total_workers = self.load_workers + self.prepare_workers + self.upsert_workers
+        with ThreadPoolExecutor(max_workers=total_workers) as executor:
+            loaders = [executor.submit(self._load_worker, source_queue, batch_queue) for _ in range(self.load_workers)]
+            preparers = [executor.submit(self._prepare_worker, batch_queue, unit_queue) for _ in range(self.prepare_workers)]
+            upserters = [executor.submit(self._upsert_worker, unit_queue) for _ in range(self.upsert_workers)]
+
+            try:
+                for source in sources:
+                    source_queue.put(source)
+            finally:
+                self._close(source_queue, self.load_workers)
+                self._close(batch_queue, self.prepare_workers, wait_for=loaders)
+                for future in preparers:
+                    future.result()
+                self._flush(unit_queue)
+                self._close(unit_queue, self.upsert_workers)
+                for future in upserters:
+                    future.result()
+
+        if self.failed_batches:
+            msg.warn(f"{self.failed_batches} batches failed during ingestion")
+        return self.ingested_cnt
+
+    @staticmethod
+    def _close(q: queue.Queue, consumer_cnt: int, wait_for: Optional[list[Future]] = None) -> None:
+        """Signal the end of the stage to its consumers, after the producers are done"""
+        for future in wait_for or []:
+            future.result()
+        for _ in range(consumer_cnt):
+            q.put(_END_OF_STAGE)
+
+    def _load_worker(self, source_queue: queue.Queue, batch_queue: queue.Queue) -> None:
+        while (source := source_queue.get()) is not _END_OF_STAGE:
+            batch = []
+            try:
+                for chunk in source():
+                    batch.append(chunk)
+                    if len(batch) == self.batch_size:
+                        batch_queue.put(batch)
+                        batch = []
+            except Exception as e:
+                self._fail("load", e)
+            if batch:
+                batch_queue.put(batch)
+
+    def _prepare_worker(self, batch_queue: queue.Queue, unit_queue: queue.Queue) -> None:
+        while (batch := batch_queue.get()) is not _END_OF_STAGE:
+            try:
+                for unit in self.ingestor.prepare(batch):
+                    unit_queue.put(unit)
+            except Exception as e:
+                self._fail("prepare", e)
+
+    def _flush(self, unit_queue: queue.Queue) -> None:
+        """Pass the units buffered by the ingestor across the batches"""
+        try:
+            for unit in self.ingestor.flush():
+                unit_queue.put(unit)
+        except Exception as e:
+            self._fail("flush", e)
+    
+    def _upsert_worker(self, unit_queue: queue.Queue) -> None:
+        while (unit := unit_queue.get()) is not _END_OF_STAGE:
+            try:
+                cnt = self.ingestor.upsert(unit)
+                with self._lock:
+                    self.ingested_cnt += cnt or 0
+            except Exception as e:
+                self._fail("upsert", e)
+
+    def _fail(self, stage: str, e: Exception) -> None:
+        msg.fail(f"Ingestion failed at {stage} stage: {e}")
+        with self._lock:
+            self.failed_batches += 1
@@ -1,5 +1,9 @@
 from wasabi import msg
-from typing import Optional
+from typing import Optional, Any, Callable
+import asyncio
+import threading
+
+import httpx
 
 from rag.type import AnyLanguageModel
 
@@ -15,21 +19,155 @@ model_providers = {
     ]
 }
 
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# models are memoized by (model_name, kwargs), and share pooled http clients,
+# so that connections (and TLS handshakes) are reused across requests
+_registry: dict[tuple, AnyLanguageModel] = {}
+_registry_lock = threading.Lock()
+_registry_stats = {"hits": 0, "misses": 0}
+
+_http_limits = httpx.Limits(
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+)
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional["_LoopLocalAsyncClient"] = None
+
+class _LoopLocalAsyncClient(httpx.AsyncClient):
+    """Async http client handed to the memoized models, which sends the requests with a pooled client per event loop.
+    Pooled connections are bound to the event loop which opened them,
+    so a single client cannot be shared across loops (e.g. successive `asyncio.run` calls, or Streamlit reruns).
+    """
+    def __init__(self, limits: httpx.Limits) -> None:
+        super().__init__(limits=limits, timeout=None)
+        self._limits = limits
+        # by id of the loop. the loop is kept, so that its id is not reused until its client is dropped
+        self._clients: dict[int, tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        self._clients_lock = threading.Lock()
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            # connections of the closed loops cannot be used nor closed anymore
+            for key in [key for key, (other, _) in self._clients.items() if other.is_closed()]:
+                del self._clients[key]
+            _, client = self._clients.get(id(loop), (loop, None))
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(limits=self._limits, timeout=None)
+                self._clients[id(loop)] = (loop, client)
+            return client
+    
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self._get_client().send(request, **kwargs)
+    
+    async def aclose(self) -> None:
+        """Close the client of the running loop"""
+        with self._clients_lock:
+            _, client = self._clients.pop(id(asyncio.get_running_loop()), (None, None))
+        if client is not None:
+            await client.aclose()
+
+# models registered at runtime, e.g. fakes of the offline benchmark. looked up before the providers
+_custom_models: dict[str, Callable[..., AnyLanguageModel]] = {}
+
 def get_provider(model_name: str) -> Optional[str]:
     for provider, models in model_providers.items():
         if model_name in models:
             return provider
     return None
 
+def register_model(model_name: str, factory: Callable[..., AnyLanguageModel]) -> None:
+    """Register a model created by `factory(**kwargs)`, overriding the providers"""
+    with _registry_lock:
+        _custom_models[model_name] = factory
+        # drop the memoized models of the previous factory
+        for key in [key for key in _registry if key[0] == model_name]:
+            del _registry[key]
+
+def configure_http_pool(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+) -> None:
+    """Configure the shared http connection pool.
+    If the limits change, the pool and the memoized models are recreated.
+    """
+    global _http_limits, _http_client, _http_async_client
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    with _registry_lock:
+        if limits == _http_limits:
+            return
+        _http_limits = limits
+        if _http_client is not None:
+            _http_client.close()
+        # async clients cannot be closed outside of their event loops. leave them to the garbage collector
+        _http_client = None
+        _http_async_client = None
+        _registry.clear()
+    msg.info(f"HTTP pool configured: max_connections={max_connections}, max_keepalive_connections={max_keepalive_connections}")
+
+def _get_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """Process-global sync client, and the async client pooling connections per event loop"""
+    global _http_client, _http_async_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=_http_limits, timeout=None)
+    if _http_async_client is None:
+        _http_async_client = _LoopLocalAsyncClient(_http_limits)
+    return _http_client, _http_async_client
+
+def _registry_key(model_name: str, kwargs: dict[str, Any]) -> Optional[tuple]:
+    key = (model_name, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable kwargs (e.g. callbacks). do not memoize
+        return None
+    return key
+
 def get_model(model_name: str, **kwargs) -> Optional[AnyLanguageModel]:
+    """Get the memoized model. Pass `with_fallbacks=False` to get the OpenAI models without the fallback model,
+    e.g. to see the rate limit errors of the model itself
+    """
+    key = _registry_key(model_name, kwargs)
+    if key is None:
+        return _create_model(model_name, **kwargs)
+
+    with _registry_lock:
+        if key in _registry:
+            _registry_stats["hits"] += 1
+            return _registry[key]
+
+        _registry_stats["misses"] += 1
+        model = _create_model(model_name, **kwargs)
+        if model is not None:
+            _registry[key] = model
+        return model
+
+def _create_model(model_name: str, with_fallbacks: bool = True, **kwargs) -> Optional[AnyLanguageModel]:
+    if model_name in _custom_models:
+        return _custom_models[model_name](**kwargs)
+    
     try:
         provider = get_provider(model_name)
-        
+
         if provider == "openai":
             from langchain_openai import ChatOpenAI
-            return ChatOpenAI(model=model_name, **kwargs).with_fallbacks(
+            http_client, http_async_client = _get_http_clients()
+            client_kwargs = {"http_client": http_client, "http_async_client": http_async_client}
+            model = ChatOpenAI(model=model_name, **client_kwargs, **kwargs)
+            if not with_fallbacks:
+                return model
+            return model.with_fallbacks(
                 [
-                    ChatOpenAI(model="gpt-4o-mini", **kwargs),
+                    ChatOpenAI(model="gpt-4o-mini", **client_kwargs, **kwargs),
                 ]
             )
         elif provider == "anthropic":
@@ -40,4 +178,37 @@ def get_model(model_name: str, **kwargs) -> Optional[AnyLanguageModel]:
             return None
     except Exception as e:
         msg.fail(f"Error loading model {model_name} from provider {provider}. Make sure you have installed the required packages.")
-        return None
\ No newline at end of file
+        return None
+
+def _pool_connections(client: Optional[httpx.Client | httpx.AsyncClient]) -> list[Any]:
+    # httpx does not expose the pool publicly. best effort inspection of the httpcore pool
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []))
+
+def get_pool_stats() -> dict[str, Any]:
+    """Statistics of the model registry and the shared http connection pool"""
+    sync_connections = _pool_connections(_http_client)
+    async_connections = []
+    if _http_async_client is not None:
+        # connections are pooled by the client of each event loop
+        with _http_async_client._clients_lock:
+            for _, client in _http_async_client._clients.values():
+                async_connections.extend(_pool_connections(client))
+    connections = sync_connections + async_connections
+    return {
+        "models": len(_registry),
+        "registry_hits": _registry_stats["hits"],
+        "registry_misses": _registry_stats["misses"],
+        "max_connections": _http_limits.max_connections,
+        "max_keepalive_connections": _http_limits.max_keepalive_connections,
+        "connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "sync_connections": len(sync_connections),
+        "async_connections": len(async_connections),
+    }
+
+def clear_registry() -> None:
+    with _registry_lock:
+        _registry.clear()
+        _registry_stats["hits"] = 0
+        _registry_stats["misses"] = 0
@@ -0,0 +1,289 @@
+from typing import Optional, Callable, Awaitable, TypeVar, Any
+from wasabi import msg
+from functools import lru_cache
+import asyncio
+import random
+import re
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+T = TypeVar("T")
+
+class ExponentialBackoff:
+    def __init__(self, initial_delay=1, max_delay=60, factor=2, jitter=True):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+    def get_delay(self, attempt):
+        delay = self.initial_delay * (self.factor ** attempt)
+        if self.jitter:
+            delay += random.uniform(0, 1)  # Add some randomness to avoid thundering herd
+        return min(delay, self.max_delay)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to `capacity` per minute.
+
+    Args:
+        capacity (float): budget per minute
+    """
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_rate = capacity / 60
+        self.updated_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float) -> None:
+        """Block until `amount` is available, and consume it.
+        Requests larger than the capacity wait for a full bucket, and drive it negative.
+        """
+        amount = max(amount, 0)
+        with self._cond:
+            while True:
+                self._refill()
+                if self.tokens >= min(amount, self.capacity):
+                    self.tokens -= amount
+                    return
+                wait = (min(amount, self.capacity) - self.tokens) / self.refill_rate
+                self._cond.wait(timeout=wait)
+
+    def sync(self, remaining: float) -> None:
+        """Align the bucket with the remaining budget reported by the server"""
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+
+
+def _parse_duration(value: str) -> float:
+    """Parse durations of rate limit headers, e.g. `1s`, `6m0s`, `20ms`"""
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+def is_rate_limit_error(e: Exception) -> bool:
+    status_code = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status_code == 429 or "rate limit" in str(e).lower() or "throttl" in str(e).lower()
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # e.g. the encoding cannot be downloaded. not retried on every call
+        msg.warn(f"tiktoken encoding not available: {e}. Estimating tokens by length.")
+        return None
+
+def estimate_tokens(text: str) -> int:
+    if (encoding := _get_encoding()) is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Truncate the text to the first `max_tokens` tokens"""
+    if (encoding := _get_encoding()) is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+class RateLimiter:
+    """Request scheduler shared by all the calls to a model.
+    It keeps the requests-per-minute and tokens-per-minute budgets, follows the `x-ratelimit-*` response headers,
+    and pauses all the callers when the server responds with 429.
+
+    Args:
+        name (str): name of the limited model
+        rpm (Optional[int]): requests per minute. Unlimited if not provided, until the headers report the limit
+        tpm (Optional[int]): tokens per minute. Unlimited if not provided, until the headers report the limit
+        max_retries (int): retries of each failed call
+        backoff (ExponentialBackoff): backoff between the retries, if the server does not tell when to retry
+    """
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_retries: int = 6,
+        backoff: Optional[ExponentialBackoff] = None,
+    ) -> None:
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.backoff = backoff or ExponentialBackoff(initial_delay=1, max_delay=60)
+
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "tokens": 0}
+
+    def set_budgets(self, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        """Apply the budgets which are provided. The budgets not provided are kept"""
+        for kind, capacity in [("requests", rpm), ("tokens", tpm)]:
+            if not capacity:
+                continue
+            with self._lock:
+                bucket: Optional[TokenBucket] = getattr(self, kind)
+                if bucket is not None and bucket.capacity == capacity:
+                    continue
+                new_bucket = TokenBucket(capacity)
+                if bucket is not None:
+                    # the budget already consumed is kept
+                    msg.info(f"Rate limit of {self.name} changed: {bucket.capacity:g} -> {capacity} {kind} per minute")
+                    with bucket._cond:
+                        bucket._refill()
+                        new_bucket.tokens = min(new_bucket.capacity, bucket.tokens)
+                setattr(self, kind, new_bucket)
+
+    def _wait_for_pause(self) -> None:
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int = 0) -> None:
+        self._wait_for_pause()
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None:
+            self.tokens.acquire(tokens)
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def record_usage(self, tokens: int) -> None:
+        with self._lock:
+            self.stats["tokens"] += tokens
+
+    def update_from_headers(self, headers: dict[str, str]) -> None:
+        """Follow the rate limit headers of OpenAI compatible APIs"""
+        headers = {k.lower(): v for k, v in headers.items()}
+        for kind in ["requests", "tokens"]:
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit is None or remaining is None:
+                continue
+
+            with self._lock:
+                bucket: Optional[TokenBucket] = getattr(self, kind)
+                if bucket is None:
+                    # not configured. adopt the limit of the account
+                    bucket = TokenBucket(float(limit))
+                    setattr(self, kind, bucket)
+            # estimated usages drift from the actual ones. the server knows better
+            bucket.sync(float(remaining))
+
+            if float(remaining) <= 0 and (reset := headers.get(f"x-ratelimit-reset-{kind}")):
+                self.pause(_parse_duration(reset))
+
+    def run(self, func: Callable[[], T], tokens: int = 0) -> T:
+        """Call `func` within the budgets, retrying only this call on failure
+
+        Args:
+            func (Callable[[], T]): a single request
+            tokens (int): estimated number of tokens of the request
+
+        Returns:
+            T: result of `func`
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                return func()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    msg.fail(f"[{self.name}] Request failed after {attempt + 1} attempts: {e}")
+                    raise
+
+                delay = self._on_failure(e, attempt)
+                time.sleep(delay)
+    
+    def _on_failure(self, e: Exception, attempt: int) -> float:
+        """Record the failure, and decide the delay before the retry"""
+        delay = self._retry_after(e) or self.backoff.get_delay(attempt)
+        with self._lock:
+            self.stats["retries"] += 1
+        if is_rate_limit_error(e):
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            # every caller of this model backs off, not only this one
+            self.pause(delay)
+        msg.warn(f"[{self.name}] Attempt {attempt + 1} failed: {e}. Retrying in {delay:.1f} seconds...")
+        return delay
+
+    async def arun(self, func: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """Async version of `run`"""
+        for attempt in range(self.max_retries + 1):
+            await asyncio.to_thread(self.acquire, tokens)
+            try:
+                return await func()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    msg.fail(f"[{self.name}] Request failed after {attempt + 1} attempts: {e}")
+                    raise
+                
+                delay = self._on_failure(e, attempt)
+                await asyncio.sleep(delay)
+    
+    @staticmethod
+    def _retry_after(e: Exception) -> Optional[float]:
+        headers = getattr(getattr(e, "response", None), "headers", None)
+        if not headers:
+            return None
+        if (retry_after := headers.get("retry-after")) is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return None
+        if (reset := headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens")):
+            return _parse_duration(reset)
+        return None
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """Feeds the response headers and the token usage of chat models back to the rate limiter.
+    The model should be created with `include_response_headers=True` to expose the headers.
+    """
+    def __init__(self, limiter: RateLimiter) -> None:
+        super().__init__()
+        self.limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if token_usage.get("total_tokens"):
+            self.limiter.record_usage(token_usage["total_tokens"])
+        
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                headers = getattr(message, "response_metadata", {}).get("headers") if message else None
+                if headers:
+                    self.limiter.update_from_headers(headers)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> RateLimiter:
+    """Get the rate limiter shared by all the calls to the model `name`.
+    The budgets provided are applied to the existing limiter
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, rpm=rpm, tpm=tpm)
+        else:
+            _limiters[name].set_budgets(rpm=rpm, tpm=tpm)
+        return _limiters[name]
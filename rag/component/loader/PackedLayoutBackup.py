@@ -0,0 +1,154 @@
+from typing import Iterator, Optional, Literal
+from wasabi import msg
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+PACKED_DIR = "packed"
+PACKED_EXT = ".sqlite"
+
+ContentFormat = Literal["html", "markdown"]
+
+def packed_backup_path(backup_dir: str, file_name_without_ext: str) -> str:
+    return os.path.join(backup_dir, PACKED_DIR, f"{file_name_without_ext}{PACKED_EXT}")
+
+class PackedLayoutBackup:
+    """Layout analysis results of a document, packed into a single SQLite file.
+    Each page is a row with its zlib-compressed HTML and Markdown, and its metadata.
+    Pages are keyed by page number, so a page can be read alone, and all the pages can be read in a single scan.
+
+    Layout:
+        {backup_dir}/packed/{file_name_without_ext}.sqlite
+
+    Args:
+        path (str): path of the packed file
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "page INTEGER PRIMARY KEY, "
+            "html BLOB, "
+            "markdown BLOB, "
+            "metadata TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def put(self, page: int, metadata: dict, html: Optional[str] = None, markdown: Optional[str] = None) -> None:
+        """Write a page. Contents not provided are kept as they are"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (page, html, markdown, metadata) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(page) DO UPDATE SET "
+                "html = COALESCE(excluded.html, html), "
+                "markdown = COALESCE(excluded.markdown, markdown), "
+                "metadata = excluded.metadata",
+                (page, _compress(html), _compress(markdown), json.dumps(metadata))
+            )
+            self._conn.commit()
+
+    def pages(self, content_format: Optional[ContentFormat] = None) -> set[int]:
+        """Backed up pages, with the content of the format if provided"""
+        condition = f"WHERE {content_format} IS NOT NULL" if content_format else ""
+        with self._lock:
+            return {row[0] for row in self._conn.execute(f"SELECT page FROM pages {condition}")}
+
+    def get(self, page: int, content_format: ContentFormat) -> Optional[tuple[str, dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {content_format}, metadata FROM pages WHERE page = ?", (page,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return _decompress(row[0]), json.loads(row[1])
+
+    def iter_pages(self, content_format: ContentFormat) -> Iterator[tuple[int, str, dict]]:
+        """Iterate all the pages with the content of the format, in page order
+
+        Returns:
+            Iterator[tuple[int, str, dict]]: page, content, and metadata
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT page, {content_format}, metadata FROM pages WHERE {content_format} IS NOT NULL ORDER BY page"
+            ).fetchall()
+        for page, content, metadata in rows:
+            yield page, _decompress(content), json.loads(metadata)
+
+    def has_format(self, content_format: ContentFormat) -> bool:
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM pages WHERE {content_format} IS NOT NULL LIMIT 1").fetchone() is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _compress(content: Optional[str]) -> Optional[bytes]:
+    return None if content is None else zlib.compress(content.encode())
+
+def _decompress(blob: bytes) -> str:
+    return zlib.decompress(blob).decode()
+
+def convert_backup_dir(backup_dir: str, metadata_ext: str = ".metadata.json", remove: bool = False) -> int:
+    """Pack the directory layout backup (`{backup_dir}/<html|markdown>/{name}/{name}_{page}.<html|md>`)
+    into one packed file per document.
+
+    Args:
+        backup_dir (str): backup directory
+        metadata_ext (str): extension of the metadata files
+        remove (bool): remove the converted page files
+
+    Returns:
+        int: number of converted documents
+    """
+    content_formats: list[tuple[ContentFormat, str]] = [("html", ".html"), ("markdown", ".md")]
+    documents: dict[str, list[tuple[ContentFormat, str, str]]] = {}
+    for content_format, ext in content_formats:
+        format_dir = os.path.join(backup_dir, content_format)
+        if not os.path.exists(format_dir):
+            continue
+        for name in sorted(os.listdir(format_dir)):
+            if os.path.isdir(os.path.join(format_dir, name)):
+                documents.setdefault(name, []).append((content_format, ext, os.path.join(format_dir, name)))
+
+    for name, sources in documents.items():
+        packed = PackedLayoutBackup(packed_backup_path(backup_dir, name))
+        converted_files = []
+        for content_format, ext, source_dir in sources:
+            for file in os.listdir(source_dir):
+                if not file.endswith(ext):
+                    continue
+                page_path = os.path.join(source_dir, file)
+                page = int(os.path.splitext(file)[0].split("_")[-1])
+                with open(page_path, "r") as f:
+                    content = f.read()
+
+                metadata_path = f"{page_path}{metadata_ext}"
+                metadata = {}
+                if os.path.exists(metadata_path):
+                    with open(metadata_path, "r") as f:
+                        metadata = json.load(f)
+                    converted_files.append(metadata_path)
+
+                packed.put(page, metadata, **{content_format: content})
+                converted_files.append(page_path)
+        packed.close()
+
+        if remove:
+            for file in converted_files:
+                os.remove(file)
+            for _, _, source_dir in sources:
+                if not os.listdir(source_dir):
+                    os.rmdir(source_dir)
+        msg.good(f"Packed {name}: {len(converted_files)} files")
+    return len(documents)
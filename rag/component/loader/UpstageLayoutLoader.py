@@ -1,9 +1,12 @@
-from typing import Iterator, Deque, Literal, Optional, Callable
+from typing import Iterator, Iterable, Deque, Literal, Optional, Callable
 from markdownify import markdownify as md
 from wasabi import msg
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 import os
 import re
 import json
+import tempfile
+import threading
 from collections import deque
 
 from langchain_core.documents import Document
@@ -11,6 +14,7 @@ from langchain_upstage import UpstageLayoutAnalysisLoader
 from langchain_upstage.layout_analysis import OutputType, SplitType
 
 from rag.component.loader.base import BaseRAGLoader
+from rag.component.loader.PackedLayoutBackup import PackedLayoutBackup, ContentFormat, packed_backup_path, PACKED_DIR, PACKED_EXT
 from rag.type import *
 from rag import util
 
@@ -28,8 +32,84 @@ def get_max_page_from_backup(backup_dir: str) -> int:
         max_page = max(max_page, page)
     return max_page
 
-# TODO load partial pages from backup, and the rest from analysis
+def get_backup_pages(backup_dir: str) -> dict[int, str]:
+    """Backed up pages in the directory, mapped to their file paths"""
+    pages = {}
+    if not os.path.exists(backup_dir):
+        return pages
+    for file in os.listdir(backup_dir):
+        if not file.endswith(".html") and not file.endswith(".md"):
+            continue
+        file_name_without_ext = os.path.splitext(file)[0]
+        pages[int(file_name_without_ext.split("_")[-1])] = os.path.join(backup_dir, file)
+    return pages
+
+def split_page_ranges(pages: list[int], max_size: int) -> list[tuple[int, int]]:
+    """Split sorted pages into ranges of consecutive pages, each with at most `max_size` pages
+
+    Returns:
+        list[tuple[int, int]]: (first page, last page) of each range
+    """
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page - 1 and page - ranges[-1][0] < max_size:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+def _render_page(
+    html: str,
+    to_markdown: bool,
+    html_path: Optional[str],
+    markdown_path: Optional[str],
+    metadata_json: str,
+    metadata_ext: str,
+) -> str:
+    """Convert a page into markdown if required, and back it up into the directory layout.
+    Module-level, so that it can run in a worker process.
+
+    Returns:
+        str: content of the page
+    """
+    if html_path:
+        msg.info(f"Saving HTML into local: {os.path.basename(html_path)}")
+        util.save_to_local(html, html_path)
+        util.save_to_local(metadata_json, f"{html_path}{metadata_ext}")
+    
+    if not to_markdown:
+        return html
+    
+    markdown = util.markdownify(html)
+    if markdown_path:
+        msg.info(f"Saving Markdown into local: {os.path.basename(markdown_path)}")
+        util.save_to_local(markdown, markdown_path)
+        util.save_to_local(metadata_json, f"{markdown_path}{metadata_ext}")
+    return markdown
+
+# shared by all the loaders, since the documents are loaded concurrently by the ingestion pipeline
+_process_pools: dict[int, ProcessPoolExecutor] = {}
+_process_pools_lock = threading.Lock()
+
+def _get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    with _process_pools_lock:
+        if max_workers not in _process_pools:
+            _process_pools[max_workers] = ProcessPoolExecutor(max_workers=max_workers)
+        return _process_pools[max_workers]
+
 class UpstageLayoutLoader(BaseRAGLoader):
+    """Loads a PDF with Upstage layout analysis, one document per page.
+    
+    If `page_range_size` is set, the PDF is split into page ranges, which are analyzed concurrently.
+    Pages already in the backup directory are loaded from the backup, and only the rest are analyzed,
+    so that an interrupted run resumes where it stopped. Documents are yielded in page order either way.
+    
+    Args:
+        page_range_size (Optional[int]): number of pages per analysis request. Whole PDF in a request if not provided
+        max_concurrency (int): number of page ranges analyzed concurrently
+        backup_format (Literal["dir", "packed"]): "dir" for files per page, "packed" for a single file per document. See `PackedLayoutBackup`
+        markdown_workers (Optional[int]): number of processes converting HTML into markdown and writing the backup. Inline if not provided
+    """
     def __init__(
         self,
         file_path: str,
@@ -43,6 +123,10 @@ class UpstageLayoutLoader(BaseRAGLoader):
         source_type: Literal["path", "name"] = "path",
         metadata_ext: str = ".metadata.json",
         force_load: bool = False,
+        page_range_size: Optional[int] = None,
+        max_concurrency: int = 4,
+        backup_format: Literal["dir", "packed"] = "dir",
+        markdown_workers: Optional[int] = None,
         *,
         metadata_handler: Optional[Callable[[dict], tuple[dict, dict]]] = None,
     ) -> None:
@@ -61,28 +145,50 @@ class UpstageLayoutLoader(BaseRAGLoader):
         else:
             backup_file_parent_dir_path = f"{backup_dir}/html/{file_name_without_ext}"
     
+        self.backup_file_parent_dir_path = backup_file_parent_dir_path
+        self.backup_format = backup_format
+        self.markdown_workers = markdown_workers
+        self.backup_path = packed_backup_path(backup_dir, file_name_without_ext) if backup_format == "packed" else backup_file_parent_dir_path
+        self.backup_loader = UpstageLayoutBackupLoader(
+            self.backup_path, metadata_handler=metadata_handler, metadata_ext=metadata_ext, content_format="markdown" if to_markdown else "html"
+        )
+        self._packed_backup: Optional[PackedLayoutBackup] = None
+        self.anlaysis_output_type = anlaysis_output_type
+        self.use_ocr = use_ocr
+        self.force_load = force_load
+        self.page_range_size = page_range_size
+        self.max_concurrency = max_concurrency
+        self.total_pages = get_total_pages(file_path)
+        self._pdf_lock = threading.Lock()
+        self._backup_lock = threading.Lock()
+        
         max_page = -1
-        total_pages = get_total_pages(file_path)
-        if os.path.exists(backup_file_parent_dir_path):
-            max_page = get_max_page_from_backup(backup_file_parent_dir_path)
+        total_pages = self.total_pages
+        if page_range_size:
+            # page ranges are analyzed on load, and the backup is read page by page
+            pass
+        elif os.path.exists(self.backup_path):
+            max_page = max(self.backup_loader.pages(), default=-1)
             if max_page >= total_pages:
                 # backup file exists
-                msg.info(f"Backup file found: {backup_file_parent_dir_path}. Use backup file instead.")
-                self.layout_loader = UpstageLayoutBackupLoader(
-                    backup_file_parent_dir_path, metadata_handler=self.metadata_handler, metadata_ext=metadata_ext
-                )
+                msg.info(f"Backup file found: {self.backup_path}. Use backup file instead.")
+                self.layout_loader = self.backup_loader
             else:
                 # backup file exists, but not all pages are backed up
-                msg.info(f"Backup file found: {backup_file_parent_dir_path}. But not all pages are backed up.")
+                msg.info(f"Backup file found: {self.backup_path}. But not all pages are backed up.")
 
-        if self.layout_loader is None or force_load:
+        if (self.layout_loader is None or force_load) and not page_range_size:
             # to implement element overlap, split by element
             self.layout_loader = UpstageLayoutAnalysisLoader(
                 file_path, output_type=anlaysis_output_type, split="element" if overlap_elem_size > 0 else "page", use_ocr=use_ocr
             )
         # save to local only if layout loader is UpstageLayoutAnalysisLoader
-        print(f"Use layout loader {self.layout_loader.__class__.__name__}")
-        self.cache_to_local = cache_to_local & isinstance(self.layout_loader, UpstageLayoutAnalysisLoader)
+        if page_range_size:
+            print(f"Use layout loader {UpstageLayoutAnalysisLoader.__name__} by page ranges of {page_range_size} pages")
+            self.cache_to_local = cache_to_local
+        else:
+            print(f"Use layout loader {self.layout_loader.__class__.__name__}")
+            self.cache_to_local = cache_to_local & isinstance(self.layout_loader, UpstageLayoutAnalysisLoader)
         
         self.to_markdown = to_markdown
         self.overlap_elem_size = overlap_elem_size
@@ -90,18 +196,45 @@ class UpstageLayoutLoader(BaseRAGLoader):
         self.metadata_ext = metadata_ext
         
         dir_name = os.path.splitext(os.path.basename(file_path))[0]
-        if self.cache_to_local and os.path.exists(f"{self.backup_dir}/html/{dir_name}"):
+        if self.cache_to_local and backup_format == "dir" and os.path.exists(f"{self.backup_dir}/html/{dir_name}"):
             msg.warn(f"Backup directory already exists: {self.backup_dir}/<html or md>/{dir_name}")
     
     def _lazy_load_non_overlap(self) -> Iterator[Document]:
         # layout loader loads pages in order
-        for document in self.layout_loader.lazy_load():
-            document = self._process(document)
-            yield document
+        yield from self._process_ordered(self.layout_loader.lazy_load())
     
     def _process(self, document: Document) -> Document:
+        task, metadata_to_dump = self._render_task(document)
+        if self.markdown_workers:
+            content = _get_process_pool(self.markdown_workers).submit(_render_page, **task).result()
+        else:
+            content = _render_page(**task)
+        return self._finish(document, content, metadata_to_dump)
+    
+    def _process_ordered(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Process the documents in the process pool if `markdown_workers` is set, yielding them in order"""
+        if not self.markdown_workers:
+            yield from map(self._process, documents)
+            return
+        
+        pool = _get_process_pool(self.markdown_workers)
+        pending: Deque[tuple[Document, dict, Future]] = deque()
+        for document in documents:
+            task, metadata_to_dump = self._render_task(document)
+            pending.append((document, metadata_to_dump, pool.submit(_render_page, **task)))
+            # bounded look-ahead keeps the workers busy, without holding the whole document
+            if len(pending) >= 2 * self.markdown_workers:
+                document, metadata_to_dump, future = pending.popleft()
+                yield self._finish(document, future.result(), metadata_to_dump)
+        while pending:
+            document, metadata_to_dump, future = pending.popleft()
+            yield self._finish(document, future.result(), metadata_to_dump)
+    
+    def _render_task(self, document: Document) -> tuple[dict, dict]:
+        """Arguments of `_render_page`, and the metadata to back up"""
         file_name_with_ext = os.path.basename(self.file_path)
         file_name_without_ext = os.path.splitext(file_name_with_ext)[0]
+        page = document.metadata.get('page')
         
         # TODO expand to general metadata handler
         metadata_to_dump = document.metadata.copy()
@@ -109,24 +242,40 @@ class UpstageLayoutLoader(BaseRAGLoader):
         persistent_metadata = util.persistent_metadata_handler(metadata_to_dump)[0]
         metadata_to_dump.update(persistent_metadata)
         
-        if self.cache_to_local:
-            msg.info(f"Saving HTML into local: {file_name_without_ext}_{document.metadata.get('page')}.html")
-            util.save_to_local(document.page_content, f"{self.backup_dir}/html/{file_name_without_ext}/{file_name_without_ext}_{document.metadata.get('page')}.html")
-            util.save_to_local(json.dumps(metadata_to_dump), f"{self.backup_dir}/html/{file_name_without_ext}/{file_name_without_ext}_{document.metadata.get('page')}.html{self.metadata_ext}")
-                
-        if self.to_markdown:
-            document.page_content = util.markdownify(document.page_content)
-            
-            if self.cache_to_local:
-                msg.info(f"Saving Markdown into local: {file_name_without_ext}_{document.metadata.get('page')}.md")
-                util.save_to_local(document.page_content, f"{self.backup_dir}/markdown/{file_name_without_ext}/{file_name_without_ext}_{document.metadata.get('page')}.md")
-                util.save_to_local(json.dumps(metadata_to_dump), f"{self.backup_dir}/markdown/{file_name_without_ext}/{file_name_without_ext}_{document.metadata.get('page')}.md{self.metadata_ext}")
+        backup_to_dir = self.cache_to_local and self.backup_format == "dir"
+        task = {
+            "html": document.page_content,
+            "to_markdown": self.to_markdown,
+            "html_path": f"{self.backup_dir}/html/{file_name_without_ext}/{file_name_without_ext}_{page}.html" if backup_to_dir else None,
+            "markdown_path": f"{self.backup_dir}/markdown/{file_name_without_ext}/{file_name_without_ext}_{page}.md" if backup_to_dir else None,
+            "metadata_json": json.dumps(metadata_to_dump),
+            "metadata_ext": self.metadata_ext,
+        }
+        return task, metadata_to_dump
+    
+    def _finish(self, document: Document, content: str, metadata_to_dump: dict) -> Document:
+        if self.cache_to_local and self.backup_format == "packed":
+            # html and markdown of a page in a single row
+            self._get_packed_backup().put(
+                document.metadata.get("page"), metadata_to_dump, html=document.page_content, markdown=content if self.to_markdown else None
+            )
         
+        document.page_content = content
         document.metadata["source"] = self.source
         
         return document
     
+    def _get_packed_backup(self) -> PackedLayoutBackup:
+        with self._backup_lock:
+            if self._packed_backup is None:
+                self._packed_backup = PackedLayoutBackup(self.backup_path)
+            return self._packed_backup
+    
     def _lazy_load_overlap(self) -> Iterator[Document]:
+        yield from self._process_ordered(self._merge_overlap(self.layout_loader.lazy_load()))
+    
+    def _merge_overlap(self, elem_docs: Iterable[Document]) -> Iterator[Document]:
+        """Merge the elements into page documents, with `overlap_elem_size` elements of the neighboring pages"""
         pprev_page_group = []
         pprev_page = None
         prev_page_group = []
@@ -136,7 +285,7 @@ class UpstageLayoutLoader(BaseRAGLoader):
         first_trial = True
         
         # layout loader loads elements in order
-        for elem_doc in self.layout_loader.lazy_load():
+        for elem_doc in elem_docs:
             page = elem_doc.metadata.get("page")
             if page is None:
                 msg.warn("Page number not found in metadata. Skipping.")
@@ -151,8 +300,7 @@ class UpstageLayoutLoader(BaseRAGLoader):
                     first_trial = False
                 else:
                     combined_elems = pprev_page_group[-self.overlap_elem_size:] + prev_page_group + current_page_group[:self.overlap_elem_size]
-                    merged_doc = self._merge_elems(combined_elems, prev_page)
-                    yield self._process(merged_doc)
+                    yield self._merge_elems(combined_elems, prev_page)
                     
                 pprev_page_group = prev_page_group
                 pprev_page = prev_page
@@ -167,15 +315,74 @@ class UpstageLayoutLoader(BaseRAGLoader):
             # second last page
             # skipt if only one page
             combined_elems = pprev_page_group[-self.overlap_elem_size:] + prev_page_group + current_page_group[:self.overlap_elem_size]
-            merged_doc = self._merge_elems(combined_elems, current_page - 1)
-            yield self._process(merged_doc)
+            yield self._merge_elems(combined_elems, current_page - 1)
         
         # last page
         combined_elems = prev_page_group[-self.overlap_elem_size:] + current_page_group
-        merged_doc = self._merge_elems(combined_elems, current_page)
-        yield self._process(merged_doc)
+        yield self._merge_elems(combined_elems, current_page)
+    
+    def _lazy_load_page_ranges(self) -> Iterator[Document]:
+        backup_pages = set() if self.force_load else self.backup_loader.pages()
+        missing_pages = [page for page in range(1, self.total_pages + 1) if page not in backup_pages]
+        ranges = split_page_ranges(missing_pages, self.page_range_size)
+        if backup_pages:
+            msg.info(f"{len(backup_pages)} pages found in backup: {self.backup_path}. Analyzing {len(missing_pages)} pages in {len(ranges)} requests.")
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {first: executor.submit(self._analyze_page_range, first, last) for first, last in ranges}
+            try:
+                for page in range(1, self.total_pages + 1):
+                    if page in backup_pages:
+                        document = self.backup_loader.load_page(page)
+                        document.metadata["source"] = self.source
+                        yield document
+                    elif page in futures:
+                        # the first page of a range. yield the whole range
+                        yield from futures.pop(page).result()
+            finally:
+                # stop analyzing if the consumer stops early
+                for future in futures.values():
+                    future.cancel()
+    
+    def _analyze_page_range(self, first: int, last: int) -> list[Document]:
+        """Analyze the pages in [first, last], and process (and back up) them in the worker, 
+        so that the finished ranges survive an interruption.
+        """
+        # elements of the neighboring pages are required for the overlap
+        margin = 1 if self.overlap_elem_size > 0 else 0
+        start, end = max(1, first - margin), min(self.total_pages, last + margin)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            range_path = os.path.join(tmp_dir, f"pages_{start}_{end}.pdf")
+            self._write_page_range(range_path, start, end)
+            
+            msg.info(f"Analyzing pages {start}-{end} of {self.file_name}")
+            elem_docs = UpstageLayoutAnalysisLoader(
+                range_path, output_type=self.anlaysis_output_type, split="element" if self.overlap_elem_size > 0 else "page", use_ocr=self.use_ocr
+            ).load()
+        
+        for elem_doc in elem_docs:
+            if elem_doc.metadata.get("page") is not None:
+                # page numbers of the range pdf start from 1
+                elem_doc.metadata["page"] += start - 1
+        
+        documents = self._merge_overlap(elem_docs) if self.overlap_elem_size > 0 else elem_docs
+        return list(self._process_ordered(document for document in documents if first <= document.metadata.get("page", 0) <= last))
+    
+    def _write_page_range(self, path: str, start: int, end: int) -> None:
+        from PyPDF2 import PdfReader, PdfWriter
+        # pypdf readers are not thread-safe
+        with self._pdf_lock:
+            reader = PdfReader(self.file_path)
+            writer = PdfWriter()
+            for i in range(start - 1, end):
+                writer.add_page(reader.pages[i])
+            with open(path, "wb") as f:
+                writer.write(f)
     
     def lazy_load(self) -> Iterator[Document]:
+        if self.page_range_size:
+            return self._lazy_load_page_ranges()
         if self.overlap_elem_size > 0:
             return self._lazy_load_overlap()
         else:
@@ -192,15 +399,65 @@ class UpstageLayoutLoader(BaseRAGLoader):
         return Document(page_content=page_content, metadata=metadata)
 
 class UpstageLayoutBackupLoader(BaseRAGLoader):
+    """Loads the backup of a document, either a directory of page files or a packed file (`.sqlite`).
+    A packed file is read with a single scan.
+    
+    Args:
+        backup_file_path (str): backup directory of the document, or its packed file
+        content_format (Optional[ContentFormat]): content to load from a packed file. Markdown if available, otherwise HTML
+    """
     def __init__(
         self,
         backup_file_path: str,
         metadata_handler: Optional[Callable[[dict], tuple[dict, dict]]] = None,
         metadata_ext: str = ".metadata.json",
+        content_format: Optional[ContentFormat] = None,
     ) -> None:
         super().__init__(metadata_handler)
         self.metadata_json_ext = metadata_ext
         self.backup_file_path = backup_file_path
+        self.content_format = content_format
+        self.is_packed = backup_file_path.endswith(PACKED_EXT)
+        self._packed: Optional[PackedLayoutBackup] = None
+        # page files of the backup directory, listed once by `pages` and reused by `load_page`
+        self._page_paths: Optional[dict[int, str]] = None
+    
+    def _get_packed(self) -> Optional[PackedLayoutBackup]:
+        if self._packed is None and os.path.exists(self.backup_file_path):
+            self._packed = PackedLayoutBackup(self.backup_file_path)
+            if self.content_format is None:
+                self.content_format = "markdown" if self._packed.has_format("markdown") else "html"
+        return self._packed
+    
+    def pages(self) -> set[int]:
+        """Backed up pages"""
+        if not self.is_packed:
+            self._page_paths = get_backup_pages(self.backup_file_path)
+            return set(self._page_paths)
+        packed = self._get_packed()
+        return packed.pages(self.content_format) if packed is not None else set()
+    
+    def load_page(self, page: int) -> Document:
+        if not self.is_packed:
+            if self._page_paths is None or page not in self._page_paths:
+                self._page_paths = get_backup_pages(self.backup_file_path)
+            return self._doc_from_backup_page(self._page_paths[page])
+        content, metadata = self._get_packed().get(page, self.content_format)
+        return self._doc_from_packed_page(page, content, metadata)
+    
+    def _doc_id(self) -> str:
+        file_name_without_ext = os.path.splitext(os.path.basename(self.backup_file_path))[0]
+        return f"{file_name_without_ext}.pdf"
+    
+    def _doc_from_packed_page(self, page: int, content: str, metadata: dict) -> Document:
+        return Document(
+            page_content=content,
+            metadata={
+                "doc_id": self._doc_id(),
+                "page": page,
+                **metadata
+            }
+        )
     
     def _doc_from_backup_page(self, page_file_path: str) -> Document:
         file_name = os.path.basename(page_file_path)
@@ -238,6 +495,14 @@ class UpstageLayoutBackupLoader(BaseRAGLoader):
         return document
     
     def lazy_load(self) -> Iterator[Document]:
+        if self.is_packed:
+            packed = self._get_packed()
+            if packed is None:
+                return
+            for page, content, metadata in packed.iter_pages(self.content_format):
+                yield self._doc_from_packed_page(page, content, metadata)
+            return
+        
         files = filter(lambda file: file.endswith(".html") or file.endswith(".md"), os.listdir(self.backup_file_path))
         page_extractor = lambda file: int(os.path.splitext(file)[0].split("_")[-1])
         for file in sorted(files, key=page_extractor):
@@ -258,6 +523,7 @@ class UpstageLayoutBackupDirLoader(BaseRAGLoader):
         
         html_dir = f"{backup_dir}/html"
         md_dir = f"{backup_dir}/markdown"
+        self.packed_dir = f"{backup_dir}/{PACKED_DIR}"
         
         if os.path.exists(md_dir):
             self.data_source_dir = md_dir
@@ -267,7 +533,19 @@ class UpstageLayoutBackupDirLoader(BaseRAGLoader):
             self.data_source_ext = ".html"
             
     def lazy_load(self) -> Iterator[Document]:
+        packed_docs = set()
+        if os.path.exists(self.packed_dir):
+            # a file per document. no need to walk the page files
+            for file in sorted(os.listdir(self.packed_dir)):
+                if file.endswith(PACKED_EXT):
+                    packed_docs.add(file[:-len(PACKED_EXT)])
+                    loader = UpstageLayoutBackupLoader(f"{self.packed_dir}/{file}", metadata_handler=self.metadata_handler, metadata_ext=self.metadata_json_ext)
+                    yield from loader.lazy_load()
+        
         for root, _, files in os.walk(self.data_source_dir):
+            # documents backed up in both layouts are loaded from the packed file
+            if os.path.basename(root) in packed_docs:
+                continue
             # if one of files contains the data source extension, iterate roo
             if any(file.endswith(self.data_source_ext) for file in files):
                 loader = UpstageLayoutBackupLoader(root, metadata_handler=self.metadata_handler, metadata_ext=self.metadata_json_ext)
@@ -1,5 +1,6 @@
 from rag.component.loader.PDFWithMetadataLoader import PDFWithMetadataLoader
 from rag.component.loader.UpstageLayoutLoader import UpstageLayoutLoader, UpstageLayoutBackupDirLoader
+from rag.component.loader.PackedLayoutBackup import PackedLayoutBackup, convert_backup_dir
 from rag.component.loader.loader import *
 from rag.component.loader.base import BaseRAGLoader, BaseLoader
 
@@ -7,6 +8,8 @@ __all__ = [
     "PDFWithMetadataLoader",
     "UpstageLayoutLoader",
     "UpstageLayoutBackupDirLoader",
+    "PackedLayoutBackup",
+    "convert_backup_dir",
     "BaseRAGLoader",
     "BaseLoader"
 ]
\ No newline at end of file
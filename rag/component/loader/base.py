@@ -38,8 +38,9 @@ class BaseRAGLoader(BaseLoader):
         return wrapped_method
 
     def lazy_load_chunk(self) -> Iterable[Chunk]:
+        page_ordinals = {}
         for document in self.lazy_load():
-            yield util.doc_to_chunk(document, metadata_handler=self.metadata_handler)
+            yield util.doc_to_chunk(document, metadata_handler=self.metadata_handler, page_ordinals=page_ordinals)
     
     def load_chunk(self) -> list[Chunk]:
         return list(self.lazy_load_chunk())
@@ -0,0 +1,52 @@
+import math
+import re
+from collections import Counter
+
+from rag.component.reranker.base import BaseRAGReranker
+from rag.type import *
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+class BM25Reranker(BaseRAGReranker):
+    """Lexical reranker scoring the chunks with BM25, taking the candidates as the corpus.
+    Complements the dense retrieval with exact term matches, e.g. requirement IDs and command names, without any model.
+    Scores depend on the whole candidate set, so they are neither batched nor cached.
+
+    Args:
+        k1 (float): term frequency saturation
+        b (float): length normalization
+    """
+    CACHEABLE = False
+    model_name = "bm25"
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def _tokenize(text: str) -> list[str]:
+        return _TOKEN_PATTERN.findall(text.lower())
+
+    def _score(self, query: str, texts: list[str]) -> list[float]:
+        docs = [Counter(self._tokenize(text)) for text in texts]
+        lengths = [sum(doc.values()) for doc in docs]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+        query_terms = set(self._tokenize(query))
+        idf = {}
+        for term in query_terms:
+            df = sum(1 for doc in docs if term in doc)
+            idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+
+        scores = []
+        for doc, length in zip(docs, lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+            scores.append(sum(
+                idf[term] * doc[term] * (self.k1 + 1) / (doc[term] + norm)
+                for term in query_terms if term in doc
+            ))
+        return scores
+
+    def score(self, query: str, chunks: list[Chunk]) -> list[float]:
+        return self._score(query, [chunk.text for chunk in chunks])
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+
+from rag.component.reranker.base import BaseRAGReranker
+
+class CrossEncoderReranker(BaseRAGReranker):
+    """Reranker scoring (query, chunk) pairs with a cross-encoder exported to ONNX, on CPU.
+    e.g. `cross-encoder/ms-marco-MiniLM-L-6-v2` exported with `optimum-cli export onnx`.
+    Requires onnxruntime and tokenizers.
+
+    Layout:
+        {model_path}/model.onnx
+        {model_path}/tokenizer.json
+
+    Args:
+        model_path (str): directory of the exported model
+        max_length (int): maximum number of tokens of a pair. Chunks are truncated to fit
+        num_threads (Optional[int]): intra-op threads of onnxruntime. Default of onnxruntime if not provided
+    """
+    def __init__(self, model_path: str, max_length: int = 512, num_threads: int | None = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("onnxruntime and tokenizers are required for the cross-encoder reranker. Run `pip install onnxruntime tokenizers`")
+
+        self.model_name = os.path.basename(os.path.normpath(model_path))
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {input.name for input in self.session.get_inputs()}
+
+    def _score(self, query: str, texts: list[str]) -> list[float]:
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in inputs.items() if name in self._input_names})[0]
+        # single relevance logit, or the logit of the relevant class
+        return logits[:, -1].tolist()
@@ -0,0 +1,11 @@
+from rag.component.reranker.base import BaseRAGReranker
+from rag.component.reranker.BM25Reranker import BM25Reranker
+from rag.component.reranker.CrossEncoderReranker import CrossEncoderReranker
+from rag.component.reranker.reranker import get_reranker
+
+__all__ = [
+    "BaseRAGReranker",
+    "BM25Reranker",
+    "CrossEncoderReranker",
+    "get_reranker",
+]
@@ -0,0 +1,57 @@
+from typing import Optional
+
+from rag.type import *
+from rag.component.cache import RerankCache
+from rag.component import tracing
+from rag import util
+
+class BaseRAGReranker:
+    """Reorders the retrieved chunks by their relevance to the query.
+    Subclasses implement `_score`, scoring a batch of texts against a query.
+    Scores are cached per (query, chunk id, chunk text) if `CACHEABLE`, so that only new candidates are scored.
+
+    Args:
+        batch_size (int): number of chunks scored at once
+        cache (Optional[RerankCache]): cache of the scores
+    """
+    CACHEABLE = True
+    model_name = "default"
+
+    def __init__(self, batch_size: int = 32, cache: Optional[RerankCache] = None, **kwargs) -> None:
+        self.batch_size = batch_size
+        self.cache = cache if self.CACHEABLE else None
+
+    def _score(self, query: str, texts: list[str]) -> list[float]:
+        raise NotImplementedError()
+
+    def score(self, query: str, chunks: list[Chunk]) -> list[float]:
+        # chunk ids are kept when a page is re-ingested, so the text is a part of the key
+        chunk_keys = [f"{chunk.chunk_id}:{util.generate_id(chunk.text)}" for chunk in chunks]
+        scores = self.cache.get_many(self.model_name, query, chunk_keys) if self.cache is not None else [None] * len(chunks)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        tracing.annotate(scored=len(missing))
+
+        for batch in util.batched(missing, self.batch_size):
+            batch_scores = self._score(query, [chunks[i].text for i in batch])
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+            if self.cache is not None:
+                self.cache.put_many(self.model_name, query, [chunk_keys[i] for i in batch], batch_scores)
+        return scores
+
+    def rerank(self, query: str, chunks: list[Chunk], top_k: Optional[int] = None) -> list[Chunk]:
+        """Sort the chunks by the reranker score, replacing the retrieval score
+
+        Returns:
+            list[Chunk]: top_k chunks, sorted by the reranker score
+        """
+        if not chunks:
+            return []
+        with tracing.span("rerank", candidates=len(chunks), reranker=self.model_name):
+            scores = self.score(query, chunks)
+        reranked = sorted(
+            (chunk.model_copy(update={"score": float(score)}) for chunk, score in zip(chunks, scores)),
+            key=lambda chunk: chunk.score,
+            reverse=True,
+        )
+        return reranked[:top_k]
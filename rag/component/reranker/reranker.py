@@ -0,0 +1,33 @@
+from typing import Optional
+
+from rag.component.reranker.base import BaseRAGReranker
+from rag.component.cache import RerankCache
+
+def get_reranker(
+    name: str,
+    model_path: Optional[str] = None,
+    batch_size: int = 32,
+    cache_path: Optional[str] = None,
+    cache_max_entries: Optional[int] = None,
+    **kwargs
+) -> BaseRAGReranker:
+    """Create a reranker by its name
+
+    Args:
+        name (str): "bm25" or "cross-encoder"
+        model_path (Optional[str]): directory of the ONNX cross-encoder
+        batch_size (int): number of chunks scored at once
+        cache_path (Optional[str]): path of the persistent score cache (SQLite). In memory if not provided
+        cache_max_entries (Optional[int]): maximum number of cached scores
+    """
+    if name == "bm25":
+        from rag.component.reranker.BM25Reranker import BM25Reranker
+        return BM25Reranker(batch_size=batch_size, **kwargs)
+    elif name == "cross-encoder":
+        from rag.component.reranker.CrossEncoderReranker import CrossEncoderReranker
+        if model_path is None:
+            raise ValueError("model_path is required for the cross-encoder reranker")
+        cache = RerankCache(cache_path or ":memory:", max_entries=cache_max_entries)
+        return CrossEncoderReranker(model_path, batch_size=batch_size, cache=cache, **kwargs)
+    else:
+        raise ValueError(f"Invalid reranker name: {name}")
@@ -1,10 +1,16 @@
 from wasabi import msg
 import os
-from typing import Optional, Iterator, Iterable, Callable, Any, TypeVar, Hashable
+from typing import Optional, Iterator, Iterable, AsyncIterable, AsyncIterator, Awaitable, Callable, Any, TypeVar, Hashable
 from itertools import chain
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+import queue
+import asyncio
+import threading
+import time
 
 from rag.component.retriever.base import BaseRAGRetriever
+from rag.component import tracing
 from rag.type import *
 from rag.util import generate_id
 
@@ -18,12 +24,53 @@ def unique_by_key(iterable: Iterable[T], key: Callable[[T], H]) -> Iterator[T]:
             seen.add(k)
             yield e
 
+_END_OF_QUERIES = object()
+
+def _iter_queue(q: queue.Queue) -> Iterator[Any]:
+    while (item := q.get()) is not _END_OF_QUERIES:
+        yield item
+
+async def _aiter_queue(q: asyncio.Queue) -> AsyncIterator[Any]:
+    while (item := await q.get()) is not _END_OF_QUERIES:
+        yield item
+
+class _Started:
+    """Start time of a sub-retrieval submitted to the thread pool"""
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.at = 0.0
+    
+    def set(self) -> None:
+        self.at = time.monotonic()
+        self.event.set()
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
 class EnsembleRetriever(BaseRAGRetriever):
+    """Runs the sub-retrievers concurrently and fuses their results with weighted reciprocal rank.
+    
+    Args:
+        retrievers (list[BaseRAGRetriever]): sub-retrievers
+        weights (Optional[list[float]]): weights of the sub-retrievers in the fusion. Equal weights if not provided
+        top_k (int): number of chunks to return
+        timeout (Optional[float | list[float]]): deadline of each sub-retriever in seconds, or one deadline per sub-retriever.
+            Late or failed sub-retrievers are dropped from the fusion. No deadline if not provided.
+            For streaming retrieval, the deadline counts from the arrival of the last query.
+            Time spent queued behind the other requests is not counted, up to one more deadline.
+        max_workers (Optional[int]): size of the thread pool shared by all the requests. 4 per sub-retriever if not provided
+    """
+    LATENCY_HISTORY = 1000
+    
     def __init__(
         self, 
         retrievers: list[BaseRAGRetriever], 
         weights: Optional[list[float]]=None,
         top_k: int=5,
+        timeout: Optional[float | list[float]]=None,
+        max_workers: Optional[int]=None,
         **kwargs
     ) -> None:
         super().__init__(top_k=top_k, **kwargs)
@@ -31,26 +78,191 @@ class EnsembleRetriever(BaseRAGRetriever):
         self.weights = weights
         self.c = 60
         self.top_k = top_k
+        
+        if isinstance(timeout, list):
+            if len(timeout) != len(retrievers):
+                raise ValueError("Timeout length does not match the number of retrievers")
+            self.timeouts = timeout
+        else:
+            self.timeouts = [timeout] * len(retrievers)
+        
+        self.names = self._retriever_names()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or 4 * len(retrievers))
+        self._latencies: dict[str, deque[float]] = {name: deque(maxlen=self.LATENCY_HISTORY) for name in self.names}
+        self._timeout_cnt: dict[str, int] = defaultdict(int)
+        self._failure_cnt: dict[str, int] = defaultdict(int)
+    
+    def _retriever_names(self) -> list[str]:
+        class_names = [retriever.__class__.__name__ for retriever in self.retrievers]
+        return [
+            f"{name}#{class_names[:i].count(name)}" if class_names.count(name) > 1 else name
+            for i, name in enumerate(class_names)
+        ]
     
-    def retrieve(self, queries: TransformationResult, filter: Filter | None = None) -> list[Chunk]:
-        retrieved_chunks_list = [
-            retriever.retrieve(queries, filter) for retriever in self.retrievers
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        started = [_Started() for _ in self.retrievers]
+        futures = [
+            self._executor.submit(tracing.bind(self._timed), retriever.retrieve, queries, filter, top_k=top_k, _started=s) 
+            for retriever, s in zip(self.retrievers, started)
         ]
         # invocation_cnt = len(self.retrievers) * len(queries) TODO trace invocation count
         
-        return self.weighted_reciprocal_rank(retrieved_chunks_list)[:self.top_k]
+        return self._fuse(self._collect(futures, started, time.monotonic()), top_k)
+    
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        """Broadcast each batch of queries to all the sub-retrievers as soon as it arrives."""
+        queues = [queue.Queue() for _ in self.retrievers]
+        started = [_Started() for _ in self.retrievers]
+        futures = [
+            self._executor.submit(tracing.bind(self._timed), retriever.retrieve_stream, _iter_queue(q), filter, top_k=top_k, _started=s)
+            for retriever, q, s in zip(self.retrievers, queues, started)
+        ]
+        try:
+            for queries in query_batches:
+                for q in queues:
+                    q.put(queries)
+        finally:
+            for q in queues:
+                q.put(_END_OF_QUERIES)
+        
+        return self._fuse(self._collect(futures, started, time.monotonic()), top_k)
+
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        tasks = [
+            asyncio.ensure_future(self._atimed(retriever.aretrieve(queries, filter, top_k=top_k)))
+            for retriever in self.retrievers
+        ]
+        return self._fuse(await self._acollect(tasks, time.monotonic()), top_k)
+    
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        queues = [asyncio.Queue() for _ in self.retrievers]
+        tasks = [
+            asyncio.ensure_future(self._atimed(retriever.aretrieve_stream(_aiter_queue(q), filter, top_k=top_k)))
+            for retriever, q in zip(self.retrievers, queues)
+        ]
+        try:
+            async for queries in query_batches:
+                for q in queues:
+                    q.put_nowait(queries)
+        finally:
+            for q in queues:
+                q.put_nowait(_END_OF_QUERIES)
+        
+        return self._fuse(await self._acollect(tasks, time.monotonic()), top_k)
+    
+    @staticmethod
+    def _timed(func: Callable[..., list[Chunk]], *args, _started: Optional[_Started] = None, **kwargs) -> tuple[list[Chunk], float]:
+        if _started is not None:
+            _started.set()
+        start = time.monotonic()
+        result = func(*args, **kwargs)
+        return result, time.monotonic() - start
+    
+    @staticmethod
+    async def _atimed(coro: Awaitable[list[Chunk]]) -> tuple[list[Chunk], float]:
+        start = time.monotonic()
+        result = await coro
+        return result, time.monotonic() - start
+    
+    def _collect(self, futures: list[Future], started: list[_Started], start: float) -> list[Optional[list[Chunk]]]:
+        """Wait for each sub-retriever until its deadline. Late or failed sub-retrievers result in None.
+        The deadline counts from `start`, or from the start of the sub-retrieval if it was queued in the thread pool.
+        A sub-retrieval still queued `timeout` after `start` (e.g. the pool is filled by hung retrievals) times out.
+        """
+        results = []
+        for name, future, s, timeout in zip(self.names, futures, started, self.timeouts):
+            remaining = None
+            if timeout is not None:
+                if not s.event.wait(max(0, start + timeout - time.monotonic())):
+                    future.cancel()
+                    results.append(self._record_timeout(name, timeout))
+                    continue
+                remaining = max(0, max(start, s.at) + timeout - time.monotonic())
+            try:
+                chunks, latency = future.result(timeout=remaining)
+                results.append(self._record(name, chunks, latency))
+            except FutureTimeoutError:
+                # running retrieval cannot be interrupted. let it finish in the background, and ignore the result
+                future.cancel()
+                results.append(self._record_timeout(name, timeout))
+            except Exception as e:
+                results.append(self._record_failure(name, e))
+        return results
+    
+    async def _acollect(self, tasks: list[asyncio.Future], start: float) -> list[Optional[list[Chunk]]]:
+        results = []
+        for name, task, timeout in zip(self.names, tasks, self.timeouts):
+            remaining = None if timeout is None else max(0, start + timeout - time.monotonic())
+            try:
+                chunks, latency = await asyncio.wait_for(task, timeout=remaining)
+                results.append(self._record(name, chunks, latency))
+            except asyncio.TimeoutError:
+                results.append(self._record_timeout(name, timeout))
+            except Exception as e:
+                results.append(self._record_failure(name, e))
+        return results
+    
+    def _record(self, name: str, chunks: list[Chunk], latency: float) -> list[Chunk]:
+        self._latencies[name].append(latency)
+        return chunks
+    
+    def _record_timeout(self, name: str, timeout: float) -> None:
+        msg.warn(f"Retriever {name} did not respond in {timeout}s. Excluding it from the ensemble.")
+        self._latencies[name].append(timeout)
+        self._timeout_cnt[name] += 1
+        return None
+    
+    def _record_failure(self, name: str, e: Exception) -> None:
+        msg.warn(f"Retriever {name} failed: {e}. Excluding it from the ensemble.")
+        self._failure_cnt[name] += 1
+        return None
+    
+    def latency_stats(self) -> dict[str, dict[str, float]]:
+        """Latency statistics of each sub-retriever, over the recent requests.
+        Timed out requests are counted with the deadline as their latency.
+        """
+        stats = {}
+        for name in self.names:
+            latencies = sorted(self._latencies[name])
+            stats[name] = {
+                "count": len(latencies),
+                "timeouts": self._timeout_cnt[name],
+                "failures": self._failure_cnt[name],
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": latencies[-1] if latencies else 0.0,
+            }
+        return stats
+    
+    def _fuse(self, results: list[Optional[list[Chunk]]], top_k: Optional[int]) -> list[Chunk]:
+        weights = self.weights or [1.0] * len(self.retrievers)
+        if len(weights) != len(results):
+            msg.fail("Weights length does not match the number of retrievers.")
+            raise ValueError("Weights length does not match the number of retrievers")
+        
+        # drop late or failed retrievers, along with their weights
+        available = [(chunks, weight) for chunks, weight in zip(results, weights) if chunks is not None]
+        if not available:
+            msg.fail("No retriever responded in time.")
+            return []
+        
+        retrieved_chunks_list, available_weights = map(list, zip(*available))
+        with tracing.span("fusion", retrievers=len(retrieved_chunks_list)):
+            return self.weighted_reciprocal_rank(retrieved_chunks_list, available_weights)[:top_k or self.top_k]
 
-    def weighted_reciprocal_rank(self, retrieved_chunks_list: list[list[Chunk]]) -> list[Chunk]:
-        if self.weights and len(self.weights) != len(retrieved_chunks_list):
+    def weighted_reciprocal_rank(self, retrieved_chunks_list: list[list[Chunk]], weights: Optional[list[float]] = None) -> list[Chunk]:
+        weights = weights or self.weights
+        if weights and len(weights) != len(retrieved_chunks_list):
             msg.fail("Weights length does not match the number of retrievers.")
             raise ValueError("Weights length does not match the number of retrievers")
         
-        if self.weights is None:
+        if weights is None:
             msg.warn("Weights are not provided. Using equal weights.")
-            self.weights = [1.0] * len(retrieved_chunks_list)
+            weights = [1.0] * len(retrieved_chunks_list)
         
         rrf_score: dict[str, float] = defaultdict(float)
-        for chunks_list, weight in zip(retrieved_chunks_list, self.weights):
+        for chunks_list, weight in zip(retrieved_chunks_list, weights):
             for rank, chunk in enumerate(chunks_list, start=1):
                 rrf_score[chunk.chunk_id] += weight / (rank + self.c)
         
@@ -1,44 +1,217 @@
 from wasabi import msg
-from typing import Type, Callable
+from typing import Type, Callable, Iterable, AsyncIterable, Optional
 
-from rag.component.retriever.base import BaseRAGRetriever, FilterUtil
+from rag.component.retriever.base import BaseRAGRetriever, FilterUtil, queries_to_dict
 from rag.type import *
 
 
 class HierarchicalRetriever(BaseRAGRetriever):
     """Wrapper class that uses a retriever hierarchically.
     It retrieves base context first and then additional context.
+    
+    In "two-pass" mode, base and additional contexts are retrieved with separate round-trips,
+    since the additional filter depends on the retrieved base chunks.
+    In "single-pass" mode, a single over-fetched retrieval is partitioned into base and additional contexts client-side.
+    Falls back to the base context retrieval if there are not enough base candidates,
+    and to the additional context retrieval if there are not enough additional candidates linked to the base chunks.
 
     Args:
         retriever (BaseRAGRetriever): The retriever to use.
+        mode (str): "two-pass" or "single-pass"
+        over_fetch_factor (float): number of candidates to retrieve in single-pass mode, relative to top_k
     """
     BASE_RATIO = 0.7
     
     @classmethod
-    def from_retriever(cls, retriever: BaseRAGRetriever) -> "HierarchicalRetriever":
-        return cls(retriever)
+    def from_retriever(cls, retriever: BaseRAGRetriever, **kwargs) -> "HierarchicalRetriever":
+        return cls(retriever, **kwargs)
         
     def __init__(
         self, 
         retriever: BaseRAGRetriever,
+        mode: str = "two-pass",
+        over_fetch_factor: float = 3.0,
         **kwargs,
     ) -> None:
         super().__init__()
+        if mode not in ["two-pass", "single-pass"]:
+            raise ValueError(f"Invalid hierarchy mode: {mode}")
         self.retriever = retriever
         self.top_k = self.retriever.top_k
+        self.mode = mode
+        self.over_fetch_factor = over_fetch_factor
+        
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        managed_base_chunks = None
+        if self.mode == "single-pass":
+            candidates = self.retriever.retrieve(
+                queries, filter=filter, top_k=self._over_fetch_k(top_k)
+            )
+            managed_base_chunks, additional_chunks = self._partition(candidates, top_k)
+            if not self._enough_base(managed_base_chunks, top_k):
+                managed_base_chunks = None
+            elif self._enough_additional(managed_base_chunks, additional_chunks, top_k):
+                return self._merge(managed_base_chunks, additional_chunks, top_k)
+        
+        if managed_base_chunks is None:
+            # base context retrieval
+            base_chunks = self.retriever.retrieve(
+                queries, filter=self._base_filter(filter), top_k=top_k
+            )
+            managed_base_chunks = base_chunks[:self._base_k(top_k)]
+        
+        # additional context retrieval 
+        additional_chunks = self.retriever.retrieve(
+            queries, filter=self._additional_filter(managed_base_chunks, filter), top_k=top_k
+        )
+        return self._merge(managed_base_chunks, additional_chunks, top_k)
+    
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        """Stream queries into the base context retrieval.
+        Additional context retrieval depends on the base chunks, so it starts after all the queries are arrived.
+        """
+        top_k = top_k or self.top_k
+        collected_queries: list[str] = []
+        def _collecting_batches():
+            for queries in query_batches:
+                collected_queries.extend(queries)
+                yield queries
+        
+        batches = _collecting_batches()
+        managed_base_chunks = None
+        if self.mode == "single-pass":
+            candidates = self.retriever.retrieve_stream(
+                batches, filter=filter, top_k=self._over_fetch_k(top_k)
+            )
+            for _ in batches:
+                pass
+            managed_base_chunks, additional_chunks = self._partition(candidates, top_k)
+            if not self._enough_base(managed_base_chunks, top_k):
+                # queries are all collected. retrieve the base context again
+                base_chunks = self.retriever.retrieve(
+                    queries_to_dict(collected_queries), filter=self._base_filter(filter), top_k=top_k
+                )
+                managed_base_chunks = base_chunks[:self._base_k(top_k)]
+            elif self._enough_additional(managed_base_chunks, additional_chunks, top_k):
+                return self._merge(managed_base_chunks, additional_chunks, top_k)
+        else:
+            # base context retrieval
+            base_chunks = self.retriever.retrieve_stream(
+                batches, filter=self._base_filter(filter), top_k=top_k
+            )
+            # make sure all the queries are collected, even if the retriever stops early
+            for _ in batches:
+                pass
+            managed_base_chunks = base_chunks[:self._base_k(top_k)]
+        
+        # additional context retrieval
+        additional_chunks = self.retriever.retrieve(
+            queries_to_dict(collected_queries), filter=self._additional_filter(managed_base_chunks, filter), top_k=top_k
+        )
+        return self._merge(managed_base_chunks, additional_chunks, top_k)
+    
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        managed_base_chunks = None
+        if self.mode == "single-pass":
+            candidates = await self.retriever.aretrieve(
+                queries, filter=filter, top_k=self._over_fetch_k(top_k)
+            )
+            managed_base_chunks, additional_chunks = self._partition(candidates, top_k)
+            if not self._enough_base(managed_base_chunks, top_k):
+                managed_base_chunks = None
+            elif self._enough_additional(managed_base_chunks, additional_chunks, top_k):
+                return self._merge(managed_base_chunks, additional_chunks, top_k)
+        
+        if managed_base_chunks is None:
+            base_chunks = await self.retriever.aretrieve(
+                queries, filter=self._base_filter(filter), top_k=top_k
+            )
+            managed_base_chunks = base_chunks[:self._base_k(top_k)]
+        
+        additional_chunks = await self.retriever.aretrieve(
+            queries, filter=self._additional_filter(managed_base_chunks, filter), top_k=top_k
+        )
+        return self._merge(managed_base_chunks, additional_chunks, top_k)
+    
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        collected_queries: list[str] = []
+        async def _collecting_batches():
+            async for queries in query_batches:
+                collected_queries.extend(queries)
+                yield queries
         
-    def retrieve(self, queries: TransformationResult, filter: Filter | None = None) -> list[Chunk]:
-        # base context retrieval
+        batches = _collecting_batches()
+        managed_base_chunks = None
+        if self.mode == "single-pass":
+            candidates = await self.retriever.aretrieve_stream(
+                batches, filter=filter, top_k=self._over_fetch_k(top_k)
+            )
+            async for _ in batches:
+                pass
+            managed_base_chunks, additional_chunks = self._partition(candidates, top_k)
+            if not self._enough_base(managed_base_chunks, top_k):
+                base_chunks = await self.retriever.aretrieve(
+                    queries_to_dict(collected_queries), filter=self._base_filter(filter), top_k=top_k
+                )
+                managed_base_chunks = base_chunks[:self._base_k(top_k)]
+            elif self._enough_additional(managed_base_chunks, additional_chunks, top_k):
+                return self._merge(managed_base_chunks, additional_chunks, top_k)
+        else:
+            base_chunks = await self.retriever.aretrieve_stream(
+                batches, filter=self._base_filter(filter), top_k=top_k
+            )
+            async for _ in batches:
+                pass
+            managed_base_chunks = base_chunks[:self._base_k(top_k)]
+        
+        additional_chunks = await self.retriever.aretrieve(
+            queries_to_dict(collected_queries), filter=self._additional_filter(managed_base_chunks, filter), top_k=top_k
+        )
+        return self._merge(managed_base_chunks, additional_chunks, top_k)
+    
+    def _base_k(self, top_k: int) -> int:
+        return int(top_k * self.BASE_RATIO)
+    
+    def _over_fetch_k(self, top_k: int) -> int:
+        return max(top_k, int(top_k * self.over_fetch_factor))
+    
+    def _partition(self, candidates: list[Chunk], top_k: int) -> tuple[list[Chunk], list[Chunk]]:
+        """Partition the over-fetched candidates into base and additional chunks,
+        applying the same conditions as `_base_filter` and `_additional_filter` client-side.
+        """
+        base_chunks = [c for c in candidates if c.doc_meta.get("doc_type") == "base"]
+        managed_base_chunks = base_chunks[:self._base_k(top_k)]
+        
+        base_doc_ids = set([c.doc_id for c in managed_base_chunks] + ["*"])
+        additional_chunks = [
+            c for c in candidates 
+            if c.doc_meta.get("doc_type") == "additional" and c.doc_meta.get("base_doc_id") in base_doc_ids
+        ]
+        return managed_base_chunks, additional_chunks
+    
+    def _enough_base(self, base_chunks: list[Chunk], top_k: int) -> bool:
+        enough = len(base_chunks) >= self._base_k(top_k)
+        if not enough:
+            msg.info(f"Only {len(base_chunks)} base candidates found in a single pass. Retrieving base and additional context again...")
+        return enough
+    
+    def _enough_additional(self, base_chunks: list[Chunk], additional_chunks: list[Chunk], top_k: int) -> bool:
+        enough = len(additional_chunks) >= top_k - len(base_chunks)
+        if not enough:
+            msg.info(f"Only {len(additional_chunks)} additional candidates found in a single pass. Retrieving additional context again...")
+        return enough
+    
+    def _base_filter(self, filter: Filter | None) -> Filter:
         base_filter = FilterUtil.from_dict({"equals": {"key": "doc_type", "value": "base"}})
         base_filter = FilterUtil.and_all(base_filter, filter) if filter else base_filter
         print(base_filter)
-        base_chunks = self.retriever.retrieve(
-            queries, filter=base_filter
-        )
-        managed_base_chunks = base_chunks[:int(self.top_k * self.BASE_RATIO)]
-        
-        # additional context retrieval 
-        base_doc_ids = list(set([c.doc_id for c in managed_base_chunks])) + ["*"] # include additional docs not linked to any base doc
+        return base_filter
+    
+    def _additional_filter(self, base_chunks: list[Chunk], filter: Filter | None) -> Filter:
+        base_doc_ids = list(set([c.doc_id for c in base_chunks])) + ["*"] # include additional docs not linked to any base doc
         additional_filters = FilterUtil.from_dict({
             "andAll": [
                 {"equals": {"key": "doc_type", "value": "additional"}}, 
@@ -47,12 +220,12 @@ class HierarchicalRetriever(BaseRAGRetriever):
         })
         additional_filters = FilterUtil.and_all(additional_filters, filter) if filter else additional_filters
         print(additional_filters)
-        additional_chunks = self.retriever.retrieve(
-            queries, filter=additional_filters
-        )
-        managed_additional_chunks = additional_chunks[:self.top_k - len(managed_base_chunks)]
+        return additional_filters
+    
+    def _merge(self, base_chunks: list[Chunk], additional_chunks: list[Chunk], top_k: int) -> list[Chunk]:
+        managed_additional_chunks = additional_chunks[:top_k - len(base_chunks)]
         
-        chunks = managed_base_chunks + managed_additional_chunks
+        chunks = base_chunks + managed_additional_chunks
         self.validate(chunks)
         
         return chunks
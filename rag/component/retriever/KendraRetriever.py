@@ -1,3 +1,4 @@
+from typing import Optional
 import os
 from wasabi import msg
 import boto3
@@ -39,25 +40,40 @@ class KendraRetriever(BaseRAGRetriever):
         self.kendra_index_id = os.environ["KENDRA_INDEX_ID"]
         self.region_name = os.environ["AWS_REGION"]
     
-    def retrieve(self, queries: TransformationResult, filter: Filter | None = None) -> list[Chunk]:
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
         _queries = util.flatten_queries(queries)
-        
-        if filter is not None:
-            filter_dict = self._arange_filter(filter)
-            self.retriever.attribute_filter = filter_dict
 
         try:
-            retrieved_chunks_raw = self.retriever.batch(_queries)
-            retrieved_chunks_raw = sum(retrieved_chunks_raw, [])
-            retrieved_chunks = [self.process_chunk(chunks_raw) for chunks_raw in retrieved_chunks_raw]
-            
-            # sort by score
-            retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:self.top_k]
-            return retrieved_chunks
+            retrieved_chunks_raw = self._get_retriever(filter).batch(_queries)
+            return self._process_batch_result(retrieved_chunks_raw, top_k or self.top_k)
+        except Exception as e:
+            msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
+            return []
+    
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        _queries = util.flatten_queries(queries)
+
+        try:
+            retrieved_chunks_raw = await self._get_retriever(filter).abatch(_queries)
+            return self._process_batch_result(retrieved_chunks_raw, top_k or self.top_k)
         except Exception as e:
             msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
             return []
     
+    def _get_retriever(self, filter: Filter | None) -> AmazonKendraRetriever:
+        """Retriever of a call, sharing the client. Concurrent calls do not share the filter"""
+        if filter is None:
+            return self.retriever
+        return self.retriever.copy(update={"attribute_filter": self._arange_filter(filter)})
+    
+    def _process_batch_result(self, retrieved_chunks_raw: list[list[Document]], top_k: int) -> list[Chunk]:
+        retrieved_chunks_raw = sum(retrieved_chunks_raw, [])
+        retrieved_chunks = [self.process_chunk(chunks_raw) for chunks_raw in retrieved_chunks_raw]
+        
+        # sort by score
+        retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:top_k]
+        return retrieved_chunks
+    
     def _arange_filter(self, filter: Filter) -> dict:
         op_map = {
             "equals": "EqualsTo",
@@ -1,3 +1,4 @@
+from typing import Optional
 from wasabi import msg
 import os
 
@@ -42,27 +43,29 @@ class KnowledgeBaseRetriever(BaseRAGRetriever):
         
         
     
-    def retrieve(self, queries: TransformationResult, filter: Filter | None = None) -> list[Chunk]:
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
         _queries = util.flatten_queries(queries)
-        
+        retrieved_chunks_raw = self._get_retriever(filter, top_k or self.top_k).batch(_queries)
+        return self._process_batch_result(retrieved_chunks_raw, top_k or self.top_k)
+    
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        _queries = util.flatten_queries(queries)
+        retrieved_chunks_raw = await self._get_retriever(filter, top_k or self.top_k).abatch(_queries)
+        return self._process_batch_result(retrieved_chunks_raw, top_k or self.top_k)
+    
+    def _get_retriever(self, filter: Filter | None, top_k: int) -> AmazonKnowledgeBasesRetriever:
+        """Retriever of a call, sharing the client. Concurrent calls do not share the filter and `top_k`"""
+        vector_search_config = {"numberOfResults": top_k}
         if filter is not None:
-            filter_dict = self._arange_filter(filter)
-            self.retriever.retrieval_config = RetrievalConfig({
-                "vectorSearchConfiguration": {
-                    "numberOfResults": self.top_k,
-                    "filter": filter_dict
-                }
-            })
-        else:
-            self.retriever.retrieval_config = RetrievalConfig({
-                "vectorSearchConfiguration": {
-                    "numberOfResults": self.top_k,
-                }
-            })
-        retrieved_chunks_raw = self.retriever.batch(_queries)
+            vector_search_config["filter"] = self._arange_filter(filter)
+        return self.retriever.copy(update={
+            "retrieval_config": RetrievalConfig({"vectorSearchConfiguration": vector_search_config})
+        })
+    
+    def _process_batch_result(self, retrieved_chunks_raw: list[list[Document]], top_k: int) -> list[Chunk]:
         retrieved_chunks_raw = sum(retrieved_chunks_raw, [])
         retrieved_chunks = [self.process_chunk(chunks_raw) for chunks_raw in retrieved_chunks_raw]
-        retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:self.top_k]
+        retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:top_k]
         return retrieved_chunks
 
     def _arange_filter(self, filter: Filter) -> dict:
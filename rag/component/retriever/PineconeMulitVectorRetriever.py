@@ -1,17 +1,19 @@
 import os
-from typing import Optional
+import asyncio
+from typing import Optional, Iterable, AsyncIterable
+from concurrent.futures import ThreadPoolExecutor, Future
 from wasabi import msg
 
 from pinecone import Pinecone, Index
 
 from langchain_core.documents import Document
-from langchain_core.runnables import RunnableParallel, Runnable, RunnableLambda
 
 
 from rag.component.vectorstore.base import BaseRAGVectorstore
 from rag.component.vectorstore.PineconeVectorstore import PineconeVectorstore
+from rag.component.vectorstore.vectorstore import get_vectorstore
 from rag.component.retriever.base import BaseRAGRetriever
-from rag.component import embeddings
+from rag.component import embeddings, tracing
 from rag.type import *
 from rag.type import Chunk, Document
 from rag import util
@@ -19,10 +21,11 @@ from rag.config import RetrievalConfig
 
 class PineconeMultiVectorRetriever(BaseRAGRetriever):
     PARENT_CHILD_FACTOR = 3
+    MAX_CONCURRENCY = 8
     def __init__(
         self, 
-        vectorstore: PineconeVectorstore,
-        sub_vectorstore: PineconeVectorstore,
+        vectorstore: BaseRAGVectorstore,
+        sub_vectorstore: BaseRAGVectorstore,
         top_k: int = 5,
         parent_id_key: str = "parent_id",
         **kwargs
@@ -32,53 +35,31 @@ class PineconeMultiVectorRetriever(BaseRAGRetriever):
         self.vectorstore = vectorstore
         self.sub_vectorstore = sub_vectorstore
         self._parent_id_key = parent_id_key
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENCY)
+        self._embedding_executor = ThreadPoolExecutor(max_workers=2)
     
-    def _get_retrieval_chain(self, chain_num: int) -> Runnable:
-        """Create a retrieval chain that retrieves chunks in parallel.
+    def _search_batch(self, queries: list[str], filter_dict: dict | None, top_k: int) -> list[Future]:
+        """Embed all the queries with a single embeddings request, 
+        and dispatch the vector searches in parallel.
 
         Args:
-            chain_num (int): The number of chains to create. Equals to the number of queries.
+            queries (list[str]): queries to search
+            filter_dict (dict | None): filter in pinecone syntax
+            top_k (int): number of sub chunks to retrieve per query
 
         Returns:
-            RunnableParallel: The retrieval chain.
+            list[Future]: futures of the sub chunks, one per query
         """
-        def _runnable_input_parser(_dict):
-            queries = _dict["queries"]
-            filter_dict = _dict["filter"]
-            top_k = _dict["top_k"]
-
-            result = {}
-            for i in range(chain_num):
-                result[f"query_{i}"] = queries[i]
-            result["filter"] = filter_dict
-            result["top_k"] = top_k
-            return result
-        runnable_input_parser = RunnableLambda(_runnable_input_parser)
-        
-        def _runnable_output_parser(_dict):
-            result = sum([_dict[f"query_{i}"] for i in range(chain_num)], [])
-            return result
-        runnable_output_parser = RunnableLambda(_runnable_output_parser)
-        
-        def _build_query_chain(i: int) -> Runnable:            
-            def _query_chain(_dict):
-                query = _dict[f"query_{i}"]
-                filter_dict = _dict["filter"]
-                top_k = _dict["top_k"]
-                
-                return self.sub_vectorstore.query(query, top_k=top_k, filter=filter_dict)
-            return RunnableLambda(_query_chain)
-        
-        parrallel_kwargs = {}
-        for i in range(chain_num):
-            parrallel_kwargs[f"query_{i}"] = _build_query_chain(i)
-        
-        runnable_parallel = RunnableParallel(**parrallel_kwargs)
-        
-        chain = runnable_input_parser | runnable_parallel | runnable_output_parser
-        return chain
+        with tracing.span("sub_query", queries=len(queries)):
+            with tracing.span("embedding", queries=len(queries)):
+                query_embeddings = self.sub_vectorstore.embed_queries(queries)
+            query_by_vector = tracing.bind(tracing.traced("vector_search", self.sub_vectorstore.query_by_vector, top_k=top_k))
+            return [
+                self._executor.submit(query_by_vector, embedding, top_k=top_k, filter=filter_dict)
+                for embedding in query_embeddings
+            ]
     
-    def retrieve(self, queries: TransformationResult, filter: Filter | None = None) -> list[Chunk]:  
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:  
         try:
             _queries = util.flatten_queries(queries)
 
@@ -86,64 +67,153 @@ class PineconeMultiVectorRetriever(BaseRAGRetriever):
                 filter_dict = self._arange_filter(filter)
             else:
                 filter_dict = None
-
-            id_scores = dict()
-            sub_chunk_cnt = 0
             
-            sub_chunks = self._get_retrieval_chain(len(_queries)).invoke({
-                "queries": _queries, 
-                "filter": filter_dict, 
-                "top_k": int(self.top_k * self.PARENT_CHILD_FACTOR)
-            })
-            sub_chunk_cnt = len(sub_chunks)
+            top_k = top_k or self.top_k
+            futures = self._search_batch(_queries, filter_dict, int(top_k * self.PARENT_CHILD_FACTOR))
+            sub_chunks = sum([future.result() for future in futures], [])
+            return self._fuse(sub_chunks, top_k)
+        except Exception as e:
+            msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
+            return []
+    
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        """Dispatch the sub vectorstore searches for each batch of queries as soon as it arrives,
+        and fuse the results into parent chunks once the last search is done.
+        Queries in the same batch share a single embeddings request.
+        """
+        try:
+            filter_dict = self._arange_filter(filter) if filter is not None else None
+            top_k = top_k or self.top_k
+            sub_top_k = int(top_k * self.PARENT_CHILD_FACTOR)
             
-            for sub_chunk in sub_chunks:
-                if self._parent_id_key in sub_chunk.chunk_meta:
-                    if sub_chunk.chunk_meta[self._parent_id_key] not in id_scores:
-                        id_scores[sub_chunk.chunk_meta[self._parent_id_key]] = []
-                    id_scores[sub_chunk.chunk_meta[self._parent_id_key]].append(sub_chunk.score)
+            batch_futures = []
+            for queries in query_batches:
+                if not queries:
+                    continue
+                batch_futures.append(self._embedding_executor.submit(
+                    tracing.bind(self._search_batch), queries, filter_dict, sub_top_k
+                ))
             
-            # retrieve parent chunks
-            retrieved_chunks_raw = self.vectorstore.fetch_docs(list(id_scores.keys()))
-            if not retrieved_chunks_raw:
-                msg.warn(f"Retrieved 0 chunks from parent vectorstore, based on {sub_chunk_cnt} sub chunks")
-                return []
+            sub_chunks = []
+            for batch_future in batch_futures:
+                for future in batch_future.result():
+                    sub_chunks.extend(future.result())
+            return self._fuse(sub_chunks, top_k)
+        except Exception as e:
+            msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
+            return []
+    
+    async def _asearch_batch(self, queries: list[str], filter_dict: dict | None, top_k: int) -> list[Chunk]:
+        with tracing.span("sub_query", queries=len(queries)):
+            with tracing.span("embedding", queries=len(queries)):
+                query_embeddings = await self.sub_vectorstore.aembed_queries(queries)
+            results = await asyncio.gather(*[
+                self._aquery_by_vector(embedding, top_k, filter_dict)
+                for embedding in query_embeddings
+            ])
+            return sum(results, [])
+    
+    async def _aquery_by_vector(self, embedding: list[float], top_k: int, filter_dict: dict | None) -> list[Chunk]:
+        with tracing.span("vector_search", top_k=top_k):
+            return await self.sub_vectorstore.aquery_by_vector(embedding, top_k=top_k, filter=filter_dict)
+    
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        try:
+            _queries = util.flatten_queries(queries)
+            filter_dict = self._arange_filter(filter) if filter is not None else None
             
-            # normalize scores using min-max scaling
-            # TODO better normalization?
-            for key in id_scores:
-                id_scores[key] = sum(id_scores[key])
+            top_k = top_k or self.top_k
+            sub_chunks = await self._asearch_batch(_queries, filter_dict, int(top_k * self.PARENT_CHILD_FACTOR))
+            return await self._afuse(sub_chunks, top_k)
+        except Exception as e:
+            msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
+            return []
+    
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        filter_dict = self._arange_filter(filter) if filter is not None else None
+        top_k = top_k or self.top_k
+        sub_top_k = int(top_k * self.PARENT_CHILD_FACTOR)
         
-            if len(id_scores) == 1:
-                # avoid division by zero
-                for key in id_scores:
-                    id_scores[key] = 1
-            else: 
-                min_score = min(id_scores.values())
-                max_score = max(id_scores.values())
-                for key in id_scores:
-                    id_scores[key] = (id_scores[key] - min_score) / (max_score - min_score)
-
-            
-            # assign scores
-            for retrieved_chunk_raw in retrieved_chunks_raw:
-                chunk_id = retrieved_chunk_raw.metadata["chunk_id"]
-                if chunk_id in id_scores:
-                    retrieved_chunk_raw.metadata["score"] = id_scores[chunk_id]
-                else:
-                    # This should not happen
-                    msg.warn(f"Chunk {chunk_id} is retrieved even though it has no retrieved sub chunks")
-                    retrieved_chunk_raw.metadata["score"] = 0 
-            
-            retrieved_chunks = [self.process_chunk(chunk_raw) for chunk_raw in retrieved_chunks_raw]
-            retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:self.top_k]
-            msg.info(f"Retrieved {len(retrieved_chunks)} chunks from parent vectorstore, based on {sub_chunk_cnt} sub chunks")
-            
-            return retrieved_chunks
+        tasks = []
+        async for queries in query_batches:
+            if not queries:
+                continue
+            tasks.append(asyncio.ensure_future(self._asearch_batch(queries, filter_dict, sub_top_k)))
+        
+        try:
+            sub_chunks = sum(await asyncio.gather(*tasks), [])
+            return await self._afuse(sub_chunks, top_k)
         except Exception as e:
             msg.warn(f"Error occurred during retrieval using {self.__class__.__name__}: {e}")
             return []
+    
+    def _fuse(self, sub_chunks: list[Chunk], top_k: int) -> list[Chunk]:
+        """Aggregate scores of sub chunks by their parent, and fetch the parent chunks.
+
+        Args:
+            sub_chunks (list[Chunk]): sub chunks retrieved from all the queries
+            top_k (int): number of parent chunks to return
+
+        Returns:
+            list[Chunk]: top_k parent chunks, sorted by aggregated score
+        """
+        id_scores = self._aggregate_scores(sub_chunks)
+        with tracing.span("parent_fetch", parents=len(id_scores)):
+            retrieved_chunks_raw = self.vectorstore.fetch_docs(list(id_scores.keys()))
+        with tracing.span("fusion", sub_chunks=len(sub_chunks)):
+            return self._rank_parents(retrieved_chunks_raw, id_scores, len(sub_chunks), top_k)
+    
+    async def _afuse(self, sub_chunks: list[Chunk], top_k: int) -> list[Chunk]:
+        id_scores = self._aggregate_scores(sub_chunks)
+        with tracing.span("parent_fetch", parents=len(id_scores)):
+            retrieved_chunks_raw = await self.vectorstore.afetch_docs(list(id_scores.keys()))
+        with tracing.span("fusion", sub_chunks=len(sub_chunks)):
+            return self._rank_parents(retrieved_chunks_raw, id_scores, len(sub_chunks), top_k)
+    
+    def _aggregate_scores(self, sub_chunks: list[Chunk]) -> dict[str, list[float]]:
+        id_scores = dict()
+        for sub_chunk in sub_chunks:
+            if self._parent_id_key in sub_chunk.chunk_meta:
+                if sub_chunk.chunk_meta[self._parent_id_key] not in id_scores:
+                    id_scores[sub_chunk.chunk_meta[self._parent_id_key]] = []
+                id_scores[sub_chunk.chunk_meta[self._parent_id_key]].append(sub_chunk.score)
+        return id_scores
+    
+    def _rank_parents(self, retrieved_chunks_raw: list[Document], id_scores: dict[str, list[float]], sub_chunk_cnt: int, top_k: int) -> list[Chunk]:
+        if not retrieved_chunks_raw:
+            msg.warn(f"Retrieved 0 chunks from parent vectorstore, based on {sub_chunk_cnt} sub chunks")
+            return []
         
+        # normalize scores using min-max scaling
+        # TODO better normalization?
+        id_scores = {key: sum(scores) for key, scores in id_scores.items()}
+    
+        if len(id_scores) == 1:
+            # avoid division by zero
+            for key in id_scores:
+                id_scores[key] = 1
+        else: 
+            min_score = min(id_scores.values())
+            max_score = max(id_scores.values())
+            for key in id_scores:
+                id_scores[key] = (id_scores[key] - min_score) / (max_score - min_score)
+
+        
+        # assign scores
+        for retrieved_chunk_raw in retrieved_chunks_raw:
+            chunk_id = retrieved_chunk_raw.metadata["chunk_id"]
+            if chunk_id in id_scores:
+                retrieved_chunk_raw.metadata["score"] = id_scores[chunk_id]
+            else:
+                # This should not happen
+                msg.warn(f"Chunk {chunk_id} is retrieved even though it has no retrieved sub chunks")
+                retrieved_chunk_raw.metadata["score"] = 0 
+        
+        retrieved_chunks = [self.process_chunk(chunk_raw) for chunk_raw in retrieved_chunks_raw]
+        retrieved_chunks = sorted(retrieved_chunks, key=lambda x: x.score, reverse=True)[:top_k]
+        msg.info(f"Retrieved {len(retrieved_chunks)} chunks from parent vectorstore, based on {sub_chunk_cnt} sub chunks")
+        
+        return retrieved_chunks
 
     def _arange_filter(self, filter: Filter) -> dict:
         op_map = {
@@ -211,16 +281,26 @@ class PineconeMultiVectorRetriever(BaseRAGRetriever):
         child_namespace = config.sub_namespace
         
         embeddings_name = config.embeddings
-        embedding_model = embeddings.get_model(embeddings_name)
+        embedding_model = embeddings.get_model(
+            embeddings_name,
+            cache_path=config.embeddings_cache_path,
+            cache_max_entries=config.embeddings_cache_max_entries,
+        )
         
-        vectorstore = PineconeVectorstore(
+        vectorstore = get_vectorstore(
+            config.vectorstore,
             embeddings=embedding_model,
             namespace=parent_namespace,
+            local_path=config.local_path,
+            local_index=config.local_index,
         )
         
-        sub_vectorstore = PineconeVectorstore(
+        sub_vectorstore = get_vectorstore(
+            config.vectorstore,
             embeddings=embedding_model,
             namespace=child_namespace,
+            local_path=config.local_path,
+            local_index=config.local_index,
         )
         
         return cls(
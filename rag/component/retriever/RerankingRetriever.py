@@ -0,0 +1,91 @@
+from typing import Iterable, AsyncIterable, Optional
+import asyncio
+
+from rag.component.retriever.base import BaseRAGRetriever
+from rag.component.reranker import BaseRAGReranker
+from rag.type import *
+
+class RerankingRetriever(BaseRAGRetriever):
+    """Wrapper class that over-fetches candidates from a retriever and reranks them.
+    Candidates are reranked against the first query, i.e. the translated user query,
+    since the other transformations (rewriting, HyDE) only serve to widen the recall.
+
+    Args:
+        retriever (BaseRAGRetriever): The retriever to use.
+        reranker (BaseRAGReranker): The reranker to use.
+        over_fetch_factor (float): number of candidates to retrieve, relative to top_k
+    """
+    @classmethod
+    def from_retriever(cls, retriever: BaseRAGRetriever, reranker: BaseRAGReranker, **kwargs) -> "RerankingRetriever":
+        return cls(retriever, reranker, **kwargs)
+
+    def __init__(
+        self,
+        retriever: BaseRAGRetriever,
+        reranker: BaseRAGReranker,
+        over_fetch_factor: float = 3.0,
+        **kwargs,
+    ) -> None:
+        super().__init__()
+        self.retriever = retriever
+        self.reranker = reranker
+        self.top_k = self.retriever.top_k
+        self.over_fetch_factor = over_fetch_factor
+
+    def _over_fetch_k(self, top_k: int) -> int:
+        return max(top_k, int(top_k * self.over_fetch_factor))
+
+    @staticmethod
+    def _rerank_query(queries: TransformationResult) -> Optional[str]:
+        for query in queries.values():
+            if isinstance(query, list):
+                if query:
+                    return query[0]
+            elif query:
+                return query
+        return None
+
+    def _rerank(self, queries: TransformationResult, candidates: list[Chunk], top_k: int) -> list[Chunk]:
+        query = self._rerank_query(queries)
+        if query is None:
+            return candidates[:top_k]
+        return self.reranker.rerank(query, candidates, top_k)
+
+    def retrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        candidates = self.retriever.retrieve(queries, filter=filter, top_k=self._over_fetch_k(top_k))
+        return self._rerank(queries, candidates, top_k)
+
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        collected_queries: list[str] = []
+        def _collecting_batches():
+            for queries in query_batches:
+                collected_queries.extend(queries)
+                yield queries
+
+        batches = _collecting_batches()
+        candidates = self.retriever.retrieve_stream(batches, filter=filter, top_k=self._over_fetch_k(top_k))
+        for _ in batches:
+            pass
+        return self._rerank({"query": collected_queries}, candidates, top_k)
+
+    async def aretrieve(self, queries: TransformationResult, filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        candidates = await self.retriever.aretrieve(queries, filter=filter, top_k=self._over_fetch_k(top_k))
+        # scoring is CPU-bound
+        return await asyncio.to_thread(self._rerank, queries, candidates, top_k)
+
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: Filter | None = None, top_k: Optional[int] = None) -> list[Chunk]:
+        top_k = top_k or self.top_k
+        collected_queries: list[str] = []
+        async def _collecting_batches():
+            async for queries in query_batches:
+                collected_queries.extend(queries)
+                yield queries
+
+        batches = _collecting_batches()
+        candidates = await self.retriever.aretrieve_stream(batches, filter=filter, top_k=self._over_fetch_k(top_k))
+        async for _ in batches:
+            pass
+        return await asyncio.to_thread(self._rerank, {"query": collected_queries}, candidates, top_k)
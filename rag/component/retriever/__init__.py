@@ -3,6 +3,7 @@ from rag.component.retriever.KendraRetriever import KendraRetriever
 from rag.component.retriever.KnowledgeBaseRetriever import KnowledgeBaseOpenSearchRetriever, KnowledgeBasePineconeRetriever
 from rag.component.retriever.EnsembleRetriever import EnsembleRetriever
 from rag.component.retriever.HierarchicalRetriever import HierarchicalRetriever
+from rag.component.retriever.RerankingRetriever import RerankingRetriever
 from rag.component.retriever.PineconeMulitVectorRetriever import PineconeMultiVectorRetriever
 
 __all__ = [
@@ -13,5 +14,6 @@ __all__ = [
     "KnowledgeBasePineconeRetriever",
     "EnsembleRetriever",
     "HierarchicalRetriever",
+    "RerankingRetriever",
     "PineconeMultiVectorRetriever",
 ]
\ No newline at end of file
@@ -1,4 +1,6 @@
-from typing import Optional, Any
+from typing import Optional, Any, Iterable, AsyncIterable
+from itertools import chain
+import asyncio
 
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
@@ -16,9 +18,46 @@ class BaseRAGRetriever:
         """Set environment variables"""
         pass
     
-    def retrieve(self, queries: TransformationResult, filter: Optional[Filter]=None) -> list[Chunk]:
+    def retrieve(self, queries: TransformationResult, filter: Optional[Filter]=None, top_k: Optional[int]=None) -> list[Chunk]:
+        """Retrieve chunks with queries
+
+        Args:
+            queries (TransformationResult): queries to search
+            filter (Optional[Filter], optional): filter to apply. Defaults to None.
+            top_k (Optional[int], optional): number of chunks to retrieve, overriding `self.top_k`. Defaults to None.
+
+        Returns:
+            list[Chunk]: list of retrieved chunks
+        """
         return []
     
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: Optional[Filter]=None, top_k: Optional[int]=None) -> list[Chunk]:
+        """Retrieve chunks with queries that arrive over time.
+        Override this method to start searching before all the queries are arrived.
+        By default, it waits for all the queries and then calls `retrieve`.
+
+        Args:
+            query_batches (Iterable[list[str]]): batches of queries, in the order of arrival
+            filter (Optional[Filter], optional): filter to apply. Defaults to None.
+            top_k (Optional[int], optional): number of chunks to retrieve, overriding `self.top_k`. Defaults to None.
+
+        Returns:
+            list[Chunk]: list of retrieved chunks
+        """
+        queries = list(chain.from_iterable(query_batches))
+        return self.retrieve(queries_to_dict(queries), filter, top_k=top_k)
+    
+    async def aretrieve(self, queries: TransformationResult, filter: Optional[Filter]=None, top_k: Optional[int]=None) -> list[Chunk]:
+        """Async version of `retrieve`. By default, runs `retrieve` in a worker thread."""
+        return await asyncio.to_thread(self.retrieve, queries, filter, top_k=top_k)
+    
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: Optional[Filter]=None, top_k: Optional[int]=None) -> list[Chunk]:
+        """Async version of `retrieve_stream`. By default, waits for all the queries and then calls `aretrieve`."""
+        queries = []
+        async for batch in query_batches:
+            queries.extend(batch)
+        return await self.aretrieve(queries_to_dict(queries), filter, top_k=top_k)
+    
     def _arange_filter(self, filter: Filter) -> dict:
         raise NotImplementedError()
     
@@ -29,6 +68,9 @@ class BaseRAGRetriever:
     def from_config(cls, config: RetrievalConfig) -> "BaseRAGRetriever":
         raise NotImplementedError()
 
+def queries_to_dict(queries: list[str]) -> dict[str, str]:
+    return {f"query_{i}": query for i, query in enumerate(queries)}
+
 class FilterUtil:
     @staticmethod
     def and_all(*filters: Filter) -> Filter:
@@ -0,0 +1,179 @@
+from typing import Optional
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from wasabi import msg
+import json
+import os
+
+S3_SYNC_MANIFEST = ".s3sync.json"
+
+def list_objects(s3_client, bucket_name: str, prefix: str = "") -> dict[str, dict]:
+    """List the objects under the prefix with the paginator
+
+    Returns:
+        dict[str, dict]: ETag, size, and last modified time of the objects, by key
+    """
+    objects = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for response in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for result in response.get("Contents", []):
+            objects[result["Key"]] = {
+                "etag": result.get("ETag", "").strip('"'),
+                "size": result.get("Size"),
+                "last_modified": result["LastModified"].isoformat() if result.get("LastModified") else None,
+            }
+    return objects
+
+def get_file_folders(s3_client, bucket_name: str, prefix: str = "", objects: Optional[dict[str, dict]] = None) -> tuple[list[str], list[str]]:
+    file_names = []
+    folders = []
+
+    for key in (objects if objects is not None else list_objects(s3_client, bucket_name, prefix)):
+        if key[-1] == "/":
+            folders.append(key)
+        else:
+            file_names.append(key)
+
+    return file_names, folders
+
+def load_sync_manifest(local_path: str) -> dict[str, dict]:
+    manifest_path = os.path.join(local_path, S3_SYNC_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def save_sync_manifest(local_path: str, manifest: dict[str, dict]) -> None:
+    manifest_path = os.path.join(local_path, S3_SYNC_MANIFEST)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def download_files(
+    s3_client,
+    bucket_name: str,
+    local_path: str,
+    file_names: list[str],
+    folders: list[str],
+    ignore_existing: bool = False,
+    objects: Optional[dict[str, dict]] = None,
+    max_workers: int = 8,
+) -> list[str]:
+    """Download the files concurrently, with the shared client
+
+    Args:
+        ignore_existing (bool): skip the files which are unchanged since the last sync.
+            Compared by ETag, size, and last modified time of the objects, against the sync manifest in `local_path`
+        objects (Optional[dict[str, dict]]): listed objects. See `list_objects`. Listed again if not provided
+        max_workers (int): number of files downloaded concurrently
+
+    Returns:
+        list[str]: downloaded file names
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    local_path = Path(local_path)
+    objects = objects if objects is not None else list_objects(s3_client, bucket_name)
+    manifest = load_sync_manifest(local_path)
+
+    for folder in folders:
+        # Create all folders in the path
+        Path.joinpath(local_path, folder).mkdir(parents=True, exist_ok=True)
+
+    to_download = []
+    for file_name in file_names:
+        file_path = Path.joinpath(local_path, file_name)
+        if ignore_existing and file_path.exists() and manifest.get(file_name) == objects.get(file_name):
+            continue
+        to_download.append(file_name)
+    msg.info(f"{len(file_names) - len(to_download)} files unchanged. Skipping...")
+
+    # concurrency comes from the files. each file is downloaded in a single thread
+    transfer_config = TransferConfig(use_threads=False)
+
+    def _download(file_name: str) -> str:
+        file_path = Path.joinpath(local_path, file_name)
+        # Create folder for parent directory
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        msg.info(f"Downloading {file_name} to {file_path}")
+        # download aside, so that a failed download does not leave a partial file
+        s3_client.download_file(
+            bucket_name,
+            file_name,
+            f"{file_path}.part",
+            Config=transfer_config,
+        )
+        os.replace(f"{file_path}.part", file_path)
+        return file_name
+
+    downloaded = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_download, file_name) for file_name in to_download]
+        for future in as_completed(futures):
+            try:
+                file_name = future.result()
+            except Exception as e:
+                msg.fail(f"Failed to download: {e}")
+                continue
+            downloaded.append(file_name)
+            manifest[file_name] = objects.get(file_name)
+
+    # forget the deleted objects
+    manifest = {key: value for key, value in manifest.items() if key in objects}
+    save_sync_manifest(local_path, manifest)
+    return downloaded
+
+def attach_metadata(local_path: str, file_names: list[str], bucket_name: str, metadata_ext: str = ".metadata.json") -> None:
+    for file_name in file_names:
+        if not file_name.endswith(".pdf"):
+            continue
+        metadata_path = os.path.join(local_path, file_name) + metadata_ext
+
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+
+        metadata["source"] = f"s3://{bucket_name}/{file_name}"
+        metadata["doc_id"] = metadata["source"]
+
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f)
+
+def sync_from_s3(
+    to_dir: str,
+    ignore_existing: bool = True,
+    max_workers: int = 8,
+    s3_client=None,
+    bucket_name: Optional[str] = None,
+    metadata_ext: str = ".metadata.json",
+) -> list[str]:
+    """Sync the objects of the bucket into `to_dir`, downloading only the new or changed ones if `ignore_existing`,
+    and attach the S3 url to the metadata of the downloaded documents
+
+    Args:
+        s3_client: boto3 S3 client. Created with a connection per download worker if not provided
+        bucket_name (Optional[str]): bucket to sync. `S3_BUCKET_NAME` if not provided
+
+    Returns:
+        list[str]: keys of the documents whose file or metadata is downloaded
+    """
+    bucket_name = bucket_name or os.getenv("S3_BUCKET_NAME")
+    if s3_client is None:
+        import boto3
+        from botocore.config import Config
+        # shared by the download threads
+        s3_client = boto3.client("s3", config=Config(max_pool_connections=max_workers))
+
+    objects = list_objects(s3_client, bucket_name)
+    file_names, folders = get_file_folders(s3_client, bucket_name, objects=objects)
+    downloaded = set(download_files(
+        s3_client, bucket_name, to_dir, file_names, folders, ignore_existing=ignore_existing, objects=objects, max_workers=max_workers
+    ))
+
+    # metadata of the unchanged files are already attached
+    changed = [
+        file_name for file_name in file_names
+        if file_name in downloaded or f"{file_name}{metadata_ext}" in downloaded
+    ]
+    attach_metadata(to_dir, changed, bucket_name, metadata_ext=metadata_ext)
+    return changed
@@ -0,0 +1,117 @@
+from typing import Optional, Any
+import json
+import os
+import sqlite3
+import threading
+
+class BaseTraceStore:
+    """Store of the finished spans
+
+    Args:
+        path (str): path of the store
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, spans: list[dict[str, Any]]) -> None:
+        raise NotImplementedError()
+
+    def read(self, since: Optional[float] = None, until: Optional[float] = None) -> list[dict[str, Any]]:
+        """Spans started within the time window
+
+        Args:
+            since (Optional[float]): unix timestamp. From the beginning if not provided
+            until (Optional[float]): unix timestamp. Until now if not provided
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteTraceStore(BaseTraceStore):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spans ("
+            "span_id TEXT PRIMARY KEY, "
+            "trace_id TEXT NOT NULL, "
+            "parent_id TEXT, "
+            "name TEXT NOT NULL, "
+            "start REAL NOT NULL, "
+            "duration REAL, "
+            "attributes TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spans_start ON spans (start)")
+        self._conn.commit()
+
+    def write(self, spans: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO spans (span_id, trace_id, parent_id, name, start, duration, attributes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (s["span_id"], s["trace_id"], s["parent_id"], s["name"], s["start"], s["duration"], json.dumps(s["attributes"], default=str))
+                    for s in spans
+                ]
+            )
+            self._conn.commit()
+
+    def read(self, since: Optional[float] = None, until: Optional[float] = None) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT span_id, trace_id, parent_id, name, start, duration, attributes FROM spans "
+                "WHERE start >= ? AND start <= ? ORDER BY start",
+                (since or 0, until or float("inf"))
+            ).fetchall()
+        return [
+            {
+                "span_id": span_id,
+                "trace_id": trace_id,
+                "parent_id": parent_id,
+                "name": name,
+                "start": start,
+                "duration": duration,
+                "attributes": json.loads(attributes),
+            }
+            for span_id, trace_id, parent_id, name, start, duration, attributes in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JSONLTraceStore(BaseTraceStore):
+    """Spans appended to a JSON Lines file, one span per line. Easy to ship to other tools, but read by a full scan"""
+    def write(self, spans: list[dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(s, default=str) + "\n" for s in spans)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
+
+    def read(self, since: Optional[float] = None, until: Optional[float] = None) -> list[dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+
+        spans = []
+        with self._lock:
+            with open(self.path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    s = json.loads(line)
+                    if (since or 0) <= s["start"] <= (until or float("inf")):
+                        spans.append(s)
+        return sorted(spans, key=lambda s: s["start"])
+
+
+def get_trace_store(path: str) -> BaseTraceStore:
+    if path.endswith(".jsonl"):
+        return JSONLTraceStore(path)
+    return SQLiteTraceStore(path)
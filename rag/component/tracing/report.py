@@ -0,0 +1,55 @@
+from typing import Any
+import math
+
+# numeric span attributes reported as their own rows, e.g. `generation.ttft`
+METRIC_ATTRIBUTES = ["ttft", "tokens_per_s"]
+USAGE_ATTRIBUTES = ["prompt_tokens", "completion_tokens", "cost"]
+
+def percentile(values: list[float], q: float) -> float:
+    """Percentile with linear interpolation between the closest ranks
+
+    Args:
+        values (list[float]): sorted values
+        q (float): percentile in [0, 100]
+    """
+    if not values:
+        return math.nan
+    rank = (len(values) - 1) * q / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+def stage_stats(spans: list[dict[str, Any]]) -> dict[str, dict[str, float]]:
+    """Latency percentiles per stage, and the total usage of the stage
+
+    Returns:
+        dict[str, dict[str, float]]: count, mean, p50, p95, p99 and usage, by stage name
+    """
+    samples: dict[str, list[float]] = {}
+    usages: dict[str, dict[str, float]] = {}
+    for span in spans:
+        if span.get("duration") is None:
+            continue
+        samples.setdefault(span["name"], []).append(span["duration"])
+
+        attributes = span.get("attributes") or {}
+        for key in METRIC_ATTRIBUTES:
+            if isinstance(attributes.get(key), (int, float)):
+                samples.setdefault(f"{span['name']}.{key}", []).append(attributes[key])
+
+        usage = usages.setdefault(span["name"], {})
+        for key in USAGE_ATTRIBUTES:
+            if isinstance(attributes.get(key), (int, float)):
+                usage[key] = usage.get(key, 0) + attributes[key]
+
+    stats = {}
+    for name, values in sorted(samples.items()):
+        values = sorted(values)
+        stats[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            **usages.get(name, {}),
+        }
+    return stats
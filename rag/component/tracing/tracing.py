@@ -0,0 +1,265 @@
+from typing import Optional, Callable, Iterator, Any, TypeVar
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+import inspect
+from wasabi import msg
+import threading
+import time
+import uuid
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+from rag.component.tracing.TraceStore import BaseTraceStore, get_trace_store
+
+T = TypeVar("T")
+
+class Span:
+    """A timed stage of a trace. Spans of a trace are written together, when the root span ends.
+
+    Attributes:
+        name (str): name of the stage, e.g. `retrieve`, `generation`
+        attributes (dict[str, Any]): e.g. token counts, cost, number of queries
+    """
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes: Any) -> None:
+        self.name = name
+        self.parent = parent
+        self.root: Span = parent.root if parent is not None else self
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes: dict[str, Any] = attributes
+
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self._start = time.perf_counter()
+
+        # shared by the spans of the trace
+        self._lock: threading.Lock = parent._lock if parent is not None else threading.Lock()
+        self._finished: list[Span] = parent._finished if parent is not None else []
+
+    def set(self, **attributes: Any) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, **counts: float) -> None:
+        """Accumulate numeric attributes, e.g. token counts of multiple LLM calls"""
+        with self._lock:
+            for key, value in counts.items():
+                self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Span of the disabled tracer"""
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def add(self, **counts: float) -> None:
+        pass
+
+    def elapsed(self) -> float:
+        return 0.0
+
+_NOOP_SPAN = _NoopSpan()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_callback_handler: ContextVar[Optional[BaseCallbackHandler]] = ContextVar("tracing_callback_handler", default=None)
+# LLM calls within a trace report their token usage to the current span
+register_configure_hook(_callback_handler, inheritable=True)
+
+
+class Tracer:
+    """Records the spans of the traces into the trace store.
+    Disabled if no store is provided, so that instrumented code costs almost nothing.
+
+    Args:
+        store (Optional[BaseTraceStore]): store of the finished traces
+    """
+    def __init__(self, store: Optional[BaseTraceStore] = None) -> None:
+        self.store = store
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Time the block as a span, child of the current span.
+        A span without the current span starts a new trace.
+        """
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+
+        parent = _current_span.get()
+        span = Span(name, parent, **attributes)
+        span_token = _current_span.set(span)
+        handler_token = _callback_handler.set(TracingCallbackHandler()) if parent is None else None
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{e.__class__.__name__}: {e}")
+            raise
+        finally:
+            span.finish()
+            try:
+                _current_span.reset(span_token)
+                if handler_token is not None:
+                    _callback_handler.reset(handler_token)
+            except ValueError:
+                # generator resumed in another context, e.g. iterated by a thread pool
+                _current_span.set(parent)
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with span._lock:
+            span._finished.append(span)
+            if span.root.duration is None:
+                return
+            # the root is finished. spans finished later (e.g. timed out retrievers) are written alone
+            spans, span._finished[:] = list(span._finished), []
+        try:
+            self.store.write([s.to_dict() for s in spans])
+        except Exception as e:
+            msg.warn(f"Failed to write {len(spans)} spans: {e}")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Attach the token usage and the cost of LLM calls to the current span, and to the root span of the trace"""
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        span = _current_span.get()
+        if span is None:
+            return
+
+        model_name, prompt_tokens, completion_tokens = _token_usage(response)
+        if not prompt_tokens and not completion_tokens:
+            return
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "llm_calls": 1}
+        if (cost := _cost(model_name, prompt_tokens, completion_tokens)) is not None:
+            usage["cost"] = cost
+
+        span.add(**usage)
+        if span.root is not span:
+            span.root.add(**usage)
+
+
+def _token_usage(response: LLMResult) -> tuple[Optional[str], int, int]:
+    llm_output = response.llm_output or {}
+    model_name = llm_output.get("model_name")
+    if (token_usage := llm_output.get("token_usage")):
+        return model_name, token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+    # streaming responses report the usage in the message
+    prompt_tokens, completion_tokens = 0, 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens += usage_metadata.get("input_tokens", 0)
+            completion_tokens += usage_metadata.get("output_tokens", 0)
+            if message is not None:
+                model_name = model_name or message.response_metadata.get("model_name")
+    return model_name, prompt_tokens, completion_tokens
+
+def _cost(model_name: Optional[str], prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    if model_name is None:
+        return None
+    try:
+        from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+        return (
+            get_openai_token_cost_for_model(model_name, prompt_tokens)
+            + get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True)
+        )
+    except Exception:
+        # unknown model
+        return None
+
+
+_tracer = Tracer()
+
+def configure(path: Optional[str]) -> None:
+    """Record the traces into the store at `path` (`.jsonl` or SQLite). Disable tracing if not provided"""
+    global _tracer
+    if _tracer.store is not None and _tracer.store.path == path:
+        return
+    _tracer = Tracer(get_trace_store(path) if path else None)
+    if path:
+        msg.info(f"Tracing into {path}")
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+def span(name: str, **attributes: Any):
+    """Time the block as a span of the current trace. See `Tracer.span`"""
+    return _tracer.span(name, **attributes)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def annotate(**attributes: Any) -> None:
+    """Set attributes of the current span, if any"""
+    if (current := _current_span.get()) is not None:
+        current.set(**attributes)
+
+def bind(func: Callable[..., T]) -> Callable[..., T]:
+    """Run `func` in the current trace context, e.g. in a worker thread.
+    Threads do not inherit the context, so the spans in the worker would start new traces otherwise.
+    """
+    context = copy_context()
+
+    @wraps(func)
+    def _bound(*args, **kwargs) -> T:
+        # a context cannot be entered by multiple threads at once
+        return context.copy().run(func, *args, **kwargs)
+    return _bound
+
+def traced(name: str, func: Callable[..., T], **attributes: Any) -> Callable[..., T]:
+    """Wrap `func` to run in a span"""
+    @wraps(func)
+    def _traced(*args, **kwargs) -> T:
+        with span(name, **attributes):
+            return func(*args, **kwargs)
+    return _traced
+
+def trace(name: str, **attributes: Any):
+    """Decorator running the function in a span. Generators are traced until they are exhausted"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @wraps(func)
+            async def _traced_async_gen(*args, **kwargs):
+                with span(name, **attributes):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return _traced_async_gen
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def _traced_gen(*args, **kwargs):
+                with span(name, **attributes):
+                    yield from func(*args, **kwargs)
+            return _traced_gen
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def _traced_async(*args, **kwargs):
+                with span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return _traced_async
+        return traced(name, func, **attributes)
+    return decorator
@@ -0,0 +1,373 @@
+from typing import Optional, Any, Callable
+from wasabi import msg
+import os
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+from rag.component.vectorstore.base import BaseRAGVectorstore
+from rag.type import Chunk, Embeddings
+
+Predicate = Callable[[dict[str, Any]], bool]
+
+def _as_list(value: Any) -> list:
+    return value if isinstance(value, list) else [value]
+
+def compile_filter(filter: dict) -> Predicate:
+    """Compile a pinecone style metadata filter into a predicate on the flattened metadata.
+    Supports `$eq`, `$ne`, `$gt`, `$gte`, `$lt`, `$lte`, `$in`, `$nin`, `$and`, `$or`.
+    List valued metadata matches if any of its elements matches, like pinecone.
+
+    Example:
+        {"$and": [{"doc_meta/doc_type": {"$eq": "base"}}, {"doc_meta/category": {"$in": ["a", "b"]}}]}
+    """
+    predicates: list[Predicate] = []
+    for key, operand in filter.items():
+        if key == "$and":
+            sub_predicates = [compile_filter(f) for f in operand]
+            predicates.append(lambda meta, ps=sub_predicates: all(p(meta) for p in ps))
+        elif key == "$or":
+            sub_predicates = [compile_filter(f) for f in operand]
+            predicates.append(lambda meta, ps=sub_predicates: any(p(meta) for p in ps))
+        elif key.startswith("$"):
+            raise ValueError(f"Invalid filter operation: {key}")
+        else:
+            if not isinstance(operand, dict):
+                # shorthand of $eq
+                operand = {"$eq": operand}
+            for op, value in operand.items():
+                predicates.append(_compile_predicate(key, op, value))
+    return lambda meta: all(p(meta) for p in predicates)
+
+def _compile_predicate(key: str, op: str, value: Any) -> Predicate:
+    def _values(meta: dict[str, Any]) -> list:
+        return _as_list(meta[key]) if key in meta else []
+
+    def _compare(cmp: Callable[[Any], bool]) -> Predicate:
+        def predicate(meta: dict[str, Any]) -> bool:
+            try:
+                return any(cmp(v) for v in _values(meta))
+            except TypeError:
+                return False
+        return predicate
+
+    if op == "$eq":
+        return lambda meta: value in _values(meta)
+    elif op == "$ne":
+        return lambda meta: value not in _values(meta)
+    elif op == "$in":
+        return lambda meta: any(v in value for v in _values(meta))
+    elif op == "$nin":
+        return lambda meta: not any(v in value for v in _values(meta))
+    elif op == "$gt":
+        return _compare(lambda v: v > value)
+    elif op == "$gte":
+        return _compare(lambda v: v >= value)
+    elif op == "$lt":
+        return _compare(lambda v: v < value)
+    elif op == "$lte":
+        return _compare(lambda v: v <= value)
+    else:
+        raise ValueError(f"Invalid filter operation: {op}")
+
+
+class LocalVectorstore(BaseRAGVectorstore):
+    """In-process vectorstore, for running ingestion and retrieval on a single machine without network hops.
+    Normalized vectors are stored in a memory-mapped float32 matrix and searched exactly by cosine similarity.
+    If `index` is "hnsw" and hnswlib is installed, an HNSW index is used once the namespace grows over `hnsw_min_entries`.
+    Texts and flattened metadata are stored in a SQLite file next to the matrix.
+
+    Layout:
+        {path}/{namespace}/vectors.f32
+        {path}/{namespace}/records.sqlite
+
+    Args:
+        embeddings (Embeddings): embeddings model
+        path (str): root directory of the vectorstore
+        namespace (Optional[str]): namespace, stored in a separate directory
+        index (str): "flat" for exact search, "hnsw" for approximate search on large namespaces
+        hnsw_min_entries (int): minimum number of vectors to use the HNSW index
+    """
+    INITIAL_CAPACITY = 1024
+    EMBEDDING_BATCH_SIZE = 256
+
+    def __init__(
+        self,
+        embeddings: Embeddings | None = None,
+        path: str = "vectorstore",
+        namespace: Optional[str] = None,
+        index: str = "flat",
+        hnsw_min_entries: int = 10000,
+        text_key: Optional[str] = "text",
+        **kwargs
+    ) -> None:
+        super().__init__(embeddings)
+        self.namespace = namespace
+        self.index = index
+        self.hnsw_min_entries = hnsw_min_entries
+        self._text_key = text_key
+
+        self.dir = os.path.join(path, namespace or "default")
+        os.makedirs(self.dir, exist_ok=True)
+        self._vectors_path = os.path.join(self.dir, "vectors.f32")
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.dir, "records.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        self._vectors: Optional[np.memmap] = None
+        self._hnsw = None
+        self._filter_masks: dict[str, np.ndarray] = {}
+        self._load()
+
+    def _load(self) -> None:
+        """Load the records into memory, and map the vectors"""
+        row = self._conn.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        self.dim: Optional[int] = int(row[0]) if row else None
+
+        self._ids: list[Optional[str]] = []
+        self._texts: list[Optional[str]] = []
+        self._metas: list[Optional[dict[str, Any]]] = []
+        self._id_to_row: dict[str, int] = {}
+        self._free_rows: list[int] = []
+
+        for row, id, text, metadata in self._conn.execute("SELECT row, id, text, metadata FROM records ORDER BY row"):
+            while len(self._ids) < row:
+                self._free_rows.append(len(self._ids))
+                self._append_slot(None, None, None)
+            self._append_slot(id, text, json.loads(metadata))
+            self._id_to_row[id] = row
+
+        self._alive = np.array([id is not None for id in self._ids], dtype=bool)
+        if self.dim is not None and os.path.exists(self._vectors_path):
+            capacity = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _append_slot(self, id: Optional[str], text: Optional[str], meta: Optional[dict]) -> None:
+        self._ids.append(id)
+        self._texts.append(text)
+        self._metas.append(meta)
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    def _ensure_capacity(self, rows: int) -> None:
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows <= capacity:
+            return
+
+        new_capacity = max(capacity, self.INITIAL_CAPACITY)
+        while new_capacity < rows:
+            new_capacity *= 2
+
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+
+    def _embed_documents(self, texts: list[str]) -> np.ndarray:
+        vectors = []
+        for i in range(0, len(texts), self.EMBEDDING_BATCH_SIZE):
+            vectors.extend(self.embeddings.embed_documents(texts[i:i + self.EMBEDDING_BATCH_SIZE]))
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def ingest(self, chunks: list[Chunk]) -> int:
+        docs = self._prepare_documents(chunks)
+        if not docs:
+            return 0
+
+        vectors = self._embed_documents([doc.page_content for doc in docs])
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the vectorstore dimension {self.dim}")
+
+            rows = []
+            for doc in docs:
+                id = doc.metadata["chunk_id"]
+                if id in self._id_to_row:
+                    # upsert in place
+                    row = self._id_to_row[id]
+                elif self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    row = len(self._ids)
+                    self._append_slot(None, None, None)
+
+                self._ids[row] = id
+                self._texts[row] = doc.page_content
+                self._metas[row] = doc.metadata
+                self._id_to_row[id] = row
+                rows.append(row)
+
+            self._ensure_capacity(len(self._ids))
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+
+            if len(self._alive) < len(self._ids):
+                self._alive = np.concatenate([self._alive, np.zeros(len(self._ids) - len(self._alive), dtype=bool)])
+            self._alive[rows] = True
+            self._filter_masks.clear()
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                [(row, doc.metadata["chunk_id"], doc.page_content, json.dumps(doc.metadata)) for row, doc in zip(rows, docs)]
+            )
+            self._conn.commit()
+
+            if self._hnsw is not None:
+                self._hnsw_add(rows)
+        return len(docs)
+
+    def delete(self, ids: list[str]) -> int:
+        with self._lock:
+            rows = [self._id_to_row.pop(id) for id in ids if id in self._id_to_row]
+            for row in rows:
+                self._ids[row] = None
+                self._texts[row] = None
+                self._metas[row] = None
+                self._free_rows.append(row)
+                if self._hnsw is not None:
+                    self._hnsw.mark_deleted(row)
+            self._alive[rows] = False
+            self._filter_masks.clear()
+
+            self._conn.executemany("DELETE FROM records WHERE row = ?", [(row,) for row in rows])
+            self._conn.commit()
+        return len(rows)
+
+    def query(self, query: str, top_k: int = 5, filter: dict | None = None) -> list[Chunk]:
+        return self.query_by_vector(self.embeddings.embed_query(query), top_k=top_k, filter=filter)
+
+    def query_by_vector(self, embedding: list[float], top_k: int = 5, filter: dict | None = None) -> list[Chunk]:
+        with self._lock:
+            if not self._id_to_row:
+                return []
+
+            query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+            mask = self._mask(filter)
+
+            if self._use_hnsw():
+                rows, scores = self._search_hnsw(query, top_k, mask)
+            else:
+                rows, scores = self._search_exact(query, top_k, mask)
+
+            result = [
+                (self._to_document(row), float(score))
+                for row, score in zip(rows, scores)
+            ]
+        return self._process_query_result(result)
+
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        if not queries:
+            return []
+        return self.embeddings.embed_documents(queries)
+
+    def fetch_docs(self, ids: list[str]) -> list[Document]:
+        with self._lock:
+            return [self._to_document(self._id_to_row[id]) for id in ids if id in self._id_to_row]
+
+    def _to_document(self, row: int) -> Document:
+        return Document(page_content=self._texts[row], metadata=dict(self._metas[row]))
+
+    def _mask(self, filter: dict | None) -> np.ndarray:
+        """Rows that are alive and match the filter. Masks are memoized until the next write"""
+        if not filter:
+            return self._alive
+
+        key = json.dumps(filter, sort_keys=True)
+        if key not in self._filter_masks:
+            predicate = compile_filter(filter)
+            matched = np.fromiter(
+                (meta is not None and predicate(meta) for meta in self._metas),
+                dtype=bool,
+                count=len(self._metas),
+            )
+            self._filter_masks[key] = matched & self._alive
+        return self._filter_masks[key]
+
+    def _search_exact(self, query: np.ndarray, top_k: int, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            return candidates, np.array([], dtype=np.float32)
+
+        if len(candidates) == len(self._ids):
+            scores = self._vectors[:len(candidates)] @ query
+        else:
+            scores = self._vectors[candidates] @ query
+
+        top_k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top], scores[top]
+
+    def _use_hnsw(self) -> bool:
+        if self.index != "hnsw" or len(self) < self.hnsw_min_entries:
+            return False
+        if self._hnsw is None:
+            self._build_hnsw()
+        return self._hnsw is not None
+
+    def _build_hnsw(self) -> None:
+        try:
+            import hnswlib
+        except ImportError:
+            msg.warn("hnswlib is not installed. Falling back to exact search. Run `pip install hnswlib` to use HNSW index.")
+            self.index = "flat"
+            return
+
+        msg.info(f"Building HNSW index of {len(self)} vectors in {self.dir}...")
+        self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+        self._hnsw.init_index(max_elements=max(len(self._ids), self.INITIAL_CAPACITY), ef_construction=200, M=16)
+        self._hnsw_add(list(np.flatnonzero(self._alive)))
+        msg.good(f"HNSW index built")
+
+    def _hnsw_add(self, rows: list[int]) -> None:
+        if not rows:
+            return
+        required = len(self._ids)
+        if required > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(required, self._hnsw.get_max_elements() * 2))
+        for row in rows:
+            try:
+                self._hnsw.unmark_deleted(row)
+            except RuntimeError:
+                # not deleted, or not added yet
+                pass
+        self._hnsw.add_items(np.asarray(self._vectors[rows]), np.asarray(rows))
+
+    def _search_hnsw(self, query: np.ndarray, top_k: int, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        top_k = min(top_k, int(mask.sum()))
+        if top_k == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        self._hnsw.set_ef(max(top_k * 2, 50))
+        filter_fn = None if mask is self._alive else (lambda row: bool(mask[row]))
+        rows, distances = self._hnsw.knn_query(query, k=top_k, filter=filter_fn)
+        # inner product space returns 1 - similarity as a distance
+        return rows[0], 1 - distances[0]
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
@@ -1,28 +1,43 @@
 import os
-from typing import Optional
+from typing import Optional, Iterable, Any
 from pinecone import Pinecone
-import uuid
+import json
 import pprint
+import time
 from wasabi import msg
 
 from langchain_pinecone import PineconeVectorStore as PVS
 from langchain_core.documents import Document
 
-from rag.component.vectorstore.base import BaseRAGVectorstore
+from rag.component.vectorstore.base import BaseRAGVectorstore, validate_chunks
 from rag.type import Chunk, Embeddings
 from rag import util
 
-def validate_chunks(chunks: list[Chunk]) -> None:
-    for chunk in chunks:
-        if "page" in chunk.chunk_meta and chunk.chunk_meta["page"] <= 0:
-            raise ValueError("page number must be greater than 0")
+# request limits of pinecone upsert
+MAX_UPSERT_BATCH_SIZE = 1000
+MAX_UPSERT_PAYLOAD_BYTES = 2 * 1024 * 1024
 
 class PineconeVectorstore(BaseRAGVectorstore):
+    """Pinecone index namespace.
+    
+    Args:
+        embeddings (Embeddings | None): embeddings model
+        namespace (Optional[str]): pinecone namespace
+        text_key (Optional[str]): metadata key of the chunk text
+        embedding_batch_size (int): number of chunks embedded at once in `bulk_ingest`
+        upsert_batch_size (int): maximum number of vectors in an upsert request
+        upsert_payload_bytes (int): maximum estimated payload size of an upsert request
+        pool_threads (int): number of concurrent upsert requests
+    """
     def __init__(
         self, 
         embeddings: Embeddings | None = None,
         namespace: Optional[str] = None,
         text_key: Optional[str] = "text",
+        embedding_batch_size: int = 1000,
+        upsert_batch_size: int = 100,
+        upsert_payload_bytes: int = MAX_UPSERT_PAYLOAD_BYTES,
+        pool_threads: int = 8,
         **kwargs
     ) -> None:
         super().__init__(embeddings)
@@ -30,39 +45,80 @@ class PineconeVectorstore(BaseRAGVectorstore):
             index_name=self.index_name,
             embedding=self.embeddings,
             namespace=namespace,
+            pool_threads=pool_threads,
         )
         self.namespace = namespace
         self._text_key = text_key
+        self.embedding_batch_size = embedding_batch_size
+        self.upsert_batch_size = min(upsert_batch_size, MAX_UPSERT_BATCH_SIZE)
+        self.upsert_payload_bytes = min(upsert_payload_bytes, MAX_UPSERT_PAYLOAD_BYTES)
     
     def _set_env(self):
         self.api_key = os.environ["PINECONE_API_KEY"]
         self.index_name = os.environ["PINECONE_INDEX_NAME"]
         
     def ingest(self, chunks: list[Chunk]) -> int:
-        validate_chunks(chunks)
-        docs = [chunk.to_document() for chunk in chunks]
-        
-        for doc in docs:
-            _meta = util.flatten_dict(doc.metadata)
-            
-            if not _meta.get("chunk_id"):
-                _meta["chunk_id"] = str(uuid.uuid4())
-            if not _meta.get("doc_id"):
-                if not _meta.get("source"):
-                    raise ValueError("doc_id or source must be provided in metadata")
-                _meta["doc_id"] = _meta["source"]
+        return self.bulk_ingest(chunks)
+    
+    def bulk_ingest(self, chunks: Iterable[Chunk], batch_size: Optional[int] = None) -> int:
+        """Embed the chunks in large batches, and upsert them with concurrent requests.
+        Upserts of a batch run in the background while the next batch is embedded.
 
-            doc.metadata = _meta
-        
-        ids = [doc.metadata["chunk_id"] for doc in docs]
+        Args:
+            chunks (Iterable[Chunk]): chunks to ingest. Consumed lazily
+            batch_size (Optional[int]): number of chunks embedded at once. `embedding_batch_size` if not provided
+
+        Returns:
+            int: number of ingested chunks
+        """
+        start = time.monotonic()
+        ingested_cnt = 0
+        pending: list[Any] = []
+        for batch in util.batched(chunks, batch_size or self.embedding_batch_size):
+            docs = self._prepare_documents(batch)
+            embeddings = self.embeddings.embed_documents([doc.page_content for doc in docs])
+            vectors = [
+                (doc.metadata["chunk_id"], embedding, {**doc.metadata, self._text_key: doc.page_content})
+                for doc, embedding in zip(docs, embeddings)
+            ]
+            
+            # wait for the previous batch, so that at most two batches are held in memory
+            self._wait(pending)
+            pending = [
+                self.vectorstore._index.upsert(vectors=upsert_batch, namespace=self.namespace, async_req=True)
+                for upsert_batch in self._split_upsert_batches(vectors)
+            ]
+            ingested_cnt += len(vectors)
+        self._wait(pending)
         
-        # print(self.namespace, len(docs), ids)
-        self.vectorstore.add_documents(
-            documents=docs,
-            ids=ids,
-            namespace=self.namespace,
-        )
-        return len(docs)
+        elapsed = time.monotonic() - start
+        if ingested_cnt:
+            msg.info(f"{ingested_cnt} vectors upserted into `{self.namespace}` ({ingested_cnt / max(elapsed, 1e-9):.1f} vectors/s)")
+        return ingested_cnt
+    
+    def _split_upsert_batches(self, vectors: list[tuple[str, list[float], dict]]) -> Iterable[list[tuple[str, list[float], dict]]]:
+        """Split the vectors into upsert requests, within the vector count and the payload size limits"""
+        batch, batch_bytes = [], 0
+        for vector in vectors:
+            vector_bytes = self._estimate_bytes(vector)
+            if batch and (len(batch) >= self.upsert_batch_size or batch_bytes + vector_bytes > self.upsert_payload_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(vector)
+            batch_bytes += vector_bytes
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def _estimate_bytes(vector: tuple[str, list[float], dict]) -> int:
+        id, values, metadata = vector
+        # values are serialized as json floats, about 20 bytes each
+        return len(id) + 20 * len(values) + len(json.dumps(metadata, default=str))
+    
+    @staticmethod
+    def _wait(pending: list[Any]) -> None:
+        for result in pending:
+            result.get()
 
     def query(self, query: str, top_k: int = 5, filter: dict | None=None) -> list[Chunk]:
         result = self.vectorstore.similarity_search_with_score(
@@ -71,42 +127,23 @@ class PineconeVectorstore(BaseRAGVectorstore):
             namespace=self.namespace,  
             filter=filter 
         )
-        
-        if result:
-            retrieved_chunks_raw, scores = zip(*result)
-        else:
-            retrieved_chunks_raw, scores = [], []
-        
-        chunks = []
-        for chunk_raw, score in zip(retrieved_chunks_raw, scores):
-            restored_metadata = util.deflatten_dict(chunk_raw.metadata)
-            chunks.append(Chunk(
-                text=chunk_raw.page_content,
-                doc_id=util.MetadataSearch.search_doc_id(restored_metadata),
-                chunk_id=util.MetadataSearch.search_chunk_id(restored_metadata),
-                doc_meta=restored_metadata["doc_meta"],
-                chunk_meta={**restored_metadata["chunk_meta"], "score": score},
-                score=score,
-                source_retriever=self.__class__.__name__,
-            ))
-        return chunks
-        
+        return self._process_query_result(result)
+    
+    def query_by_vector(self, embedding: list[float], top_k: int = 5, filter: dict | None=None) -> list[Chunk]:
+        result = self.vectorstore.similarity_search_by_vector_with_score(
+            embedding=embedding,
+            k=top_k,
+            namespace=self.namespace,
+            filter=filter
+        )
+        return self._process_query_result(result)
+    
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Embed multiple queries with a single embeddings request"""
+        if not queries:
+            return []
+        return self.embeddings.embed_documents(queries)
     
-    def fetch(self, ids: list[str]) -> list[Chunk]:
-        retrieved_chunks_raw = self._fetch_docs(ids)
-        chunks = []
-        for chunk_raw in retrieved_chunks_raw:
-            restored_metadata = util.deflatten_dict(chunk_raw.metadata)
-            chunks.append(Chunk(
-                text=chunk_raw.page_content,
-                doc_id=restored_metadata["doc_id"],
-                chunk_id=restored_metadata["chunk_id"],
-                doc_meta=restored_metadata["doc_meta"],
-                chunk_meta=restored_metadata["chunk_meta"],
-                source_retriever=self.__class__.__name__,
-            ))
-        return chunks
-        
     def _fetch_docs(self, ids: list[str]) -> list[Document]:
         if not ids:
             return []
@@ -129,4 +166,13 @@ class PineconeVectorstore(BaseRAGVectorstore):
         return docs
     
     def fetch_docs(self, ids: list[str]) -> list[Document]:
-        return self._fetch_docs(ids)
\ No newline at end of file
+        return self._fetch_docs(ids)
+    
+    def delete(self, ids: list[str]) -> int:
+        if not ids:
+            return 0
+        self.vectorstore._index.delete(
+            ids=ids,
+            namespace=self.namespace,
+        )
+        return len(ids)
\ No newline at end of file
@@ -1,7 +1,11 @@
 from rag.component.vectorstore.base import BaseRAGVectorstore
 from rag.component.vectorstore.PineconeVectorstore import PineconeVectorstore
+from rag.component.vectorstore.LocalVectorstore import LocalVectorstore
+from rag.component.vectorstore.vectorstore import get_vectorstore
 
 __all__ = [
     "BaseRAGVectorstore",
     "PineconeVectorstore",
-]
\ No newline at end of file
+    "LocalVectorstore",
+    "get_vectorstore",
+]
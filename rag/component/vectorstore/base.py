@@ -1,8 +1,16 @@
-from typing import Optional
+from typing import Optional, Iterable
+import asyncio
+import uuid
 
 from langchain_core.documents import Document
 
 from rag.type import *
+from rag import util
+
+def validate_chunks(chunks: list[Chunk]) -> None:
+    for chunk in chunks:
+        if "page" in chunk.chunk_meta and chunk.chunk_meta["page"] <= 0:
+            raise ValueError("page number must be greater than 0")
 
 class BaseRAGVectorstore:
     def __init__(self, embeddings: Optional[Embeddings] = None, **kwargs) -> None:
@@ -16,5 +24,100 @@ class BaseRAGVectorstore:
     def ingest(self, chunks: list[Chunk]) -> int:
         raise NotImplementedError()
     
-    def query(self, query: str, top_k: int = 5) -> list[Chunk]:
+    def bulk_ingest(self, chunks: Iterable[Chunk], batch_size: int = 1000) -> int:
+        """Ingest a stream of chunks in large batches, without materializing the whole stream.
+        By default, each batch is passed to `ingest`. Backends may override it with a faster path.
+
+        Args:
+            chunks (Iterable[Chunk]): chunks to ingest
+            batch_size (int): number of chunks embedded at once
+
+        Returns:
+            int: number of ingested chunks
+        """
+        ingested_cnt = 0
+        for batch in util.batched(chunks, batch_size):
+            ingested_cnt += self.ingest(batch)
+        return ingested_cnt
+    
+    def query(self, query: str, top_k: int = 5, filter: dict | None = None) -> list[Chunk]:
+        raise NotImplementedError()
+    
+    def query_by_vector(self, embedding: list[float], top_k: int = 5, filter: dict | None = None) -> list[Chunk]:
+        raise NotImplementedError()
+    
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        raise NotImplementedError()
+    
+    def fetch_docs(self, ids: list[str]) -> list[Document]:
+        raise NotImplementedError()
+    
+    def delete(self, ids: list[str]) -> int:
         raise NotImplementedError()
+    
+    def fetch(self, ids: list[str]) -> list[Chunk]:
+        retrieved_chunks_raw = self.fetch_docs(ids)
+        chunks = []
+        for chunk_raw in retrieved_chunks_raw:
+            restored_metadata = util.deflatten_dict(chunk_raw.metadata)
+            chunks.append(Chunk(
+                text=chunk_raw.page_content,
+                doc_id=restored_metadata["doc_id"],
+                chunk_id=restored_metadata["chunk_id"],
+                doc_meta=restored_metadata["doc_meta"],
+                chunk_meta=restored_metadata["chunk_meta"],
+                source_retriever=self.__class__.__name__,
+            ))
+        return chunks
+    
+    def _prepare_documents(self, chunks: list[Chunk]) -> list[Document]:
+        """Convert chunks to documents with flattened metadata, which every vectorstore can filter on"""
+        validate_chunks(chunks)
+        docs = [chunk.to_document() for chunk in chunks]
+        
+        for doc in docs:
+            _meta = util.flatten_dict(doc.metadata)
+            
+            if not _meta.get("chunk_id"):
+                _meta["chunk_id"] = str(uuid.uuid4())
+            if not _meta.get("doc_id"):
+                if not _meta.get("source"):
+                    raise ValueError("doc_id or source must be provided in metadata")
+                _meta["doc_id"] = _meta["source"]
+
+            doc.metadata = _meta
+        return docs
+    
+    def _process_query_result(self, result: list[tuple[Document, float]]) -> list[Chunk]:
+        if result:
+            retrieved_chunks_raw, scores = zip(*result)
+        else:
+            retrieved_chunks_raw, scores = [], []
+        
+        chunks = []
+        for chunk_raw, score in zip(retrieved_chunks_raw, scores):
+            restored_metadata = util.deflatten_dict(chunk_raw.metadata)
+            chunks.append(Chunk(
+                text=chunk_raw.page_content,
+                doc_id=util.MetadataSearch.search_doc_id(restored_metadata),
+                chunk_id=util.MetadataSearch.search_chunk_id(restored_metadata),
+                doc_meta=restored_metadata["doc_meta"],
+                chunk_meta={**restored_metadata["chunk_meta"], "score": score},
+                score=score,
+                source_retriever=self.__class__.__name__,
+            ))
+        return chunks
+    
+    # blocking clients are run in a worker thread by default.
+    # override these methods if the client supports asyncio natively.
+    async def aquery_by_vector(self, embedding: list[float], top_k: int = 5, filter: dict | None = None) -> list[Chunk]:
+        return await asyncio.to_thread(self.query_by_vector, embedding, top_k=top_k, filter=filter)
+    
+    async def aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        if not queries:
+            return []
+        return await self.embeddings.aembed_documents(queries)
+    
+    async def afetch_docs(self, ids: list[str]) -> list[Document]:
+        return await asyncio.to_thread(self.fetch_docs, ids)
+
@@ -0,0 +1,32 @@
+from typing import Optional
+from wasabi import msg
+
+from rag.type import Embeddings
+from rag.component.vectorstore.base import BaseRAGVectorstore
+
+def get_vectorstore(
+    name: str,
+    embeddings: Embeddings,
+    namespace: Optional[str] = None,
+    local_path: str = "vectorstore",
+    local_index: str = "flat",
+    **kwargs
+) -> BaseRAGVectorstore:
+    """Create a vectorstore by its name
+
+    Args:
+        name (str): "pinecone" or "local"
+        embeddings (Embeddings): embeddings model
+        namespace (Optional[str]): namespace of the vectorstore
+        local_path (str): root directory of the local vectorstore
+        local_index (str): index type of the local vectorstore. "flat" or "hnsw"
+    """
+    if name == "pinecone":
+        from rag.component.vectorstore.PineconeVectorstore import PineconeVectorstore
+        return PineconeVectorstore(embeddings=embeddings, namespace=namespace, **kwargs)
+    elif name == "local":
+        from rag.component.vectorstore.LocalVectorstore import LocalVectorstore
+        return LocalVectorstore(embeddings=embeddings, path=local_path, namespace=namespace, index=local_index, **kwargs)
+    else:
+        msg.fail(f"Vectorstore {name} not supported.")
+        raise ValueError(f"Vectorstore {name} not supported")
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Literal
 from pydantic import BaseModel, Field
 
 
@@ -10,6 +10,10 @@ class LanguageConfig(BaseModel):
 class GlobalConfig(BaseModel):
     lang: LanguageConfig = LanguageConfig()
     context_hierarchy: bool = True
+    http_max_connections: int = Field(100, description="Maximum number of connections in the shared LLM http pool")
+    http_max_keepalive_connections: int = Field(20, description="Maximum number of idle connections kept alive in the shared LLM http pool")
+    context_token_budget: Optional[int] = Field(None, description="Maximum number of tokens of the retrieved context in the prompts. Chunks are deduplicated, packed greedily by score and formatted without metadata. If not provided, all the chunks are formatted in full")
+    trace_path: Optional[str] = Field(None, description="Path of the trace store, recording the latency of each stage per query. `.jsonl` for JSON Lines, SQLite otherwise. If not provided, queries are not traced")
     
 class RAGPipelineConfig:
     global_: Optional[GlobalConfig] = Field(None, alias="global", description="Global configuration")
@@ -22,6 +26,25 @@ class IngestionConfig(BaseModel, RAGPipelineConfig):
     embeddings: str = Field("text-embedding-3-small", description="Embeddings name")
     namespace: str = Field("parent", description="Pinecone namespace")
     sub_namespace: str = Field("child", description="Pinecone sub-namespace")
+    vectorstore: Literal["pinecone", "local"] = Field("pinecone", description="Vectorstore backend. local: in-process vectorstore stored under `local_path`")
+    local_path: str = Field("vectorstore", description="Root directory of the local vectorstore")
+    local_index: Literal["flat", "hnsw"] = Field("flat", description="Index of the local vectorstore. hnsw requires hnswlib")
+    embeddings_cache_path: Optional[str] = Field(None, description="Path of the persistent embeddings cache (SQLite). If not provided, embeddings are not cached")
+    embeddings_cache_max_entries: int = Field(1_000_000, description="Maximum number of cached embeddings. Least recently used embeddings are evicted")
+    llm_rpm: Optional[int] = Field(None, description="Requests per minute of the LLM generating child chunks. If not provided, follows the rate limit headers")
+    llm_tpm: Optional[int] = Field(None, description="Tokens per minute of the LLM generating child chunks. If not provided, follows the rate limit headers")
+    embeddings_rpm: Optional[int] = Field(None, description="Requests per minute of the embeddings. Not limited if not provided")
+    embeddings_tpm: Optional[int] = Field(None, description="Tokens per minute of the embeddings. Not limited if not provided")
+    generation_concurrency: int = Field(16, description="Maximum number of concurrent LLM calls per child chunk generation")
+    generation_workers: int = Field(4, description="Number of parent batches whose child chunks are generated concurrently, apart from the parent upserts")
+    child_batch_size: int = Field(200, description="Number of child chunks in an upsert batch, regardless of the parent batch size")
+    embedding_batch_size: int = Field(1000, description="Number of chunks embedded at once by the pinecone bulk upsert")
+    upsert_batch_size: int = Field(100, description="Maximum number of vectors in a pinecone upsert request (up to 1000)")
+    upsert_payload_bytes: int = Field(2 * 1024 * 1024, description="Maximum estimated payload size of a pinecone upsert request (up to 2MB)")
+    upsert_pool_threads: int = Field(8, description="Number of concurrent pinecone upsert requests")
+    generation_cache_path: Optional[str] = Field(None, description="Path of the persistent cache (SQLite) of the generated summaries and hypothetical queries. If not provided, generations are not cached")
+    generation_cache_max_entries: int = Field(1_000_000, description="Maximum number of cached generations. Least recently used generations are evicted")
+    manifest_path: Optional[str] = Field("ingestion_manifest.sqlite", description="Path of the ingestion manifest (SQLite), recording content hashes and vector ids of the ingested pages. If not provided, ingestion is not tracked")
 
 class TransformationEnableConfig(BaseModel):
     translation: bool = True
@@ -36,10 +59,25 @@ class TransformationConfig(BaseModel, RAGPipelineConfig):
 class RetrievalConfig(BaseModel, RAGPipelineConfig):
     retriever: list[str] = Field(["pinecone-multivector"], description="Retriever name")
     weights: Optional[list[float]] = Field(None, description="Retriever weights. If provided, should be the same length as retrievers")
+    timeout: Optional[float | list[float]] = Field(None, description="Deadline of each retriever in seconds, or a list of deadlines with the same length as retrievers. Late or failed retrievers are excluded from the ensemble")
+    max_workers: Optional[int] = Field(None, description="Threads shared by the concurrent requests to the ensemble. A streaming request holds one thread per retriever until its queries are transformed. 4 per retriever if not provided")
     namespace: str = Field("parent", description="Pinecone namespace")
     sub_namespace: str = Field("child", description="Pinecone sub-namespace")
+    vectorstore: Literal["pinecone", "local"] = Field("pinecone", description="Vectorstore backend. local: in-process vectorstore stored under `local_path`")
+    local_path: str = Field("vectorstore", description="Root directory of the local vectorstore")
+    local_index: Literal["flat", "hnsw"] = Field("flat", description="Index of the local vectorstore. hnsw requires hnswlib")
     embeddings: Optional[str] = Field("text-embedding-3-small", description="Embeddings name. If retriever does not require embeddings, this field is optional")
     top_k: int = Field(6, description="Top k results")
+    hierarchy_mode: Literal["two-pass", "single-pass"] = Field("two-pass", description="Retrieval mode of the context hierarchy. single-pass: partition a single over-fetched retrieval into base and additional contexts")
+    hierarchy_over_fetch_factor: float = Field(3.0, description="Number of candidates to retrieve in single-pass mode, relative to top_k")
+    embeddings_cache_path: Optional[str] = Field(None, description="Path of the persistent embeddings cache (SQLite). If not provided, embeddings are not cached")
+    embeddings_cache_max_entries: int = Field(1_000_000, description="Maximum number of cached embeddings. Least recently used embeddings are evicted")
+    reranker: Optional[Literal["bm25", "cross-encoder"]] = Field(None, description="Reranker of the retrieved candidates. bm25: lexical score, cross-encoder: ONNX cross-encoder on CPU. If not provided, candidates are not reranked")
+    reranker_model_path: Optional[str] = Field(None, description="Directory of the ONNX cross-encoder, with `model.onnx` and `tokenizer.json`")
+    rerank_over_fetch_factor: float = Field(3.0, description="Number of candidates to rerank, relative to top_k")
+    rerank_batch_size: int = Field(32, description="Number of chunks scored at once by the reranker")
+    rerank_cache_path: Optional[str] = Field(None, description="Path of the persistent rerank score cache (SQLite). In memory if not provided")
+    rerank_cache_max_entries: int = Field(100_000, description="Maximum number of cached rerank scores. Least recently used scores are evicted")
 
 class GenerationConfig(BaseModel, RAGPipelineConfig):
     model: str = Field("gpt-4o", description="LLM model name")
@@ -47,6 +85,17 @@ class GenerationConfig(BaseModel, RAGPipelineConfig):
 class FactVerificationConfig(BaseModel, RAGPipelineConfig):
     model: str = Field("gpt-4o-mini", description="LLM model name")
     enable: bool = True
+    mode: Literal["full", "incremental"] = Field("full", description="full: verify the whole response after generation. incremental: verify segments of the response while streaming")
+    segment: Literal["paragraph", "sentence"] = Field("paragraph", description="Segment boundary of incremental verification")
+    segment_min_chars: int = Field(300, description="Minimum length of a segment in incremental verification")
+
+class CacheConfig(BaseModel, RAGPipelineConfig):
+    enable: bool = False
+    embeddings: str = Field("text-embedding-3-small", description="Embeddings name used to compare queries")
+    path: str = Field("cache/semantic_cache.sqlite", description="Path of the semantic cache (SQLite)")
+    similarity_threshold: float = Field(0.95, description="Minimum cosine similarity between queries to reuse the cached result")
+    ttl: Optional[float] = Field(86400, description="Time to live of the cached results in seconds. Never expires if not provided")
+    max_entries: int = Field(10000, description="Maximum number of cached results. Least recently used results are evicted")
 
 class RAGConfig(BaseModel):
     global_: GlobalConfig = Field(GlobalConfig(), alias="global")
@@ -56,3 +105,4 @@ class RAGConfig(BaseModel):
     retrieval: RetrievalConfig = RetrievalConfig()
     generation: GenerationConfig = GenerationConfig()
     fact_verification: FactVerificationConfig = FactVerificationConfig()
+    cache: CacheConfig = CacheConfig()
@@ -5,6 +5,7 @@ from rag.managers.generator import GeneratorManager
 from rag.managers.fact_verifier import FactVerifierManager
 from rag.managers.ingestor import IngestorManager
 from rag.managers.loader import LoaderManager
+from rag.managers.cache import CacheManager
 
 __all__ = [
     "BasePipelineManager",
@@ -14,4 +15,5 @@ __all__ = [
     "FactVerifierManager",
     "IngestorManager",
     "LoaderManager",
+    "CacheManager",
 ]
\ No newline at end of file
@@ -0,0 +1,131 @@
+from typing import Optional
+from functools import lru_cache
+from wasabi import msg
+import json
+
+from rag.managers.base import BasePipelineManager
+from rag.type import *
+from rag.component import embeddings
+from rag.component.cache import SemanticCache
+from rag import util
+from rag.config import CacheConfig
+
+class CacheManager(BasePipelineManager):
+    """Semantic cache of the generation results.
+    A query hits the cache if a previous query with the same categories and pipeline config is similar enough.
+    Queries with chat history are not cached, since the answer depends on the conversation.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.enable = False
+        self.cache: Optional[SemanticCache] = None
+        self.fingerprint = ""
+        self._embed_query = None
+    
+    def set_config(self, config: CacheConfig) -> None:
+        self.enable = config.enable
+        self.similarity_threshold = config.similarity_threshold
+        self.ttl = config.ttl
+        
+        if not self.enable:
+            msg.info("Semantic cache disabled")
+            return
+        
+        embeddings_model = embeddings.get_model(config.embeddings)
+        if embeddings_model is None:
+            msg.warn(f"Embeddings {config.embeddings} not found. Disabling semantic cache.")
+            self.enable = False
+            return
+        
+        self._embed_query = lru_cache(maxsize=256)(embeddings_model.embed_query)
+        self.cache = SemanticCache(config.path, max_entries=config.max_entries)
+        msg.info(f"Setting SEMANTIC CACHE to {config.path} (threshold: {self.similarity_threshold})")
+    
+    def set_fingerprint(self, fingerprint: str) -> None:
+        """Set the fingerprint of the pipeline config. Results of different configs never hit each other."""
+        self.fingerprint = fingerprint
+    
+    def _is_active(self, history: Optional[list[ChatLog]]) -> bool:
+        return self.enable and self.cache is not None and not history
+    
+    def _partition(self, categories: Optional[list[str]]) -> str:
+        return util.generate_id(json.dumps({
+            "categories": sorted(categories or []),
+            "fingerprint": self.fingerprint,
+        }))
+    
+    def lookup(
+        self, 
+        query: str, 
+        history: Optional[list[ChatLog]] = None, 
+        categories: Optional[list[str]] = None
+    ) -> Optional[GenerationResult]:
+        if not self._is_active(history):
+            return None
+        
+        try:
+            found = self.cache.lookup(
+                self._partition(categories), 
+                self._embed_query(query), 
+                self.similarity_threshold, 
+                ttl=self.ttl,
+            )
+        except Exception as e:
+            msg.warn(f"Semantic cache lookup failed: {e}")
+            return None
+        
+        if found is None:
+            return None
+        
+        result, similarity = found
+        msg.good(f"Semantic cache hit (similarity: {similarity:.3f})")
+        return self._deserialize(result)
+    
+    def store(
+        self, 
+        query: str, 
+        result: GenerationResult,
+        history: Optional[list[ChatLog]] = None, 
+        categories: Optional[list[str]] = None,
+    ) -> None:
+        if not self._is_active(history) or not result.get("generation"):
+            return
+        
+        try:
+            if self.ttl is not None:
+                self.cache.purge_expired(self.ttl)
+            self.cache.put(
+                self._partition(categories), 
+                query, 
+                self._embed_query(query), 
+                self._serialize(result),
+            )
+        except Exception as e:
+            msg.warn(f"Semantic cache store failed: {e}")
+    
+    def invalidate(self) -> None:
+        """Drop all the cached results, e.g. when new documents are ingested"""
+        if self.cache is None:
+            return
+        self.cache.clear()
+        msg.info("Semantic cache invalidated")
+    
+    @staticmethod
+    def _serialize(result: GenerationResult) -> str:
+        verification = result.get("fact_verification")
+        return json.dumps({
+            "transformation": result.get("transformation"),
+            "retrieval": [chunk.model_dump() for chunk in result.get("retrieval", [])],
+            "generation": result.get("generation"),
+            "fact_verification": verification.model_dump() if verification is not None else None,
+        })
+    
+    @staticmethod
+    def _deserialize(result: str) -> GenerationResult:
+        _dict = json.loads(result)
+        return util.remove_falsy({
+            "transformation": _dict.get("transformation"),
+            "retrieval": [Chunk(**chunk) for chunk in _dict.get("retrieval") or []],
+            "generation": _dict.get("generation"),
+            "fact_verification": VerificationResult(**_dict["fact_verification"]) if _dict.get("fact_verification") else None,
+        })
@@ -1,23 +1,109 @@
 from typing import Optional, Generator
+from concurrent.futures import ThreadPoolExecutor, Future
 from wasabi import msg
+import re
 
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain_core.runnables import Runnable
 
 from rag.managers.base import BasePipelineManager
 from rag.type import VerificationResult
 from rag import util
-from rag.component import llm, prompt
+from rag.component import llm, prompt, tracing
 from rag.config import FactVerificationConfig
 
+class IncrementalVerification:
+    """Verifies a streaming response segment by segment, concurrently with the generation.
+    Feed the generated tokens with `feed`, and call `finalize` after the generation is done.
+    
+    Args:
+        chain (Runnable): verification chain
+        context (str): formatted context of the retrieved chunks
+        executor (ThreadPoolExecutor): executor to run the verification requests
+        segment (str): segment boundary. "paragraph" or "sentence"
+        min_chars (int): minimum length of a segment. Shorter segments are merged into the next one
+    """
+    BOUNDARIES = {
+        "paragraph": re.compile(r"\n\s*\n"),
+        "sentence": re.compile(r"(?<=[.!?])\s+|\n+"),
+    }
+    
+    def __init__(
+        self, 
+        chain: Runnable, 
+        context: str, 
+        executor: ThreadPoolExecutor,
+        segment: str = "paragraph",
+        min_chars: int = 300,
+    ) -> None:
+        self.chain = chain
+        self.context = context
+        self.executor = executor
+        self.boundary = self.BOUNDARIES[segment]
+        self.min_chars = min_chars
+        
+        self.buffer = ""
+        self.segments: list[tuple[str, Future]] = []
+    
+    def feed(self, text: str) -> None:
+        self.buffer += text
+        while len(self.buffer) > self.min_chars:
+            match = self.boundary.search(self.buffer, self.min_chars)
+            if match is None:
+                break
+            segment, self.buffer = self.buffer[:match.end()], self.buffer[match.end():]
+            self._submit(segment)
+    
+    def _submit(self, segment: str) -> None:
+        if not segment.strip():
+            return
+        verify_segment = tracing.bind(tracing.traced("verification.segment", self.chain.invoke, chars=len(segment)))
+        future = self.executor.submit(verify_segment, {"response": segment, "context": self.context})
+        self.segments.append((segment, future))
+    
+    def finalize(self) -> Optional[VerificationResult]:
+        """Verify the remaining segment, and merge all the partial verdicts"""
+        self._submit(self.buffer)
+        self.buffer = ""
+        
+        if not self.segments:
+            return None
+        
+        verdicts: list[tuple[str, VerificationResult]] = []
+        for segment, future in self.segments:
+            try:
+                verdicts.append((segment, VerificationResult(**future.result())))
+            except Exception as e:
+                msg.warn(f"Failed to verify segment: {e}")
+        
+        if not verdicts:
+            return None
+        
+        verification = all(verdict.verification for _, verdict in verdicts)
+        # on failure, only report the reasoning of the failed segments
+        reported = [(segment, verdict) for segment, verdict in verdicts if verification or not verdict.verification]
+        reasoning = "\n\n".join(
+            verdict.reasoning if len(reported) == 1 else f"> {segment.strip()[:80]}...\n{verdict.reasoning}"
+            for segment, verdict in reported
+        )
+        return VerificationResult(verification=verification, reasoning=reasoning)
+
 class FactVerifierManager(BasePipelineManager):
+    MAX_CONCURRENCY = 4
+    
     def __init__(self) -> None:
         super().__init__()
         self.verifier_name = None
         self.enable = False
+        self.mode = "full"
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENCY)
         
     def set_config(self, config: FactVerificationConfig):
         self.verifier_name = config.model
         self.enable = config.enable
+        self.mode = config.mode
+        self.segment = config.segment
+        self.segment_min_chars = config.segment_min_chars
         self.user_lang = config.global_.lang.user
         self.prompt = prompt.verification_prompt.partial(lang=self.user_lang)
         
@@ -43,6 +129,36 @@ class FactVerifierManager(BasePipelineManager):
     #         yield r
         
     def verify(self, response: str, context: str) -> Optional[VerificationResult]:
+        chain = self._get_chain()
+        if chain is None:
+            return None
+        return VerificationResult(**chain.invoke({"response": response, "context": context}))
+    
+    def verify_incremental(self, context: str) -> Optional[IncrementalVerification]:
+        """Start an incremental verification of a streaming response.
+        Returns None if the verifier is not available, or not in incremental mode.
+        """
+        if self.mode != "incremental":
+            return None
+        
+        chain = self._get_chain()
+        if chain is None:
+            return None
+        return IncrementalVerification(
+            chain, 
+            context, 
+            self._executor, 
+            segment=self.segment, 
+            min_chars=self.segment_min_chars,
+        )
+    
+    async def averify(self, response: str, context: str) -> Optional[VerificationResult]:
+        chain = self._get_chain()
+        if chain is None:
+            return None
+        return VerificationResult(**await chain.ainvoke({"response": response, "context": context}))
+    
+    def _get_chain(self) -> Optional[Runnable]:
         if not self.enable:
             msg.warn("Fact verifier not enabled. Skipping verification.")
             return None
@@ -56,5 +172,4 @@ class FactVerifierManager(BasePipelineManager):
             msg.warn(f"Verifier {self.verifier_name} not found. Skipping verification.")
             return None
                 
-        chain = self.prompt | verifier | JsonOutputParser(pydantic_object=VerificationResult)
-        return VerificationResult(**chain.invoke({"response": response, "context": context}))
+        return self.prompt | verifier | JsonOutputParser(pydantic_object=VerificationResult)
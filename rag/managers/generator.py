@@ -1,5 +1,5 @@
 from wasabi import msg
-from typing import Generator, Optional
+from typing import Generator, AsyncGenerator, Optional
 
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import Runnable
@@ -49,6 +49,25 @@ class GeneratorManager(BasePipelineManager):
         
         return chain.invoke({"query": query, "context": context, "history": history})
     
+    async def agenerate_stream(
+        self, query: str, history: str="", context: str=""
+    ) -> AsyncGenerator[str, None]:
+        chain = self._get_chain()
+        if chain is None:
+            return
+        
+        async for chunk in chain.astream({"query": query, "context": context, "history": history}):
+            yield chunk
+    
+    async def agenerate(
+        self, query: str, history: str="", context: str=""
+    ) -> str:
+        chain = self._get_chain()
+        if chain is None:
+            return ""
+        
+        return await chain.ainvoke({"query": query, "context": context, "history": history})
+    
     def _get_chain(self) -> Optional[Runnable]:
         if self.generator_name is None:
             msg.warn("Generator not set. Skipping generation.")
@@ -1,5 +1,5 @@
 from wasabi import msg
-from typing import Optional, Type, Iterable
+from typing import Optional, Type, Iterable, Callable
 
 from langchain_core.embeddings import Embeddings
 
@@ -45,3 +45,41 @@ class IngestorManager(BasePipelineManager):
             msg.warn("No ingestor initialized. Skipping ingestion.")
             return False
         return ingestor.ingest(chunks)
+    
+    def finalize(self, prune_missing: bool = False) -> int:
+        ingestor = self.selected_ingestors
+        if ingestor is None:
+            return 0
+        return ingestor.finalize(prune_missing=prune_missing)
+    
+    def ingest_pipelined(
+        self, 
+        sources: Iterable[Callable[[], Iterable[Chunk]]],
+        batch_size: int = 20,
+        prune_missing: bool = False,
+        **pipeline_kwargs,
+    ) -> int:
+        """Ingest multiple documents concurrently through a staged pipeline. See `IngestionPipeline`
+
+        Args:
+            sources (Iterable[Callable[[], Iterable[Chunk]]]): one callable per document, returning its chunks
+            batch_size (int): number of chunks in a batch
+            prune_missing (bool): delete the documents not included in the sources. Set only if the sources cover the entire corpus
+            pipeline_kwargs: worker counts and queue size of the pipeline
+
+        Returns:
+            int: number of ingested chunks
+        """
+        ingestor = self.selected_ingestors
+        if ingestor is None:
+            msg.warn("No ingestor initialized. Skipping ingestion.")
+            return 0
+        
+        pipeline = IngestionPipeline(ingestor, batch_size=batch_size, **pipeline_kwargs)
+        ingested_cnt = pipeline.run(sources)
+        if pipeline.failed_batches:
+            # pages of the failed batches may be mistaken for removed ones
+            msg.warn("Skipping the removal of stale pages, since some batches failed")
+        else:
+            ingestor.finalize(prune_missing=prune_missing)
+        return ingested_cnt
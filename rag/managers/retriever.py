@@ -1,10 +1,11 @@
-from typing import Optional, Type, Callable
+from typing import Optional, Type, Callable, Iterable, AsyncIterable
 from wasabi import msg
 
 from rag.managers.base import BasePipelineManager
 from rag.type import *
 from rag.component.retriever import *
-from rag.component import embeddings
+from rag.component.reranker import BaseRAGReranker, get_reranker
+from rag.component import embeddings, tracing
 from rag import util
 from rag.config import RetrievalConfig
 
@@ -29,6 +30,7 @@ class RetrieverManager(BasePipelineManager):
         self.selected_retriever_names: list[str] = []
         self.use_context_hierarchy: bool = False
         self.weights: list[float] = []
+        self.reranker: Optional[BaseRAGReranker] = None
                 
         self.selected_retriever: Optional[BaseRAGRetriever] = None
 
@@ -37,7 +39,11 @@ class RetrieverManager(BasePipelineManager):
         self.embeddings_name = config.embeddings
         
         if self.embeddings_name is not None:
-            self.embeddings = embeddings.get_model(self.embeddings_name)
+            self.embeddings = embeddings.get_model(
+                self.embeddings_name,
+                cache_path=config.embeddings_cache_path,
+                cache_max_entries=config.embeddings_cache_max_entries,
+            )
             msg.info(f"Setting EMBEDDINGS to {self.embeddings_name}")
         else:
             self.embeddings = None
@@ -52,6 +58,7 @@ class RetrieverManager(BasePipelineManager):
         
         self.weights = config.weights
         self.use_context_hierarchy = config.global_.context_hierarchy
+        self.reranker = self.init_reranker(config)
         
         self.init_retriever(config)
     
@@ -75,17 +82,52 @@ class RetrieverManager(BasePipelineManager):
                     ],
                     weights=self.weights,
                     top_k=self.top_k,
+                    timeout=config.timeout,
+                    max_workers=config.max_workers,
                 )
         return retriever_initiator
 
     
+    def init_reranker(self, config: RetrievalConfig) -> Optional[BaseRAGReranker]:
+        if config.reranker is None:
+            return None
+        try:
+            reranker = get_reranker(
+                config.reranker,
+                model_path=config.reranker_model_path,
+                batch_size=config.rerank_batch_size,
+                cache_path=config.rerank_cache_path,
+                cache_max_entries=config.rerank_cache_max_entries,
+            )
+        except (ImportError, ValueError, OSError) as e:
+            msg.warn(f"Error initializing reranker {config.reranker}: {e}. Disabling reranking.")
+            return None
+        msg.info(f"Setting RERANKER to {config.reranker} (over-fetch factor: {config.rerank_over_fetch_factor})")
+        return reranker
+    
+    def _rerank_lambda(self, ensemble_lambda: Callable[[RetrievalConfig], BaseRAGRetriever]) -> Callable[[RetrievalConfig], BaseRAGRetriever]:
+        if self.reranker is None:
+            return ensemble_lambda
+        def retriever_initiator(config: RetrievalConfig):
+            return RerankingRetriever.from_retriever(
+                ensemble_lambda(config),
+                self.reranker,
+                over_fetch_factor=config.rerank_over_fetch_factor,
+            )
+        return retriever_initiator
+    
     def init_retriever(self, config: RetrievalConfig) -> BaseRAGRetriever:
         try:
-            ensemble_lambda = self._ensemble_lambda()
+            # each pass of the hierarchical retriever is reranked
+            ensemble_lambda = self._rerank_lambda(self._ensemble_lambda())
             
             msg.info(f"Use Hierarchical Retriever: {self.use_context_hierarchy}")
             if self.use_context_hierarchy:
-                retriever = HierarchicalRetriever.from_retriever(ensemble_lambda(config))
+                retriever = HierarchicalRetriever.from_retriever(
+                    ensemble_lambda(config),
+                    mode=config.hierarchy_mode,
+                    over_fetch_factor=config.hierarchy_over_fetch_factor,
+                )
             else:
                 retriever = ensemble_lambda(config)
         except KeyError as e:
@@ -115,6 +157,67 @@ class RetrieverManager(BasePipelineManager):
             return []
 
         formulated_filter = FilterUtil.from_dict(filter)
-        retrieved_chunks = retriever.retrieve(queries, filter=formulated_filter)
+        with tracing.span("retrieve") as span:
+            retrieved_chunks = retriever.retrieve(queries, filter=formulated_filter)
+            span.set(chunks=len(retrieved_chunks))
+        return retrieved_chunks
+
+
+    def retrieve_stream(self, query_batches: Iterable[list[str]], filter: dict | None=None) -> list[Chunk]:
+        """Retrieve chunks from selected retriever, dispatching queries as soon as they arrive
+
+        Args:
+            query_batches (Iterable[list[str]]): batches of queries, in the order of arrival
+            filter (dict, optional): Same as `retrieve`. Defaults to None.
+
+        Returns:
+            list[Chunk]: list of retrieved chunks
+        """
+        retriever = self.selected_retriever
+        if retriever is None:
+            for _ in query_batches:
+                pass
+            return []
+
+        formulated_filter = FilterUtil.from_dict(filter)
+        with tracing.span("retrieve") as span:
+            retrieved_chunks = retriever.retrieve_stream(query_batches, filter=formulated_filter)
+            span.set(chunks=len(retrieved_chunks))
         return retrieved_chunks
+    
+    async def aretrieve(self, queries: TransformationResult, filter: dict | None=None) -> list[Chunk]:
+        """Async version of `retrieve`"""
+        retriever = self.selected_retriever
+        if retriever is None:
+            return []
 
+        formulated_filter = FilterUtil.from_dict(filter)
+        with tracing.span("retrieve") as span:
+            retrieved_chunks = await retriever.aretrieve(queries, filter=formulated_filter)
+            span.set(chunks=len(retrieved_chunks))
+        return retrieved_chunks
+    
+    async def aretrieve_stream(self, query_batches: AsyncIterable[list[str]], filter: dict | None=None) -> list[Chunk]:
+        """Async version of `retrieve_stream`"""
+        retriever = self.selected_retriever
+        if retriever is None:
+            async for _ in query_batches:
+                pass
+            return []
+
+        formulated_filter = FilterUtil.from_dict(filter)
+        with tracing.span("retrieve") as span:
+            retrieved_chunks = await retriever.aretrieve_stream(query_batches, filter=formulated_filter)
+            span.set(chunks=len(retrieved_chunks))
+        return retrieved_chunks
+    
+    def latency_stats(self) -> dict[str, dict[str, float]]:
+        """Latency statistics of the sub-retrievers, if the ensemble retriever is used"""
+        retriever = self.selected_retriever
+        if isinstance(retriever, HierarchicalRetriever):
+            retriever = retriever.retriever
+        if isinstance(retriever, RerankingRetriever):
+            retriever = retriever.retriever
+        if isinstance(retriever, EnsembleRetriever):
+            return retriever.latency_stats()
+        return {}
@@ -1,10 +1,12 @@
-from typing import Optional
+from typing import Optional, Generator, AsyncGenerator, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 from wasabi import msg
 
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import Runnable, RunnablePassthrough, RunnableParallel, RunnableLambda
 
-from rag.component import llm, prompt
+from rag.component import llm, prompt, tracing
 from rag.managers.base import BasePipelineManager
 from rag.type import *
 from rag.config import TransformationConfig
@@ -32,7 +34,17 @@ class TransformerManager(BasePipelineManager):
             return sentence
         
         chain = prompt.translation_prompt.partial(user_lang=self.user_lang, source_lang=self.source_lang) | transformer | StrOutputParser()
-        return chain.invoke({"sentence": sentence})
+        with tracing.span("transform.translation"):
+            return chain.invoke({"sentence": sentence})
+    
+    async def atranslate(self, sentence: str) -> str:
+        transformer = llm.get_model(self.transformer_name)
+        if transformer is None:
+            return sentence
+        
+        chain = prompt.translation_prompt.partial(user_lang=self.user_lang, source_lang=self.source_lang) | transformer | StrOutputParser()
+        with tracing.span("transform.translation"):
+            return await chain.ainvoke({"sentence": sentence})
     
     def transform(self, sentence: str, history: list[ChatLog]=None) -> TransformationResult:
         if self.transformer_name is None:
@@ -42,18 +54,102 @@ class TransformerManager(BasePipelineManager):
         history = history or []
         sentences: TransformationResult = {}
         
-        chains = {}
+        sentence, query_lang = self._translate_if_needed(sentence)
+        sentences["translation"] = sentence
+        
+        chains = self._build_chains(query_lang)
+        
+        parallel_chain = RunnableParallel(**chains)
+        transformed_sentences = parallel_chain.invoke({"query": sentence, "history": history})
+        for key, _sentence in transformed_sentences.items():
+            sentences[key] = _sentence
+
+        return sentences
+    
+    def transform_stream(
+        self, sentence: str, history: list[ChatLog]=None
+    ) -> Generator[tuple[str, Union[str, list[str]]], None, None]:
+        """Yield each transformed query as soon as it is ready.
+        Translation is yielded first, since the other transformations are based on it.
+
+        Args:
+            sentence (str): user query
+            history (list[ChatLog], optional): chat history. Defaults to None.
+
+        Yields:
+            tuple[str, Union[str, list[str]]]: key of TransformationResult and its transformed query
+        """
+        if self.transformer_name is None:
+            msg.warn("Transformer not set. Skipping transformation.")
+            yield "translation", sentence
+            return
+        
+        history = history or []
+        
+        sentence, query_lang = self._translate_if_needed(sentence)
+        yield "translation", sentence
+        
+        chains = self._build_chains(query_lang)
+        if not chains:
+            return
+        
+        with ThreadPoolExecutor(max_workers=len(chains)) as executor:
+            futures = {
+                executor.submit(tracing.bind(tracing.traced(f"transform.{key}", chain.invoke)), {"query": sentence, "history": history}): key
+                for key, chain in chains.items()
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    
+    async def atransform(self, sentence: str, history: list[ChatLog]=None) -> TransformationResult:
+        sentences: TransformationResult = {}
+        async for key, _sentence in self.atransform_stream(sentence, history):
+            sentences[key] = _sentence
+        return sentences
+    
+    async def atransform_stream(
+        self, sentence: str, history: list[ChatLog]=None
+    ) -> AsyncGenerator[tuple[str, Union[str, list[str]]], None]:
+        """Async version of `transform_stream`"""
+        if self.transformer_name is None:
+            msg.warn("Transformer not set. Skipping transformation.")
+            yield "translation", sentence
+            return
+        
+        history = history or []
         
-        # if translation is disabled even though the user language is different from the source language,
-        # the entire queries will be in the user language
         if self.user_lang != self.source_lang and self.enable.translation:
-            sentence = self.translate(sentence)
-            sentences["translation"] = sentence
-            query_lang = self.source_lang
+            sentence, query_lang = await self.atranslate(sentence), self.source_lang
         else:
-            sentences["translation"] = sentence
             query_lang = self.user_lang
+        yield "translation", sentence
         
+        chains = self._build_chains(query_lang)
+        tasks = {
+            asyncio.ensure_future(self._atraced(f"transform.{key}", chain.ainvoke({"query": sentence, "history": history}))): key
+            for key, chain in chains.items()
+        }
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield tasks[task], task.result()
+    
+    @staticmethod
+    async def _atraced(name: str, coro):
+        with tracing.span(name):
+            return await coro
+    
+    def _translate_if_needed(self, sentence: str) -> tuple[str, str]:
+        # if translation is disabled even though the user language is different from the source language,
+        # the entire queries will be in the user language
+        if self.user_lang != self.source_lang and self.enable.translation:
+            return self.translate(sentence), self.source_lang
+        else:
+            return sentence, self.user_lang
+    
+    def _build_chains(self, query_lang: str) -> dict[str, Runnable]:
+        chains = {}
         for key in ["rewriting", "expansion", "hyde"]:
             if not getattr(self.enable, key):
                 continue
@@ -64,13 +160,7 @@ class TransformerManager(BasePipelineManager):
                 if key == "expansion":
                     chain = chain | RunnableLambda(split_lambda)
                 chains[key] = chain
-        
-        parallel_chain = RunnableParallel(**chains)
-        transformed_sentences = parallel_chain.invoke({"query": sentence, "history": history})
-        for key, _sentence in transformed_sentences.items():
-            sentences[key] = _sentence
-
-        return sentences
+        return chains
 
     def build_chain(self, key: str, *, lang: str = "English", **model_kwargs) -> Optional[Runnable]:
         prompts = {
@@ -1,5 +1,6 @@
-from typing import Generator, Iterable, Optional, Callable, Any, TypedDict
+from typing import Generator, AsyncGenerator, Iterable, Optional, Callable, Any, TypedDict
 from wasabi import msg
+import asyncio
 import time
 import os
 
@@ -13,13 +14,16 @@ from rag.managers import (
     FactVerifierManager,
     IngestorManager,
     LoaderManager,
+    CacheManager,
 )
+from rag.managers.fact_verifier import IncrementalVerification
 from rag.type import *
 from rag import util
-from rag.component import chunker, loader
+from rag.component import chunker, loader, llm, tracing
+from rag.component.llm.ratelimit import estimate_tokens
 from rag.util import time_logger
 from rag.config import *
-from rag.component.loader import BaseRAGLoader, BaseLoader
+from rag.component.loader import BaseRAGLoader, BaseLoader, PDFWithMetadataLoader
         
 class Managers(TypedDict):
     load: LoaderManager
@@ -28,6 +32,7 @@ class Managers(TypedDict):
     retrieval: RetrieverManager
     generation: GeneratorManager
     fact_verification: FactVerifierManager
+    cache: CacheManager
     
     def __getitem__(self, key: str) -> BasePipelineManager:
         return self.get(key)
@@ -41,6 +46,7 @@ class RAGManager:
             "retrieval": RetrieverManager(),
             "generation": GeneratorManager(),
             "fact_verification": FactVerifierManager(),
+            "cache": CacheManager(),
         }
         
         self.config: Optional[RAGConfig] = None
@@ -49,17 +55,43 @@ class RAGManager:
         print(config)
         self.config = config
         self.global_config = config.global_
+        llm.configure_http_pool(
+            max_connections=self.global_config.http_max_connections,
+            max_keepalive_connections=self.global_config.http_max_keepalive_connections,
+        )
+        tracing.configure(self.global_config.trace_path)
         
         for manager_key, manager in self.managers.items():
             manager.set_config(util.attach_global_config(getattr(self.config, manager_key), self.global_config))
+        self.managers["cache"].set_fingerprint(
+            util.generate_id(self.config.model_dump_json(by_alias=True, exclude={"cache"}))
+        )
         msg.good("RAGManager successfully configured")
+    
+    def lookup_cache(
+        self, 
+        query: str, 
+        history: Optional[list[ChatLog]] = None, 
+        categories: Optional[list[str]] = None
+    ) -> Optional[GenerationResult]:
+        return self.managers["cache"].lookup(query, history, categories)
+    
+    def update_cache(
+        self, 
+        query: str, 
+        result: GenerationResult,
+        history: Optional[list[ChatLog]] = None, 
+        categories: Optional[list[str]] = None,
+    ) -> None:
+        self.managers["cache"].store(query, result, history, categories)
         
     def transform_query(self, query: str, history: list[ChatLog]) -> TransformationResult:
         with time_logger(
             lambda: f"Transforming query: {query} with {len(history)} history...",
             lambda: f"Query transformed into {len(queries)} queries"
         ):
-            queries = self.managers["transformation"].transform(query, history)
+            with tracing.span("transform"):
+                queries = self.managers["transformation"].transform(query, history)
             msg.info(f"Transformed queries: {queries}")
             return queries
 
@@ -70,9 +102,69 @@ class RAGManager:
         ):
             chunks = self.managers["retrieval"].retrieve(
                 queries,
-                filter = {"in": {"key": "category", "value": categories}} if categories else None
+                filter = self._category_filter(categories)
             )
             return chunks
+    
+    def transform_and_retrieve(
+        self, 
+        query: str, 
+        history: list[ChatLog], 
+        categories: list[str]=None
+    ) -> tuple[TransformationResult, list[Chunk]]:
+        """Transform the query and retrieve chunks in a single pipeline.
+        Each transformed query is dispatched to the retriever as soon as it is generated,
+        so retrieval overlaps with the remaining transformations.
+        """
+        queries: TransformationResult = {}
+        
+        def _query_batches():
+            for key, transformed in self.managers["transformation"].transform_stream(query, history):
+                queries[key] = transformed
+                yield transformed if isinstance(transformed, list) else [transformed]
+        
+        with time_logger(
+            lambda: f"Transforming and retrieving with: {query} with {len(history)} history...",
+            lambda: f"{len(chunks)} chunks retrieved with {len(queries)} transformed queries"
+        ):
+            with tracing.span("transform_and_retrieve") as span:
+                chunks = self.managers["retrieval"].retrieve_stream(
+                    _query_batches(),
+                    filter = self._category_filter(categories)
+                )
+                span.set(queries=len(util.flatten_queries(queries)), chunks=len(chunks))
+            msg.info(f"Transformed queries: {queries}")
+            return queries, chunks
+    
+    async def atransform_and_retrieve(
+        self, 
+        query: str, 
+        history: list[ChatLog], 
+        categories: list[str]=None
+    ) -> tuple[TransformationResult, list[Chunk]]:
+        """Async version of `transform_and_retrieve`"""
+        queries: TransformationResult = {}
+        
+        async def _query_batches():
+            async for key, transformed in self.managers["transformation"].atransform_stream(query, history):
+                queries[key] = transformed
+                yield transformed if isinstance(transformed, list) else [transformed]
+        
+        with time_logger(
+            lambda: f"Transforming and retrieving with: {query} with {len(history)} history...",
+            lambda: f"{len(chunks)} chunks retrieved with {len(queries)} transformed queries"
+        ):
+            with tracing.span("transform_and_retrieve") as span:
+                chunks = await self.managers["retrieval"].aretrieve_stream(
+                    _query_batches(),
+                    filter = self._category_filter(categories)
+                )
+                span.set(queries=len(util.flatten_queries(queries)), chunks=len(chunks))
+            msg.info(f"Transformed queries: {queries}")
+            return queries, chunks
+    
+    def _category_filter(self, categories: Optional[list[str]]) -> Optional[dict]:
+        return {"in": {"key": "category", "value": categories}} if categories else None
 
     def generate(
         self, 
@@ -87,10 +179,12 @@ class RAGManager:
             lambda: f"Querying with: `{query}` and {len(history)} history...",
             lambda: f"Query completed"
         ):
-            context = util.format_chunks(chunks, self.global_config.context_hierarchy)
+            context = util.format_chunks(chunks, self.global_config.context_hierarchy, self.global_config.context_token_budget)
             history_str = util.format_history(history)
             
-            generation_response = self.managers["generation"].generate(query, history_str, context)
+            with tracing.span("generation", context_chars=len(context)) as span:
+                generation_response = self.managers["generation"].generate(query, history_str, context)
+                self._record_generation(span, generation_response)
             return generation_response
     
     def generate_stream(
@@ -106,21 +200,88 @@ class RAGManager:
             lambda: f"Querying with: `{query}` and {len(history)} history...",
             lambda: f"Query completed"
         ):
-            context = util.format_chunks(chunks, self.global_config.context_hierarchy)
+            context = util.format_chunks(chunks, self.global_config.context_hierarchy, self.global_config.context_token_budget)
             history_str = util.format_history(history)
             
-            yield from self.managers["generation"].generate_stream(query, history_str, context)
+            with tracing.span("generation", context_chars=len(context)) as span:
+                generation_response, ttft = "", None
+                for response in self.managers["generation"].generate_stream(query, history_str, context):
+                    ttft = ttft if ttft is not None else span.elapsed()
+                    generation_response += response
+                    yield response
+                self._record_generation(span, generation_response, ttft)
+    
+    async def agenerate_stream(
+        self, 
+        query: str, 
+        history: Optional[list[ChatLog]] = None, 
+        chunks: Optional[list[Chunk]] = None
+    ) -> AsyncGenerator[str, None]:
+        chunks = chunks or []
+        history = history or []
+        
+        with time_logger(
+            lambda: f"Querying with: `{query}` and {len(history)} history...",
+            lambda: f"Query completed"
+        ):
+            context = util.format_chunks(chunks, self.global_config.context_hierarchy, self.global_config.context_token_budget)
+            history_str = util.format_history(history)
+            
+            with tracing.span("generation", context_chars=len(context)) as span:
+                generation_response, ttft = "", None
+                async for response in self.managers["generation"].agenerate_stream(query, history_str, context):
+                    ttft = ttft if ttft is not None else span.elapsed()
+                    generation_response += response
+                    yield response
+                self._record_generation(span, generation_response, ttft)
+    
+    @staticmethod
+    def _record_generation(span: tracing.Span, response: str, ttft: Optional[float] = None) -> None:
+        """Attach the time to first token and the throughput of the generation to the span"""
+        tokens = estimate_tokens(response)
+        # throughput of the decoding, apart from the time to first token
+        decoding_time = span.elapsed() - (ttft or 0)
+        span.set(
+            output_tokens=tokens,
+            ttft=ttft,
+            tokens_per_s=tokens / decoding_time if decoding_time > 0 else None,
+        )
     
     def verify_fact(self, response: str, chunks: list[Chunk]) -> Optional[VerificationResult]:
         with time_logger(
             lambda: f"Verifying fact...",
             lambda: f"Fact verification completed"
         ):
-            context = util.format_chunks(chunks or [], self.global_config.context_hierarchy)
-            verification_response = self.managers["fact_verification"].verify(response, context)
+            context = util.format_chunks(chunks or [], self.global_config.context_hierarchy, self.global_config.context_token_budget)
+            with tracing.span("verification"):
+                verification_response = self.managers["fact_verification"].verify(response, context)
             return verification_response
 
     
+    async def averify_fact(self, response: str, chunks: list[Chunk]) -> Optional[VerificationResult]:
+        with time_logger(
+            lambda: f"Verifying fact...",
+            lambda: f"Fact verification completed"
+        ):
+            context = util.format_chunks(chunks or [], self.global_config.context_hierarchy, self.global_config.context_token_budget)
+            with tracing.span("verification"):
+                return await self.managers["fact_verification"].averify(response, context)
+    
+    def start_fact_verification(self, chunks: list[Chunk]) -> Optional[IncrementalVerification]:
+        """Start verifying the response while it is being generated.
+        Returns None if the fact verification is not in incremental mode. Use `verify_fact` instead.
+        """
+        context = util.format_chunks(chunks or [], self.global_config.context_hierarchy, self.global_config.context_token_budget)
+        return self.managers["fact_verification"].verify_incremental(context)
+    
+    def finish_fact_verification(self, verification: IncrementalVerification) -> Optional[VerificationResult]:
+        with time_logger(
+            lambda: f"Waiting for the remaining fact verification...",
+            lambda: f"Fact verification completed"
+        ):
+            with tracing.span("verification", mode="incremental"):
+                return verification.finalize()
+    
     # def verify_fact_stream(self, response: str, chunks: list[Chunk]) -> Generator[str, None, None]:
     #     with time_logger(
     #         lambda: f"Verifying fact...",
@@ -139,6 +300,7 @@ class RAGManager:
                 batch_size=batch_size,
                 func=self.managers["ingestion"].ingest
             )
+            self.managers["ingestion"].finalize()
             return chunks_cnt
     
     # TODO route loader. For now, specific loader should be passed
@@ -149,11 +311,51 @@ class RAGManager:
         batch_size: int = 20
     ) -> int:
         chunks_iter = self.managers["load"].lazy_load_chunk(loader=loader)
-        return self._ingest_with_loader(chunks_iter, batch_size=batch_size)
+        chunks_cnt = self._ingest_with_loader(chunks_iter, batch_size=batch_size)
+        if chunks_cnt:
+            # cached answers may be outdated by the new documents
+            self.managers["cache"].invalidate()
+        return chunks_cnt
     
-    def aingest(self, data_url: str, batch_size: int = 20) -> int:
-        # TODO
-        return -1
+    def ingest_pipelined(
+        self,
+        loader_inits: Iterable[Callable[[], Union[BaseRAGLoader, BaseLoader]]],
+        batch_size: int = 20,
+        prune_missing: bool = False,
+        **pipeline_kwargs,
+    ) -> int:
+        """Ingest multiple documents concurrently. 
+        Loading, chunk generation and upsert of different documents overlap. See `IngestionPipeline`
+
+        Args:
+            loader_inits (Iterable[Callable[[], Union[BaseRAGLoader, BaseLoader]]]): one loader initializer per document
+            batch_size (int): number of chunks in a batch
+            prune_missing (bool): delete the documents not included in `loader_inits`. Set only if they cover the entire corpus
+            pipeline_kwargs: worker counts and queue size of the pipeline
+        """
+        def _source(loader_init):
+            return lambda: self.managers["load"].lazy_load_chunk(loader=loader_init())
+        
+        with time_logger(
+            lambda: f"Ingesting data through the pipeline...",
+            lambda: f"Data ingested"
+        ):
+            chunks_cnt = self.managers["ingestion"].ingest_pipelined(
+                (_source(loader_init) for loader_init in loader_inits),
+                batch_size=batch_size,
+                prune_missing=prune_missing,
+                **pipeline_kwargs,
+            )
+        if chunks_cnt:
+            self.managers["cache"].invalidate()
+        return chunks_cnt
+    
+    async def aingest(self, data_url: str, batch_size: int = 20) -> int:
+        """Ingest a single document from s3 url or local path, without blocking the event loop.
+        Loading and ingestion clients are blocking, so they run in a worker thread.
+        """
+        loader = await asyncio.to_thread(PDFWithMetadataLoader, data_url)
+        return await asyncio.to_thread(self.ingest, loader, batch_size)
 
     def upload_data(self, file_path: str, object_location: str, metadata: Optional[dict] = None) -> bool:
         """Uploads data to S3
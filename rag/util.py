@@ -114,24 +114,100 @@ def combine_chunks(chunks: list[Chunk], attach_url=False) -> list[CombinedChunks
     combined_chunks_list = sorted(combined_chunks_list, key=lambda x: x.doc_max_score, reverse=True)
     return combined_chunks_list
 
-def _format_combined_chunks(combined_chunks: list[CombinedChunks]) -> str:
+def _format_doc_header(doc_meta: dict, compact: bool = False) -> str:
+    result = f"--- Document: {doc_meta.get('doc_name', '')} ---\n"
+    if compact and doc_meta.get("version"):
+        result += f"Version: {doc_meta.get('version')}\n"
+    if doc_meta.get("base_doc_id"):
+        result += f"Based on: {doc_meta.get('base_doc_id')}\n"
+    return result
+
+def _format_chunk_compact(chunk: Chunk) -> str:
+    page = chunk.chunk_meta.get("page")
+    return (f"--- Page {page} ---\n" if page else "--- Chunk ---\n") + f"{chunk.text}\n\n"
+
+def _format_combined_chunks(combined_chunks: list[CombinedChunks], compact: bool = False) -> str:
     result = ""
     for combined_chunk in combined_chunks:
-        result += f"--- Document: {combined_chunk.doc_meta.get('doc_name', '')} ---\n"
-        if combined_chunk.doc_meta.get("base_doc_id"):
-            result += f"Based on: {combined_chunk.doc_meta.get('base_doc_id')}\n"
+        result += _format_doc_header(combined_chunk.doc_meta, compact)
+        if compact:
+            # scores and metadata reprs cost tokens without helping the answer
+            result += "\n"
+            for chunk in combined_chunk.chunks:
+                result += _format_chunk_compact(chunk)
+            continue
         result += f"Average Score: {combined_chunk.doc_mean_score}\n"
         result += f"DOC META:\n {combined_chunk.doc_meta}\n\n"
         for chunk in combined_chunk.chunks:
             result += f"{chunk.detail(doc_meta=False)}\n\n"
     return result
 
-def format_chunks_single_context(chunks: list[Chunk]) -> str:
+def _line_key(line: str) -> str:
+    return " ".join(line.split())
+
+def _dedupe_lines(text: str, seen: set[str], min_chars: int) -> str:
+    """Drop the lines already packed from the same document, e.g. elements duplicated by the overlap loader"""
+    lines, keys = [], set()
+    for line in text.splitlines():
+        key = _line_key(line)
+        if len(key) >= min_chars:
+            if key in seen or key in keys:
+                continue
+            keys.add(key)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def pack_chunks(chunks: list[Chunk], token_budget: int, dedupe_min_chars: int = 20, min_trim_tokens: int = 64) -> list[Chunk]:
+    """Select the chunks fitting in the token budget of the context, greedily by score.
+    Lines repeated within a document are kept only in the best chunk, and a chunk exceeding the remaining budget is trimmed,
+    if at least `min_trim_tokens` tokens remain.
+
+    Args:
+        chunks (list[Chunk]): retrieved chunks
+        token_budget (int): maximum number of tokens of the formatted chunks (compact format)
+        dedupe_min_chars (int): minimum length of the deduplicated lines. Shorter lines, e.g. list items, may legitimately repeat
+        min_trim_tokens (int): minimum number of tokens of a trimmed chunk
+
+    Returns:
+        list[Chunk]: packed chunks, in the order of the score
+    """
+    from rag.component.llm.ratelimit import estimate_tokens, truncate_tokens
+
+    packed: list[Chunk] = []
+    packed_docs: set[str] = set()
+    seen_lines: dict[str, set[str]] = {}
+    remaining = token_budget
+    for chunk in sorted(chunks, key=lambda c: c.score, reverse=True):
+        # the document header is paid by the first packed chunk of the document
+        header_tokens = 0 if chunk.doc_id in packed_docs else estimate_tokens(_format_doc_header(chunk.doc_meta, compact=True) + "\n")
+        seen = seen_lines.setdefault(chunk.doc_id, set())
+        text = _dedupe_lines(chunk.text, seen, dedupe_min_chars)
+        if not text:
+            continue
+
+        tokens = header_tokens + estimate_tokens(_format_chunk_compact(chunk.model_copy(update={"text": text})))
+        if tokens > remaining:
+            overhead = tokens - estimate_tokens(text)
+            # the best chunk is trimmed to whatever fits, so that the context is never empty
+            if remaining - overhead < (min_trim_tokens if packed else 1):
+                continue
+            text = truncate_tokens(text, remaining - overhead)
+            tokens = remaining
+
+        seen.update(_line_key(line) for line in text.splitlines())
+        packed.append(chunk.model_copy(update={"text": text}))
+        packed_docs.add(chunk.doc_id)
+        remaining -= tokens
+        if remaining < min_trim_tokens:
+            break
+    return packed
+
+def format_chunks_single_context(chunks: list[Chunk], compact: bool = False) -> str:
     combined_chunks = combine_chunks(chunks)
     
-    return _format_combined_chunks(combined_chunks)
+    return _format_combined_chunks(combined_chunks, compact)
 
-def format_chunks_hierarchy_context(chunks: list[Chunk], ascending_additional: bool=True) -> str:
+def format_chunks_hierarchy_context(chunks: list[Chunk], ascending_additional: bool=True, compact: bool = False) -> str:
     combined_chunks = combine_chunks(chunks)
     context = {
         "base": "",
@@ -142,11 +218,11 @@ def format_chunks_hierarchy_context(chunks: list[Chunk], ascending_additional: b
     additional_chunks = [chunk for chunk in combined_chunks if chunk.doc_meta.get("doc_type") == "additional"]
     
     # base
-    context["base"] = _format_combined_chunks(base_chunks)
+    context["base"] = _format_combined_chunks(base_chunks, compact)
     
     # additional
     additional_chunks.sort(key=lambda x: x.doc_max_score, reverse=not ascending_additional) # resolve lost in middle problem
-    context["additional"] = _format_combined_chunks(additional_chunks)
+    context["additional"] = _format_combined_chunks(additional_chunks, compact)
     
     context_str = (
         "<base-context>\n"
@@ -158,11 +234,20 @@ def format_chunks_hierarchy_context(chunks: list[Chunk], ascending_additional: b
     )
     return context_str
 
-def format_chunks(chunks: list[Chunk], use_hierarchy=False) -> str:
+def format_chunks(chunks: list[Chunk], use_hierarchy=False, token_budget: Optional[int] = None) -> str:
+    """Format the chunks into the context of the prompt.
+    If `token_budget` is provided, chunks are packed into the budget (see `pack_chunks`) and formatted compactly, without the scores and metadata.
+    """
+    compact = token_budget is not None
+    if compact:
+        from rag.component.llm.ratelimit import estimate_tokens
+        # tags of the hierarchy context are out of the chunks
+        reserved = estimate_tokens(format_chunks_hierarchy_context([])) if use_hierarchy else 0
+        chunks = pack_chunks(chunks, token_budget - reserved)
     if use_hierarchy:
-        return format_chunks_hierarchy_context(chunks)
+        return format_chunks_hierarchy_context(chunks, compact=compact)
     else:
-        return format_chunks_single_context(chunks)
+        return format_chunks_single_context(chunks, compact=compact)
 
 def format_history(history: list[ChatLog]) -> str:
     return "\n".join([f"{item['role'].upper()}: {item['content']}" for item in history])
@@ -241,11 +326,26 @@ def persistent_metadata_handler(
         persistent_metadata = {}
     return persistent_metadata, {}
 
+def page_chunk_id(doc_id: str, page: Any, ordinal: int = 0) -> str:
+    """Deterministic id of the `ordinal`-th chunk loaded from a page, so that re-ingesting a page overwrites its vectors"""
+    if ordinal == 0:
+        return generate_id(f"{doc_id}:{page}")
+    return generate_id(f"{doc_id}:{page}:{ordinal}")
+
 def doc_to_chunk(
     document: Document,
     *,
     metadata_handler: Optional[Callable[[dict], tuple[dict, dict]]] = None,
+    page_ordinals: Optional[dict[tuple[str, Any], int]] = None,
 ) -> Chunk:
+    """Convert a langchain document into a chunk
+
+    Args:
+        document (Document): loaded document
+        metadata_handler (Optional[Callable[[dict], tuple[dict, dict]]]): splits the metadata into doc_meta and chunk_meta, on top of the default handler
+        page_ordinals (Optional[dict[tuple[str, Any], int]]): number of chunks converted so far per (doc_id, page), shared across the documents of a loader.
+            Loaders emitting several documents per page (e.g. element-split loaders) need it for the chunk ids to be unique
+    """
     if metadata_handler is None:
         final_metadata_handler = _default_metadata_handler
     else:
@@ -262,7 +362,15 @@ def doc_to_chunk(
         msg.warn(f"Failed to handle metadata: {e}. Using default metadata handler.")
         doc_meta, chunk_meta = _default_metadata_handler(document.metadata)
 
-    chunk_id = str(uuid.uuid4())
+    if (page := chunk_meta.get("page")) is not None:
+        ordinal = 0
+        if page_ordinals is not None:
+            key = (doc_meta["doc_id"], page)
+            ordinal = page_ordinals.get(key, 0)
+            page_ordinals[key] = ordinal + 1
+        chunk_id = page_chunk_id(doc_meta["doc_id"], page, ordinal)
+    else:
+        chunk_id = str(uuid.uuid4())
     chunk = Chunk(
         text=document.page_content,
         doc_id=doc_meta["doc_id"],
@@ -395,6 +503,16 @@ def save_to_local(content: Any, file_path: str) -> bool:
         return False
     return True
 
+def batched(iterable: Iterable[Any], batch_size: int) -> Iterable[list[Any]]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def execute_as_batch(
     iterable: Iterable[Any], 
     batch_size: int = 10,
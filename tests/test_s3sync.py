@@ -0,0 +1,62 @@
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from rag.component import s3sync
+
+BUCKET = "spec-bucket"
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        client.put_object(Bucket=BUCKET, Key="specs/", Body=b"")
+        client.put_object(Bucket=BUCKET, Key="specs/major.pdf", Body=b"%PDF-1.4 major")
+        client.put_object(Bucket=BUCKET, Key="specs/major.pdf.metadata.json", Body=json.dumps({"version": "1.0"}).encode())
+        client.put_object(Bucket=BUCKET, Key="specs/minor.pdf", Body=b"%PDF-1.4 minor")
+        client.put_object(Bucket=BUCKET, Key="specs/minor.pdf.metadata.json", Body=json.dumps({"version": "0.1"}).encode())
+        yield client
+
+def _sync(s3_client, to_dir, **kwargs) -> list[str]:
+    return s3sync.sync_from_s3(str(to_dir), s3_client=s3_client, bucket_name=BUCKET, max_workers=2, **kwargs)
+
+def test_first_sync_downloads_all(s3_client, tmp_path):
+    changed = _sync(s3_client, tmp_path)
+
+    assert sorted(changed) == [
+        "specs/major.pdf", "specs/major.pdf.metadata.json", "specs/minor.pdf", "specs/minor.pdf.metadata.json",
+    ]
+    assert (tmp_path / "specs/major.pdf").read_bytes() == b"%PDF-1.4 major"
+    assert not list(tmp_path.rglob("*.part"))
+
+    metadata = json.loads((tmp_path / "specs/major.pdf.metadata.json").read_text())
+    assert metadata["doc_id"] == f"s3://{BUCKET}/specs/major.pdf"
+
+    manifest = s3sync.load_sync_manifest(str(tmp_path))
+    assert set(manifest) == {"specs/major.pdf", "specs/major.pdf.metadata.json", "specs/minor.pdf", "specs/minor.pdf.metadata.json"}
+
+def test_resync_is_noop(s3_client, tmp_path):
+    _sync(s3_client, tmp_path)
+    mtime = os.path.getmtime(tmp_path / "specs/major.pdf")
+
+    assert _sync(s3_client, tmp_path) == []
+    assert os.path.getmtime(tmp_path / "specs/major.pdf") == mtime
+
+def test_changed_etag_is_downloaded_again(s3_client, tmp_path):
+    _sync(s3_client, tmp_path)
+    s3_client.put_object(Bucket=BUCKET, Key="specs/minor.pdf", Body=b"%PDF-1.4 minor, revised")
+
+    assert _sync(s3_client, tmp_path) == ["specs/minor.pdf"]
+    assert (tmp_path / "specs/minor.pdf").read_bytes() == b"%PDF-1.4 minor, revised"
+
+    manifest = s3sync.load_sync_manifest(str(tmp_path))
+    etag = s3_client.head_object(Bucket=BUCKET, Key="specs/minor.pdf")["ETag"].strip('"')
+    assert manifest["specs/minor.pdf"]["etag"] == etag
+
+def test_sync_all_ignores_manifest(s3_client, tmp_path):
+    _sync(s3_client, tmp_path)
+    assert len(_sync(s3_client, tmp_path, ignore_existing=False)) == 4
@@ -0,0 +1,92 @@
+import re, time, argparse
+from datetime import datetime
+
+from wasabi import msg
+
+from rag.component.tracing.TraceStore import get_trace_store
+from rag.component.tracing.report import stage_stats
+from rag import util
+
+parser = argparse.ArgumentParser(description="Report latency percentiles per stage from the trace store")
+parser.add_argument(
+    "-s",
+    "--store",
+    type=str,
+    metavar="",
+    required=False,
+    help="Path of the trace store (.sqlite or .jsonl). Default: global.trace_path of config/config.json",
+    default=None,
+)
+parser.add_argument(
+    "--since",
+    type=str,
+    metavar="",
+    required=False,
+    help="Start of the time window. Duration before now (e.g. 30m, 1h, 7d) or ISO datetime. Default: 1h",
+    default="1h",
+)
+parser.add_argument(
+    "--until",
+    type=str,
+    metavar="",
+    required=False,
+    help="End of the time window, in the same format as --since. Default: now",
+    default=None,
+)
+parser.add_argument(
+    "--stage",
+    type=str,
+    metavar="",
+    required=False,
+    help="Report only the stages starting with the prefix, e.g. transform",
+    default=None,
+)
+
+def parse_time(value: str) -> float:
+    if (match := re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value)):
+        amount, unit = match.groups()
+        return time.time() - float(amount) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[unit]
+    return datetime.fromisoformat(value).timestamp()
+
+def _format(value, unit=""):
+    if isinstance(value, float):
+        return f"{value:.3f}{unit}"
+    return "" if value is None else str(value)
+
+def main():
+    args = parser.parse_args()
+    store_path = args.store or util.load_config().get("global", {}).get("trace_path")
+    if store_path is None:
+        msg.fail("Trace store not provided. Set --store or global.trace_path of the config")
+        return
+
+    store = get_trace_store(store_path)
+    spans = store.read(since=parse_time(args.since), until=parse_time(args.until) if args.until else None)
+    if args.stage:
+        spans = [span for span in spans if span["name"].startswith(args.stage)]
+    if not spans:
+        msg.warn(f"No spans found in {store_path} within the window")
+        return
+
+    stats = stage_stats(spans)
+    rows = []
+    for name, stat in stats.items():
+        # throughput is not a latency
+        unit = "" if name.endswith("tokens_per_s") else "s"
+        rows.append([
+            name,
+            stat["count"],
+            _format(stat["p50"], unit),
+            _format(stat["p95"], unit),
+            _format(stat["p99"], unit),
+            _format(stat["mean"], unit),
+            _format(stat.get("prompt_tokens")),
+            _format(stat.get("completion_tokens")),
+            _format(stat.get("cost")),
+        ])
+    traces = len({span["trace_id"] for span in spans})
+    msg.info(f"{traces} traces, {len(spans)} spans")
+    msg.table(rows, header=["stage", "count", "p50", "p95", "p99", "mean", "prompt tokens", "completion tokens", "cost ($)"], divider=True)
+
+if __name__ == "__main__":
+    main()